@@ -7,19 +7,30 @@ import sys
 from gemini_schema import PlayerState, RoomState
 import logging
 from prompts import GAME_START_PROMPTS, NARRATIVE_PROMPTS, PLAYER_UPDATE_PROMPTS, DICE_ROLL_PROMPTS, COMBAT_PROMPTS
-from character_config import get_race_stats, get_class_bonuses, get_enemy, ENEMIES, RACE_CONFIGS, CLASS_CONFIGS, calculate_ability_modifier, get_saving_throw
+from character_config import get_race_stats, get_class_bonuses, get_enemy, ENEMIES, RACE_CONFIGS, CLASS_CONFIGS, calculate_ability_modifier, get_saving_throw, get_character_stats
 from pathlib import Path
-from logging.handlers import TimedRotatingFileHandler
 from datetime import datetime
 from translations import load_translations
+from save_format import write_save, read_save, find_save, SAVE_SUFFIX, LEGACY_SUFFIX
+from save_index import SaveIndex
+from logging_setup import setup_logging, sampled_prompt
+from metrics import STAGE_SECONDS
+from token_budget import ledger, estimate_tokens, MAX_HISTORY_MESSAGES
+import time
 
-# Add this at the top of the file, before the DnDGame class
-class GetRoomStateFilter(logging.Filter):
-    def filter(self, record):
-        return "GET /get_room_state" not in record.getMessage()
+def history_message_id(msg):
+    """ID of a room history entry, which may be a RoomMessage or a plain dict"""
+    return msg.get('id') if isinstance(msg, dict) else msg.id
+
+def history_after(history, through):
+    """History entries newer than message `through`; entries without an ID are kept"""
+    if through is None:
+        return list(history)
+    return [msg for msg in history if history_message_id(msg) is None or history_message_id(msg) > through]
 
 class DnDGame:
     def __init__(self, language="en"):
+        started = time.perf_counter()
         load_dotenv()
         self.setup_logging()
         
@@ -51,50 +62,16 @@ class DnDGame:
         
         # Initialize chat immediately
         self.initialize_chat()
+        STAGE_SECONDS.observe(time.perf_counter() - started, stage='game_init')
 
     def setup_logging(self):
         """Set up logging configuration"""
-        # Get the root logger that was configured in app.py
-        root_logger = logging.getLogger()
-        
         # Create a child logger for this class
         self.logger = logging.getLogger(__name__)
-        
-        # If root logger has no handlers (app.py logging not initialized),
-        # set up basic logging
-        if not root_logger.handlers:
-            # Create logs directory if it doesn't exist
-            logs_dir = Path("logs")
-            logs_dir.mkdir(exist_ok=True)
-            
-            # Create formatters
-            detailed_formatter = logging.Formatter(
-                '%(asctime)s - %(levelname)s - %(message)s',
-                datefmt='%Y-%m-%d %H:%M:%S'
-            )
-            
-            # Create file handler with daily rotation
-            log_file = logs_dir / "game.log"
-            file_handler = TimedRotatingFileHandler(
-                log_file,
-                when="midnight",
-                interval=1,
-                backupCount=30  # Keep 30 days of logs
-            )
-            file_handler.setLevel(logging.INFO)
-            file_handler.setFormatter(detailed_formatter)
-            file_handler.addFilter(GetRoomStateFilter())
-            
-            # Create console handler
-            console_handler = logging.StreamHandler()
-            console_handler.setLevel(logging.DEBUG)
-            console_handler.setFormatter(detailed_formatter)
-            console_handler.addFilter(GetRoomStateFilter())
-            
-            # Configure root logger
-            root_logger.setLevel(logging.DEBUG)
-            root_logger.addHandler(file_handler)
-            root_logger.addHandler(console_handler)
+
+        # Standalone use (app.py not imported): install the shared pipeline
+        if not logging.getLogger().handlers:
+            setup_logging()
 
     def initialize_chat(self):
         """Initialize chat with language-specific system prompt"""
@@ -179,12 +156,12 @@ Response Format:
                 "success": success
             }
             self.logger.info(
-                f"Rolling a d{dice_sides}. Ability Check: {is_ability_check}; "
-                f"Dice type: {dice_type}; "
-                f"Ability Modifier: {ability_modifier if ability_modifier is not None else 0}; "
-                f"Proficiency bonus applied: {proficiency_bonus}; "
-                f"Reason: '{reason}'; Base roll: {base_roll}; Total bonus: {bonus}; Final total: {total}; "
-                f"Difficulty: {difficulty}; Success: {success}"
+                "Rolling a d%s. Ability Check: %s; Dice type: %s; Ability Modifier: %s; "
+                "Proficiency bonus applied: %s; Reason: '%s'; Base roll: %s; Total bonus: %s; "
+                "Final total: %s; Difficulty: %s; Success: %s",
+                dice_sides, is_ability_check, dice_type,
+                ability_modifier if ability_modifier is not None else 0,
+                proficiency_bonus, reason, base_roll, bonus, total, difficulty, success
             )
             self.last_dice_roll = total
             self.dice_roll_needed = False
@@ -199,13 +176,13 @@ Response Format:
         if not state_update:
             return
             
-        self.logger.info(f"Updating state with: {state_update}")
+        self.logger.info("Updating state with: %s", state_update)
         old_hp = self.health_points
             
         # Update basic stats if provided
         if 'health_points' in state_update:
             self.health_points = state_update['health_points']
-            self.logger.info(f"Health changed from {old_hp} to {self.health_points}")
+            self.logger.info("Health changed from %s to %s", old_hp, self.health_points)
         if 'gold' in state_update:
             self.gold = state_update['gold']
         if 'damage' in state_update:
@@ -275,9 +252,32 @@ Response Format:
             'ability_scores': self.get_ability_scores()
         }
 
+    @staticmethod
+    def format_history_entry(msg):
+        """One room message as it appears in the prompt's history section"""
+        if isinstance(msg, dict):
+            if msg.get('type') == 'player':
+                entry = f"{msg.get('player_name', 'Player')}: {msg.get('user_message', '')}\n"
+                if msg.get('dm_response'):
+                    entry += f"DM: {msg.get('dm_response')}\n"
+                return entry
+            if msg.get('type') == 'dm':
+                return f"DM: {msg.get('message', '')}\n"
+            if msg.get('type') == 'system':
+                return f"System: {msg.get('message', '')}\n"
+            return ""
+        if msg.player_name:
+            entry = f"{msg.player_name}: {msg.user_message}\n"
+        else:
+            entry = f"Player: {msg.user_message}\n"
+        if msg.dm_response:
+            entry += f"DM: {msg.dm_response}\n"
+        return entry
+
     def send_message(self, message, player_id=None, room_state=None):
         """Send message and get structured response"""
-        self.logger.info(f"\nSending message: {message}")
+        self.logger.info("Sending message: %s", sampled_prompt(message))
+        started = time.perf_counter()
         
         # Build context with current stats
         current_stats = "Current player stats:\n"
@@ -323,38 +323,42 @@ Response Format:
         elif self.in_combat and self.enemy:
             current_stats += f"\nEnemy: {self.enemy['name']} (HP: {self.enemy['hp']})"
         
-        self.logger.debug(f"Current stats:\n{current_stats}")
+        self.logger.debug("Current stats:\n%s", current_stats)
         
-        # Build context from message history
+        # Build context from message history, as much as fits in the room's token budget
+        room_id = getattr(room_state, 'room_id', None)
         context = "Previous messages:\n"
         if room_state and hasattr(room_state, 'message_history'):
-            for msg in room_state.message_history[-10:]:
-                if isinstance(msg, dict):
-                    if msg.get('type') == 'player':
-                        context += f"{msg.get('player_name', 'Player')}: {msg.get('user_message', '')}\n"
-                        if msg.get('dm_response'):
-                            context += f"DM: {msg.get('dm_response')}\n"
-                    elif msg.get('type') == 'dm':
-                        context += f"DM: {msg.get('message', '')}\n"
-                    elif msg.get('type') == 'system':
-                        context += f"System: {msg.get('message', '')}\n"
-                else:
-                    if msg.player_name:
-                        context += f"{msg.player_name}: {msg.user_message}\n"
-                    else:
-                        context += f"Player: {msg.user_message}\n"
-                    if msg.dm_response:
-                        context += f"DM: {msg.dm_response}\n"
+            history = room_state.message_history
+            summary = getattr(room_state, 'summary', '')
+            if summary:
+                # Turns folded into the summary are sent as the summary only
+                history = history_after(history, room_state.summary_through)
+                context = f"Story so far:\n{summary}\n\n{context}"
+            entries = [self.format_history_entry(msg) for msg in history[-MAX_HISTORY_MESSAGES:]]
+            entries, omitted = ledger.fit_history(room_id, f"{current_stats}{context}{message}", entries)
+            if omitted:
+                context += f"({omitted} earlier messages omitted)\n"
+            context += "".join(entries)
         else:
             self.logger.warning("No message history found in room_state")
             context += "No previous messages available.\n"
         
         full_message = f"{current_stats}\n{context}\nCurrent message: {message}"
-        self.logger.debug(f"Full message to Gemini:\n{full_message}")
+        STAGE_SECONDS.observe(time.perf_counter() - started, stage='prompt_build')
+        self.logger.debug("Full message to Gemini:\n%s", sampled_prompt(full_message))
         
         # Send message to Gemini and get response in new format
-        response = self.chat.send_structured_message(full_message)
-        self.logger.info(f"Gemini response: {response}")
+        response = self.chat.send_structured_message(full_message, room_id=room_id)
+        self.logger.info("Gemini response: %s", sampled_prompt(response))
+        if self.chat.last_usage is not None:
+            usage = self.chat.last_usage
+            estimated_prompt = estimate_tokens(full_message) + estimate_tokens(self.chat.system_instruction)
+            ledger.record(room_id, self.chat.key_label, usage, estimated_prompt=estimated_prompt)
+            self.logger.info("Gemini usage: %s prompt + %s output tokens%s", usage.prompt_tokens,
+                             usage.output_tokens, " (estimated)" if usage.estimated else "",
+                             extra={'room_id': room_id, 'prompt_tokens': usage.prompt_tokens,
+                                    'output_tokens': usage.output_tokens})
         
         # Extract the required fields from the response
         message_text = response.get('message', '')
@@ -528,23 +532,24 @@ Response Format:
     def save_game(self, save_name="quicksave"):
         """Save current game state"""
         save_data = self.get_state_dict()
-        save_path = os.path.join(self.save_folder, f"{save_name}.json")
+        save_path = os.path.join(self.save_folder, f"{save_name}{SAVE_SUFFIX}")
         
-        with open(save_path, 'w', encoding='utf-8') as f:
-            json.dump(save_data, f, ensure_ascii=False, indent=4)
+        write_save(save_path, save_data)
+        # A legacy JSON save with the same name is superseded now
+        Path(save_path).with_suffix(LEGACY_SUFFIX).unlink(missing_ok=True)
+        SaveIndex.for_folder(self.save_folder).add(save_name, save_path, save_data)
         
-        return f"Game saved to {save_name}.json"
+        return f"Game saved to {save_name}{SAVE_SUFFIX}"
 
     def load_game(self, save_name="quicksave"):
         """Load saved game state"""
-        save_path = os.path.join(self.save_folder, f"{save_name}.json")
+        save_path = find_save(self.save_folder, save_name)
         
-        if not os.path.exists(save_path):
+        if save_path is None:
             return "Save file not found!"
             
         try:
-            with open(save_path, 'r', encoding='utf-8') as f:
-                save_data = json.load(f)
+            save_data = read_save(save_path)
             
             self.load_state_from_dict(save_data)
             return "Game successfully loaded!"
@@ -553,7 +558,8 @@ Response Format:
 
     def list_saves(self):
         """List available save files"""
-        saves = [f.replace('.json', '') for f in os.listdir(self.save_folder) if f.endswith('.json')]
+        _, entries = SaveIndex.for_folder(self.save_folder).query(kind='game', limit=100)
+        saves = [entry['name'] for entry in entries]
         if not saves:
             return "No save files found!"
         saves_list = "\n".join(saves)
@@ -577,37 +583,16 @@ Response Format:
             self.logger.error("Cannot initialize character without race and class")
             raise ValueError("Race and class must be set before initializing character")
             
-        # Get base stats from race
-        race_stats = get_race_stats(self.player_race)
-        self.health_points = race_stats['hp']
-        self.gold = race_stats['gold']
-        # Parse damage range from string (e.g., "2-7")
-        damage_range = race_stats['damage'].split('-')
-        self.damage = int(damage_range[1])  # Use the max damage as base damage
-            
-        # Apply class bonuses
-        class_bonuses = get_class_bonuses(self.player_class)
-        self.health_points += class_bonuses['hp_bonus']
-        self.gold += class_bonuses['gold_bonus']
-        self.magic_1lvl = class_bonuses['magic']  # Base magic slots from class
-        self.magic_2lvl = max(0, class_bonuses['magic'] - 1)  # One less 2nd level slot than 1st level
-        
-        self.level = 1
-        defaults = CLASS_CONFIGS.get(self.player_class, {}).get("default_stats", {
-            "strength": 10,
-            "dexterity": 10,
-            "constitution": 10,
-            "intelligence": 10,
-            "wisdom": 10,
-            "charisma": 10
-        })
-        race_bonus = RACE_CONFIGS.get(self.player_race, {}).get("ability_scores", {})
-        self.strength = defaults.get("strength", 10) + race_bonus.get("strength", 0)
-        self.dexterity = defaults.get("dexterity", 10) + race_bonus.get("dexterity", 0)
-        self.constitution = defaults.get("constitution", 10) + race_bonus.get("constitution", 0)
-        self.intelligence = defaults.get("intelligence", 10) + race_bonus.get("intelligence", 0)
-        self.wisdom = defaults.get("wisdom", 10) + race_bonus.get("wisdom", 0)
-        self.charisma = defaults.get("charisma", 10) + race_bonus.get("charisma", 0)
+        # Starting stats come from the precomputed race x class table
+        stats = get_character_stats(self.player_race, self.player_class)
+        self.health_points = stats['health_points']
+        self.gold = stats['gold']
+        self.damage = stats['damage']
+        self.magic_1lvl = stats['magic_1lvl']
+        self.magic_2lvl = stats['magic_2lvl']
+        self.level = stats['level']
+        for ability, score in stats['ability_scores'].items():
+            setattr(self, ability, score)
         
         self.logger.info(f"Character initialized: {self.player_race} {self.player_class}")
         self.update_system_prompt()
@@ -1,20 +1,33 @@
 from dotenv import load_dotenv
 load_dotenv()
 
-from flask import Flask, render_template, request, jsonify, session, Response, send_from_directory
+from flask import Flask, render_template, request, jsonify, session, Response, send_from_directory, g, url_for
 from DEF import DnDGame
 from character_config import (RACE_STATS, CLASS_BONUSES, RACE_TRANSLATIONS, CLASS_TRANSLATIONS,
-                            RACE_CONFIGS, CLASS_CONFIGS, calculate_ability_modifier)
+                            RACE_CONFIGS, CLASS_CONFIGS, calculate_ability_modifier,
+                            canonical_race, canonical_class,
+                            get_character_stats, CHARACTER_TABLE_JSON, CHARACTER_TABLE_ETAG)
 from room_manager import RoomManager
+from sqlite_room_manager import SQLiteRoomManager
+from translations import catalog as translation_catalog
+from serialization import FastJSONProvider, player_fragment, dumps as dumps_json
+from logging_setup import setup_logging
+from summarizer import RoomSummarizer
+from llm_jobs import JobStore, LLMJobQueue, QueueFull
+from narration_prefetch import NarrationPrefetch, PREFETCH_WAIT
+from fair_scheduler import SchedulerFull
+from broadcast import RoomBroadcaster, SSE_HEADERS
+from player_updates import apply_player_updates, ROLL_FIELD_MAP
+import metrics
+import hmac
 import os
+import secrets
 import json
+import time
 import uuid
 import logging
-from logging.handlers import TimedRotatingFileHandler
 from pathlib import Path
 from datetime import datetime
-from threading import Lock
-from gemini_schema import PlayerState
 from pydantic import Extra, BaseModel
 from typing import Optional
 
@@ -26,91 +39,85 @@ def _patched_init(self, *args, **kwargs):
          self.system_prompt += "\nNote: Do not change player's HP unless necessary due to explicit combat events. Only update HP when it is clearly altered by combat damage or healing."
 DnDGame.__init__ = _patched_init
 
-# Create a custom filter to exclude get_room_state messages
-class GetRoomStateFilter(logging.Filter):
-    def filter(self, record):
-        return "GET /get_room_state" not in record.getMessage()
-
-# Configure logging
-def setup_logging():
-    # Create logs directory if it doesn't exist
-    logs_dir = Path("logs")
-    logs_dir.mkdir(exist_ok=True)
-    
-    # Create formatters
-    detailed_formatter = logging.Formatter(
-        '%(asctime)s - %(levelname)s - %(message)s',
-        datefmt='%Y-%m-%d %H:%M:%S'
-    )
-    
-    # Create file handler with daily rotation
-    log_file = logs_dir / "game.log"
-    file_handler = TimedRotatingFileHandler(
-        log_file,
-        when="midnight",
-        interval=1,
-        backupCount=30  # Keep 30 days of logs
-    )
-    file_handler.setLevel(logging.INFO)
-    file_handler.setFormatter(detailed_formatter)
-    file_handler.addFilter(GetRoomStateFilter())
-    
-    # Create console handler
-    console_handler = logging.StreamHandler()
-    console_handler.setLevel(logging.DEBUG)
-    console_handler.setFormatter(detailed_formatter)
-    console_handler.addFilter(GetRoomStateFilter())
-    
-    # Configure root logger
-    root_logger = logging.getLogger()
-    root_logger.setLevel(logging.DEBUG)
-    
-    # Remove any existing handlers
-    root_logger.handlers = []
-    
-    # Add the handlers
-    root_logger.addHandler(file_handler)
-    root_logger.addHandler(console_handler)
-    
-    # Log startup message
-    root_logger.info("Game server starting up...")
-
 # Set up logging before creating the app
 setup_logging()
+logging.getLogger().info("Game server starting up...")
 
 app = Flask(__name__)
-app.secret_key = os.urandom(24)  # For session management
+app.json = FastJSONProvider(app)
+# For session management; set SECRET_KEY so every worker process accepts the same cookies
+app.secret_key = os.getenv('SECRET_KEY') or os.urandom(24)
+
+# ROOM_BACKEND=sqlite shares rooms between worker processes (e.g. gunicorn -w 4)
+ROOM_IDLE_MINUTES = int(os.getenv('ROOM_IDLE_MINUTES', 60))
+ROOM_DB_PATH = os.getenv('ROOM_DB_PATH', 'saves/rooms.db')
+if os.getenv('ROOM_BACKEND') == 'sqlite':
+    room_manager = SQLiteRoomManager(ROOM_DB_PATH, idle_minutes=ROOM_IDLE_MINUTES)
+else:
+    room_manager = RoomManager(idle_minutes=ROOM_IDLE_MINUTES,
+                               max_resident_rooms=int(os.getenv('ROOM_MAX_RESIDENT', 1000)))
+
+# Idle rooms are spilled to saves/ and evicted from memory in the background
+room_manager.start_reaper(int(os.getenv('ROOM_REAPER_INTERVAL', 60)))
+
+# Long transcripts are folded into a running summary off the request path
+summarizer = RoomSummarizer(room_manager)
 
-room_manager = RoomManager()
-room_locks = {}  # Dictionary to store room locks
+# DM turns requested with "async": true run here instead of on the request thread;
+# with several workers their states go through the shared database, so any worker can report them
+llm_jobs = LLMJobQueue(store=JobStore(ROOM_DB_PATH) if isinstance(room_manager, SQLiteRoomManager) else None)
+# DM narrations of dice rolls, started by /roll_dice ahead of /process_roll
+narration_prefetch = NarrationPrefetch(llm_jobs)
+
+# Room gauges and the room manager's own counters, read when /metrics is scraped
+metrics.REGISTRY.gauge('dnd_rooms_live', 'Rooms currently held by the room manager',
+                       lambda: room_manager.get_stats()['rooms_live'])
+metrics.REGISTRY.gauge('dnd_players_live', 'Players in the rooms held by the room manager',
+                       lambda: room_manager.get_stats()['players_live'])
+for _stat in ('rooms_evicted', 'rooms_spilled', 'rooms_hydrated', 'bytes_reclaimed'):
+    metrics.REGISTRY.counter_func(f'dnd_{_stat}_total', f'Room manager {_stat.replace("_", " ")} counter',
+                                  lambda stat=_stat: room_manager.get_stats()[stat])
 
 @app.before_request
 def set_default_language():
     if 'language' not in session:
         session['language'] = 'en'
 
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request_time(response):
+    started = g.get('request_started')
+    if started is not None:
+        endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+        metrics.REQUEST_SECONDS.observe(time.perf_counter() - started, endpoint=endpoint,
+                                        method=request.method, status=response.status_code)
+    return response
+
 def get_room_lock(room_id):
     """Get or create a lock for a room"""
-    if room_id not in room_locks:
-        room_locks[room_id] = Lock()
-    return room_locks[room_id]
+    return metrics.TimedLock(room_manager.room_lock(room_id))
 
-# Store messages for each room
-room_messages = {}
+class RoomConflict(Exception):
+    """A room write was refused: the room is gone, or another writer changed it first"""
 
-class RoomMessage(BaseModel):
-    type: str
-    message: str
-    player_name: Optional[str] = None
-    timestamp: datetime
+def write_room(room):
+    """Store a changed room, raising RoomConflict instead of losing the change silently"""
+    if not room_manager.update_room(room):
+        raise RoomConflict('The room changed or was removed, please try again')
 
-    @property
-    def user_message(self) -> str:
-        return self.message
+@app.errorhandler(RoomConflict)
+def room_conflict(error):
+    return jsonify({'error': str(error)}), 409
 
-    @property
-    def dm_response(self) -> str:
-        return self.message if self.type == 'dm' else ""
+@app.errorhandler(SchedulerFull)
+def scheduler_full(error):
+    """The room already has too many Gemini requests waiting; nothing was posted"""
+    response = jsonify({'error': str(error)})
+    response.headers['Retry-After'] = '2'
+    return response, 503
 
 @app.route('/')
 def index():
@@ -139,9 +146,6 @@ def create_room():
     room_id = room_manager.create_room(player_id, language)
     room = room_manager.join_room(room_id, player_id, player_name)
     
-    # Initialize room messages
-    room_messages[room_id] = []
-    
     session['room_id'] = room_id
     return jsonify({
         'status': 'success',
@@ -160,7 +164,8 @@ def join_room():
     room_id = request.json.get('room_id')
     player_name = request.json.get('player_name', f'Player_{player_id[:6]}')
     
-    logging.info(f"Join room request - Room: {room_id}, Player: {player_name} ({player_id})")
+    logging.info("Join room request - Room: %s, Player: %s (%s)", room_id, player_name, player_id,
+                 extra={'room_id': room_id})
     
     # Get room first to check if it exists
     room = room_manager.get_room(room_id)
@@ -193,19 +198,10 @@ def join_room():
         add_room_message(room_id, f"{player_name} joined the room", 'system')
     
     # Get all existing messages for the new player
-    existing_messages = room_messages.get(room_id, [])
+    existing_messages = room_manager.get_messages(room_id)
     
     # Convert player states to dict with proper translation
-    players_dict = {}
-    for pid, p in room.players.items():
-        player_data = p.model_dump()
-        if p.race and p.class_name:
-            # Translate race and class names if they exist
-            player_data['race'] = RACE_TRANSLATIONS[room.language].get(p.race, p.race)
-            player_data['class_name'] = CLASS_TRANSLATIONS[room.language].get(p.class_name, p.class_name)
-        if hasattr(p, 'ability_scores') and p.ability_scores is not None:
-            player_data['ability_scores'] = p.ability_scores
-        players_dict[pid] = player_data
+    players_dict = {pid: player_fragment(p, room.language).raw for pid, p in room.players.items()}
     
     response_data = {
         'status': 'success',
@@ -217,7 +213,8 @@ def join_room():
         'messages': existing_messages
     }
     
-    logging.info(f"Join room response - Room: {room_id}, Host: {room.host_id}, Players: {list(players_dict.keys())}")
+    logging.info("Join room response - Room: %s, Host: %s, Players: %s", room_id, room.host_id, list(players_dict),
+                 extra={'room_id': room_id})
     
     return jsonify(response_data)
 
@@ -247,43 +244,43 @@ def get_room_state():
         logging.error("Session missing room_id")
         return jsonify({'status': 'error', 'message': 'Not in a room'}), 400
 
-    room = room_manager.get_room(session['room_id'])
+    room_id = session['room_id']
+    
+    # Answer from the revision counter alone while nothing has changed
+    revision = room_manager.revision(room_id)
+    if revision is not None:
+        known = known_revision(room_id)
+        wait = min(max(request.args.get('wait', 0, type=float), 0), LONG_POLL_MAX_SECONDS)
+        if wait and known == revision:
+            revision = room_manager.wait_for_revision(room_id, revision, wait)
+        # A long poll that saw no change answers 304, with or without If-None-Match
+        unchanged = 'wait' in request.args and revision == known
+        if revision is not None and (unchanged or room_etag(room_id, revision) in request.if_none_match):
+            return not_modified(room_id, revision)
+
+    room = room_manager.get_room(room_id)
     if not room:
-        logging.error(f"Room {session['room_id']} not found")
+        logging.error(f"Room {room_id} not found")
         return jsonify({'status': 'error', 'message': 'Room not found'}), 404
 
-    # Get messages since last_message_id if provided
-    last_message_id = request.args.get('last_message_id')
-    messages = []
+    # Clients that speak the delta protocol send the revision they already have
+    if 'since_revision' in request.args:
+        delta = room_state_delta(room, session.get('player_id'), request.args.get('since_revision'),
+                                 request.args.get('last_message_id'))
+        return with_room_etag(jsonify({
+            'status': 'success',
+            'is_host': room.host_id == session.get('player_id'),
+            **delta
+        }), room_id, delta['revision'])
 
-    if session['room_id'] in room_messages:
-        if last_message_id is None:
-            # First time getting messages, get more message history (50 instead of 5)
-            messages = room_messages[session['room_id']][-50:]
-        else:
-            # Get only new messages since last_message_id
-            try:
-                last_id = int(last_message_id)
-                messages = [msg for msg in room_messages[session['room_id']]
-                          if msg.get('id', 0) > last_id]
-            except ValueError:
-                logging.error(f"Invalid last_message_id: {last_message_id}")
-                messages = room_messages[session['room_id']][-50:]
+    # Get messages since last_message_id if provided
+    messages = get_new_messages(session['room_id'], request.args.get('last_message_id'))
 
-    # Convert player states to dict with proper translation
-    players_dict = {}
-    for pid, p in room.players.items():
-        player_data = p.model_dump()  # Use model_dump instead of dict
-        if p.race and p.class_name:
-            # Translate race and class names if they exist
-            player_data['race'] = RACE_TRANSLATIONS[room.language].get(p.race, p.race)
-            player_data['class_name'] = CLASS_TRANSLATIONS[room.language].get(p.class_name, p.class_name)
-        if hasattr(p, 'ability_scores') and p.ability_scores is not None:
-            player_data['ability_scores'] = p.ability_scores
-        players_dict[pid] = player_data
+    # Translated players are encoded once per change and reused across polls
+    players_dict = {pid: player_fragment(p, room.language).raw for pid, p in room.players.items()}
 
     # Convert room state with translated player data
-    room_data = room.model_dump()  # Use model_dump instead of dict
+    room_data = room.model_dump(exclude={'players', 'summary', 'summary_through'})
     room_data['players'] = players_dict
 
     response_data = {
@@ -292,12 +289,39 @@ def get_room_state():
         'is_host': room.host_id == session.get('player_id'),
         'player': players_dict.get(session.get('player_id')),
         'messages': messages,
-        'last_message_id': messages[-1].get('id') if messages else None
+        'last_message_id': messages[-1].get('id') if messages else None,
+        'revision': revision
     }
 
-    logging.debug(f"Room state response - Players: {list(players_dict.keys())}")
+    logging.debug("Room state response - Players: %s", players_dict.keys())
 
-    return jsonify(response_data)
+    return with_room_etag(jsonify(response_data), room_id, revision)
+
+# Longest a /get_room_state?wait=... request may block for a change
+LONG_POLL_MAX_SECONDS = float(os.getenv('LONG_POLL_MAX_SECONDS', '25'))
+
+def room_etag(room_id: str, revision: int) -> str:
+    return f"{room_id}.{revision}"
+
+def known_revision(room_id: str) -> Optional[int]:
+    """The revision the client already has, from If-None-Match or since_revision"""
+    for etag in request.if_none_match.as_set():
+        prefix, _, revision = etag.rpartition('.')
+        if prefix == room_id and optional_int(revision) is not None:
+            return int(revision)
+    return optional_int(request.args.get('since_revision'))
+
+def with_room_etag(response, room_id: str, revision: Optional[int]):
+    if revision is not None:
+        response.set_etag(room_etag(room_id, revision))
+    # The body depends on who is asking (is_host, player), not just the URL
+    response.headers['Vary'] = 'Cookie'
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+def not_modified(room_id: str, revision: int):
+    metrics.CACHE_LOOKUPS.inc(cache='room_state_etag', result='hit')
+    return with_room_etag(Response(status=304), room_id, revision)
 
 @app.route('/get_races')
 def get_races():
@@ -338,93 +362,221 @@ def choose_character():
     room_id = session['room_id']
     player_id = session['player_id']
     
-    room = room_manager.get_room(room_id)
-    if not room:
-        return jsonify({'error': 'Room not found'}), 404
-    
-    player = room.players.get(player_id)
-    if not player:
-        return jsonify({'error': 'Player not found'}), 404
-    
     try:
         data = request.get_json()
         race = data.get('race')
         class_name = data.get('class')
         
-        logging.info(f"Received character creation request - Room: {room_id}, Player: {player_id}, Data: {data}")
+        logging.info("Received character creation request - Room: %s, Player: %s, Data: %s", room_id, player_id, data,
+                     extra={'room_id': room_id})
         
-        # Convert race and class names if needed
-        language = room.language
-        logging.info(f"Converting from {language}. Race: {race}, Class: {class_name}")
+        # Convert localized names to their canonical English names
+        race = canonical_race(race) or race
+        class_name = canonical_class(class_name) or class_name
         
-        # Convert localized names to English if needed
-        for eng_name, local_name in RACE_TRANSLATIONS[language].items():
-            if local_name == race:
-                race = eng_name
-                break
+        logging.info("Converted names - Race: %s, Class: %s", race, class_name)
         
-        for eng_name, local_name in CLASS_TRANSLATIONS[language].items():
-            if local_name == class_name:
-                class_name = eng_name
-                break
-        
-        logging.info(f"Converted names - Race: {race}, Class: {class_name}")
-        
-        # Update player state
-        player.race = race
-        player.class_name = class_name
+        with get_room_lock(room_id):
+            try:
+                room, player = room_and_player(room_id, player_id)
+            except LookupError as e:
+                return jsonify({'error': str(e)}), 404
+            
+            # Update player state
+            player.race = race
+            player.class_name = class_name
+            
+            # Copy precomputed starting stats to player state
+            stats = get_character_stats(race, class_name)
+            for field in ('health_points', 'gold', 'damage', 'level', 'magic_1lvl', 'magic_2lvl'):
+                setattr(player, field, stats[field])
+            for ability, score in stats['ability_scores'].items():
+                setattr(player, ability, score)
+            player.ability_scores = dict(stats['ability_scores'])
+            
+            # Update room state
+            write_room(room)
+            
+            # Only generate opening scene if this is the host and game hasn't started
+            context = None
+            if player_id == room.host_id and not room.has_started:
+                context = room.model_copy(deep=True)
         
-        # Initialize character stats
-        game = DnDGame(language=room.language)
-        game.player_race = race
-        game.player_class = class_name
-        game.initialize_character()
-        
-        # Copy stats to player state
-        player.health_points = game.health_points
-        player.gold = game.gold
-        player.damage = game.damage
-        player.level = game.level
-        player.magic_1lvl = game.magic_1lvl
-        player.magic_2lvl = game.magic_2lvl
-        player.strength = game.strength
-        player.dexterity = game.dexterity
-        player.constitution = game.constitution
-        player.intelligence = game.intelligence
-        player.wisdom = game.wisdom
-        player.charisma = game.charisma
-        if player.__pydantic_extra__ is None:
-            object.__setattr__(player, "__pydantic_extra__", {})
-        player.ability_scores = game.get_ability_scores()
-        
-        # Only generate opening scene if this is the host and game hasn't started
         response = None
-        if player_id == room.host_id and not room.has_started:
+        if context is not None:
+            game = DnDGame(language=context.language)
+            game.player_race = race
+            game.player_class = class_name
+            game.initialize_character()
             game.player_id = player_id  # Set player_id
-            game.room_state = room      # Set room_state
+            game.room_state = context   # Set room_state
+            # The room stays unlocked while the DM thinks
             response = game.start_game()
-            room.has_started = True  # Mark game as started
-            # Add opening scene to room messages
-            add_room_message(room_id, "Game started", "system")
-            if response.get('message'):
-                add_room_message(room_id, response['message'], 'dm')
-        
-        # Update room state
-        room_manager.update_room(room)
-        
-        logging.info(f"Character created successfully - Player: {player.name} ({player_id})")
         
-        return jsonify({
-            'status': 'success',
-            'player': player.model_dump(),
-            'room': room.model_dump(),
-            'message': response.get('message', '') if response else ''
-        })
+        with get_room_lock(room_id):
+            try:
+                room, player = room_and_player(room_id, player_id)
+            except LookupError as e:
+                return jsonify({'error': str(e)}), 404
+            
+            # A second request from the host may have started the game meanwhile
+            if response is not None and not room.has_started:
+                room.has_started = True  # Mark game as started
+                # Add opening scene to room messages
+                add_room_message(room_id, "Game started", "system")
+                if response.get('message'):
+                    add_room_message(room_id, response['message'], 'dm')
+                write_room(room)
+            
+            logging.info(f"Character created successfully - Player: {player.name} ({player_id})")
+            
+            return jsonify({
+                'status': 'success',
+                'player': player,
+                'room': room,
+                'message': response.get('message', '') if response else ''
+            })
         
+    except (RoomConflict, SchedulerFull):
+        raise
     except Exception as e:
         logging.error(f"Error creating character: {str(e)}", exc_info=True)
         return jsonify({'error': str(e)}), 500
 
+def load_game_for(room, player) -> DnDGame:
+    """A DnDGame primed with the player's stats and the room's combat state"""
+    game = DnDGame(language=room.language)
+    game.player_race = player.race
+    game.player_class = player.class_name
+    game.health_points = player.health_points
+    game.gold = player.gold
+    game.damage = player.damage
+    game.level = player.level
+    game.magic_1lvl = player.magic_1lvl
+    game.magic_2lvl = player.magic_2lvl
+    game.last_dice_roll = player.last_dice_roll
+    
+    game.in_combat = room.in_combat
+    if room.in_combat:
+        game.enemy = {"name": room.enemy_name, "hp": room.enemy_health} if room.enemy_name else None
+    return game
+
+def room_and_player(room_id: str, player_id: str):
+    """Current room and player, raising LookupError if either is gone"""
+    room = room_manager.get_room(room_id)
+    if not room:
+        raise LookupError('Room not found')
+    player = room.players.get(player_id)
+    if not player:
+        raise LookupError('Player not found')
+    return room, player
+
+def run_game_action(room_id: str, player_id: str, action: str, player_message_id: Optional[int] = None):
+    """Have the DM answer a player's action and apply the outcome to the room.
+
+    Returns the answer fields and the updated room; raises LookupError if the
+    room or player is gone.
+    """
+    with get_room_lock(room_id):
+        room, player = room_and_player(room_id, player_id)
+        game = load_game_for(room, player)
+        
+        # First add the player's action to room messages
+        if player_message_id is None:
+            player_message_id = add_room_message(room_id, action, 'player', player.name)
+        context = room.model_copy(deep=True)
+    
+    # The room stays unlocked while the DM thinks
+    response = game.send_message(action, player_id=player_id, room_state=context)
+    
+    with get_room_lock(room_id):
+        room, player = room_and_player(room_id, player_id)
+        
+        # Then add DM's response if there is one
+        dm_message_id = None
+        if response.get('message'):
+            dm_message_id = add_room_message(room_id, response['message'], 'dm', detailed_result=getattr(player, 'last_dice_detail', None))
+        
+        # Handle player updates if required
+        if response.get('player_update_required'):
+            apply_player_updates(room, response.get('players_update', []))
+        
+        # Handle dice roll request if required
+        if response.get('dice_roll_required'):
+            dice_request = response.get('dice_roll_request', {})
+            player.dice_roll_needed = True
+            if dice_request.get('ability_modifier'):
+                ability_name = dice_request['ability_modifier']
+                proficient = dice_request.get('proficient', False)
+                difficulty = dice_request.get('difficulty')
+                player.dice_type = 'd20'  # Always use d20 for ability checks
+                ability_score = getattr(player, ability_name.lower())
+                player.dice_modifier = {
+                    'modifier': calculate_ability_modifier(ability_score),
+                    'proficient': proficient,
+                    'reason': dice_request.get('reason', ''),
+                    'difficulty': difficulty
+                }
+                response['dice_roll_request'] = {
+                    'dice_type': player.dice_type,
+                    'dice_modifier': player.dice_modifier,
+                    'ability_modifier': ability_name,
+                    'difficulty': difficulty
+                }
+            else:
+                player.dice_type = dice_request.get('dice_type', 'd20')
+                player.dice_modifier = {
+                    'reason': dice_request.get('reason', ''),
+                    'difficulty': dice_request.get('difficulty')
+                }
+                response['dice_roll_request'] = {
+                    'dice_type': player.dice_type,
+                    'dice_modifier': player.dice_modifier,
+                    'difficulty': dice_request.get('difficulty')
+                }
+        else:
+            player.dice_roll_needed = False
+            player.dice_type = None
+            player.dice_modifier = None
+        
+        # Handle combat started flag (placeholder for now)
+        if response.get('combat_started'):
+            room.in_combat = True
+        
+        # Update room state
+        write_room(room)
+        summarizer.maybe_schedule(room)
+        
+        return {
+            'message': response.get('message', ''),
+            'dice_roll_required': response.get('dice_roll_required', False),
+            'dice_roll_request': response.get('dice_roll_request', {}),
+            'player_message_id': player_message_id,
+            'dm_message_id': dm_message_id
+        }, room
+
+def dm_busy(error: QueueFull):
+    response = jsonify({'error': str(error)})
+    response.headers['Retry-After'] = '2'
+    return response, 429
+
+def queue_llm_job(kind: str, room_id: str, player_id: str, fn, *args, key=None, prepare=None):
+    """Run fn on the LLM worker pool and answer 202 with the job id.
+
+    prepare() runs only once the job is accepted, and its result is passed to
+    fn after args.
+    """
+    try:
+        job = llm_jobs.submit(room_id, player_id, kind, lambda *prepared: fn(room_id, player_id, *args, *prepared)[0],
+                              key=key, prepare=prepare)
+    except QueueFull as e:
+        return dm_busy(e)
+    return jsonify({'status': 'queued', 'job_id': job.id}), 202
+
+def job_key(player_id: str, kind: str, *parts):
+    """Jobs a player repeats while the first is still queued (double clicks, resends) share a key"""
+    return (player_id, kind) + tuple(' '.join(str(part).lower().split()) for part in parts)
+
 @app.route('/game_action', methods=['POST'])
 def game_action():
     if 'room_id' not in session or 'player_id' not in session:
@@ -432,137 +584,64 @@ def game_action():
     
     room_id = session['room_id']
     player_id = session['player_id']
+    data = request.get_json()
+    action = data.get('action')
     
-    # Get room lock
-    room_lock = get_room_lock(room_id)
-    
-    with room_lock:
+    if data.get('async'):
+        # Post the player's message right away; the DM answers from the worker pool
         room = room_manager.get_room(room_id)
         if not room:
             return jsonify({'error': 'Room not found'}), 404
-        
         player = room.players.get(player_id)
         if not player:
             return jsonify({'error': 'Player not found'}), 404
-        
-        try:
-            data = request.get_json()
-            action = data.get('action')
-            
-            game = DnDGame(language=room.language)
-            # Load player stats into DnDGame
-            game.player_race = player.race
-            game.player_class = player.class_name
-            game.health_points = player.health_points
-            game.gold = player.gold
-            game.damage = player.damage
-            game.level = player.level
-            game.magic_1lvl = player.magic_1lvl
-            game.magic_2lvl = player.magic_2lvl
-            game.last_dice_roll = player.last_dice_roll
-            
-            # Set game state from room state
-            game.in_combat = room.in_combat
-            if room.in_combat:
-                game.enemy = {"name": room.enemy_name, "hp": room.enemy_health} if room.enemy_name else None
-            
-            # First add the player's action to room messages
-            player_message_id = add_room_message(room_id, action, 'player', player.name)
-            
-            # Send message with room state context
-            response = game.send_message(action, player_id=player_id, room_state=room)
-            
-            # Then add DM's response if there is one
-            dm_message_id = None
-            if response.get('message'):
-                dm_message_id = add_room_message(room_id, response['message'], 'dm', detailed_result=getattr(player, 'last_dice_detail', None))
-            
-            # Handle player updates if required
-            if response.get('player_update_required'):
-                for player_update in response.get('players_update', []):
-                    target_pid = player_update.get('player_id')
-                    if not target_pid or target_pid not in room.players:
-                        continue
-
-                    target_player = room.players[target_pid]
-                    # Update only the allowed stats
-                    if 'health_points' in player_update:
-                        target_player.health_points = player_update['health_points']
-                    if 'gold' in player_update:
-                        target_player.gold = player_update['gold']
-                    if 'damage' in player_update:
-                        target_player.damage = player_update['damage']
-            
-            # Handle dice roll request if required
-            if response.get('dice_roll_required'):
-                dice_request = response.get('dice_roll_request', {})
-                player.dice_roll_needed = True
-                if dice_request.get('ability_modifier'):
-                    ability_name = dice_request['ability_modifier']
-                    proficient = dice_request.get('proficient', False)
-                    difficulty = dice_request.get('difficulty')
-                    player.dice_type = 'd20'  # Always use d20 for ability checks
-                    ability_score = 10
-                    player_data = player.model_dump()
-                    ability_score = player_data[ability_name.lower()]
-                    player.dice_modifier = {
-                        'modifier': calculate_ability_modifier(ability_score),
-                        'proficient': proficient,
-                        'reason': dice_request.get('reason', ''),
-                        'difficulty': difficulty
-                    }
-                    response['dice_roll_request'] = {
-                        'dice_type': player.dice_type,
-                        'dice_modifier': player.dice_modifier,
-                        'ability_modifier': ability_name,
-                        'difficulty': difficulty
-                    }
-                else:
-                    player.dice_type = dice_request.get('dice_type', 'd20')
-                    player.dice_modifier = {
-                        'reason': dice_request.get('reason', ''),
-                        'difficulty': dice_request.get('difficulty')
-                    }
-                    response['dice_roll_request'] = {
-                        'dice_type': player.dice_type,
-                        'dice_modifier': player.dice_modifier,
-                        'difficulty': dice_request.get('difficulty')
-                    }
-            else:
-                player.dice_roll_needed = False
-                player.dice_type = None
-                player.dice_modifier = None
-            
-            # Handle combat started flag (placeholder for now)
-            if response.get('combat_started'):
-                room.in_combat = True
-            
-            # Update room state
-            room_manager.update_room(room)
-            
-            # Get the latest messages for this room
-            latest_messages = get_new_messages(room_id)
-            
-            # Create player data with preserved ability scores
-            player_data = player.model_dump()
-            if not player_data.get('ability_scores') and hasattr(player, 'ability_scores'):
-                player_data['ability_scores'] = player.ability_scores
-            
-            return jsonify({
-                'message': response.get('message', ''),
-                'player': player_data,
-                'room': room.model_dump(),
-                'dice_roll_required': response.get('dice_roll_required', False),
-                'dice_roll_request': response.get('dice_roll_request', {}),
-                'messages': latest_messages,
-                'last_message_id': latest_messages[-1]['id'] if latest_messages else None,
-                'player_message_id': player_message_id,
-                'dm_message_id': dm_message_id
-            })
-            
-        except Exception as e:
-            logging.error(f"Error in game_action: {str(e)}", exc_info=True)
-            return jsonify({'error': str(e)})
+        key = job_key(player_id, 'game_action', action)
+        queued = llm_jobs.find_queued(room_id, key)
+        if queued is not None:
+            # Already waiting for its turn: don't post the message twice
+            return jsonify({'status': 'queued', 'job_id': queued.id, 'collapsed': True}), 202
+        # The message is posted once the job holds its slot, so a 429 posts nothing
+        return queue_llm_job('game_action', room_id, player_id, run_game_action, action, key=key,
+                             prepare=lambda: add_room_message(room_id, action, 'player', player.name))
+    
+    try:
+        result, room = run_game_action(room_id, player_id, action)
+    except LookupError as e:
+        return jsonify({'error': str(e)}), 404
+    except (RoomConflict, SchedulerFull):
+        raise
+    except Exception as e:
+        logging.error(f"Error in game_action: {str(e)}", exc_info=True)
+        return jsonify({'error': str(e)})
+    
+    if 'since_revision' in data:
+        return jsonify({
+            **result,
+            **room_state_delta(room, player_id, data.get('since_revision'), data.get('last_message_id'))
+        })
+    
+    # Get the latest messages for this room
+    latest_messages = get_new_messages(room_id)
+    
+    # Models are encoded natively by the JSON provider, extra attributes included
+    return jsonify({
+        **result,
+        'player': room.players.get(player_id),
+        'room': room,
+        'messages': latest_messages,
+        'last_message_id': latest_messages[-1]['id'] if latest_messages else None
+    })
+
+@app.route('/llm_job/<job_id>')
+def llm_job_status(job_id):
+    """Status and result of a queued LLM job; ?wait=N blocks until it finishes"""
+    job = llm_jobs.get(job_id)
+    if job is None or job.room_id != session.get('room_id'):
+        return jsonify({'error': 'Job not found'}), 404
+    wait = min(max(request.args.get('wait', 0, type=float), 0), LONG_POLL_MAX_SECONDS)
+    if wait:
+        job = llm_jobs.wait(job, wait)
+    return jsonify(job.as_dict())
 
 @app.route('/roll_dice', methods=['POST'])
 def roll_dice():
@@ -585,22 +664,26 @@ def roll_dice():
             return jsonify({'error': 'Player not found'}), 404
         
         game = DnDGame(language=room.language)
+        # Rolls the DM asked for are always followed by /process_roll
+        roll_requested = player.dice_roll_needed
         
         data = request.get_json()
-        logging.info(f"Received dice roll request - Room: {room_id}, Player: {player_id}, Data: {data}")
+        logging.info("Received dice roll request - Room: %s, Player: %s, Data: %s", room_id, player_id, data,
+                     extra={'room_id': room_id})
         dice_type = data.get('dice_type', 'd20')
         
         # Get difficulty from dice roll request if it exists
         difficulty = None
-        if hasattr(player, 'dice_modifier') and player.dice_modifier:
+        if player.dice_modifier:
             difficulty = player.dice_modifier.get('difficulty')
         
         # Check if player has a dice_modifier (for ability check)
-        if len(player.dice_modifier) > 1:
+        if player.dice_modifier and len(player.dice_modifier) > 1:
             modifier = player.dice_modifier.get('modifier', 0)
             proficient = player.dice_modifier.get('proficient', False)
             reason = player.dice_modifier.get('reason', '')
-            logging.info(f"Ability modifier: {modifier}, Proficient: {proficient}, Reason: {reason}, Difficulty: {difficulty}")
+            logging.info("Ability modifier: %s, Proficient: %s, Reason: %s, Difficulty: %s",
+                         modifier, proficient, reason, difficulty)
             roll_result = game.roll_dice(dice_type, ability_modifier=modifier, proficient=proficient, reason=reason, difficulty=difficulty)
         else:
             roll_result = game.roll_dice(dice_type, difficulty=difficulty)
@@ -609,8 +692,9 @@ def roll_dice():
             return jsonify({'error': 'Error rolling dice'}), 400
         
         # Persist the dice roll details into player's state
-        player.last_dice_detail = game.last_dice_detail
-        room_manager.update_room(room)
+        # A copy, so the game object cannot change the player's dict behind its back
+        player.last_dice_detail = dict(game.last_dice_detail)
+        write_room(room)
         
         # Add dice roll to room messages with detailed_result
         success_text = ""
@@ -626,7 +710,7 @@ def roll_dice():
         player.last_dice_roll = roll_result
         player.dice_roll_needed = False
         player.dice_type = None
-        room_manager.update_room(room)
+        write_room(room)
         
         # Construct roll details message for Gemini along with debugging info
         detail = game.last_dice_detail
@@ -642,16 +726,11 @@ def roll_dice():
         # Get the latest messages for this room
         latest_messages = get_new_messages(room_id)
         
-        # Create player data with preserved ability scores
-        player_data = player.model_dump()
-        if not player_data.get('ability_scores') and hasattr(player, 'ability_scores'):
-            player_data['ability_scores'] = player.ability_scores
-        
         response_data = {
             'roll': roll_result,
             'base_roll': detail.get('base_roll'),
             'dice_type': dice_type,
-            'player': player_data,
+            'player': player,
             'messages': latest_messages,
             'last_message_id': latest_messages[-1]['id'] if latest_messages else None,
             'roll_message_id': roll_message_id,
@@ -662,51 +741,22 @@ def roll_dice():
             'difficulty': detail.get('difficulty')
         }
         
+        # The client asks for the narration next; start it now so it is ready by then
+        if roll_requested:
+            narration_prefetch.start(room_id, player_id, (roll_result, dice_type),
+                                     narrate_roll, room_id, player_id, roll_result, dice_type)
+        
         return jsonify(response_data)
 
-@app.route('/process_roll', methods=['POST'])
-def process_roll():
-    if 'room_id' not in session or 'player_id' not in session:
-        return jsonify({'error': 'Not in a room'}), 400
-    
-    room_id = session['room_id']
-    player_id = session['player_id']
-    
-    # Get room lock
-    room_lock = get_room_lock(room_id)
-    
-    with room_lock:
-        room = room_manager.get_room(room_id)
-        if not room:
-            return jsonify({'error': 'Room not found'}), 404
-        
-        player = room.players.get(player_id)
-        if not player:
-            return jsonify({'error': 'Player not found'}), 404
-        
-        data = request.get_json()
-        roll_value = data.get('roll')
-        dice_type = data.get('dice_type', 'd20')
-        
-        game = DnDGame(language=room.language)
-        # Load player stats into DnDGame
-        game.player_race = player.race
-        game.player_class = player.class_name
-        game.health_points = player.health_points
-        game.gold = player.gold
-        game.damage = player.damage
-        game.level = player.level
-        game.magic_1lvl = player.magic_1lvl
-        game.magic_2lvl = player.magic_2lvl
-        game.last_dice_roll = player.last_dice_roll
-        
-        # Set game state from room state
-        game.in_combat = room.in_combat
-        if room.in_combat:
-            game.enemy = {"name": room.enemy_name, "hp": room.enemy_health} if room.enemy_name else None
+def narrate_roll(room_id: str, player_id: str, roll_value, dice_type: str) -> dict:
+    """Ask the DM to narrate the player's last roll, without applying the answer to the room"""
+    with get_room_lock(room_id):
+        room, player = room_and_player(room_id, player_id)
+        game = load_game_for(room, player)
+        context = room.model_copy(deep=True)
         
         # Create detailed dice roll message
-        if hasattr(player, 'dice_modifier') and player.dice_modifier and getattr(player, 'last_dice_detail', None) and 'base_roll' in player.last_dice_detail:
+        if player.dice_modifier and player.last_dice_detail and 'base_roll' in player.last_dice_detail:
             base_roll = player.last_dice_detail.get('base_roll')
             ability_mod = player.last_dice_detail.get('ability_modifier', 0)
             proficient_bonus = player.last_dice_detail.get('proficient_bonus', 0)
@@ -720,19 +770,44 @@ def process_roll():
             detail_msg = f"I rolled a {dice_type}{difficulty_text}: base roll = {base_roll}, ability modifier = {ability_mod}, proficiency bonus = {proficient_bonus}, resulting in total = {total}{success_text}"
         else:
             # Check if we have difficulty and success information even without detailed roll info
-            difficulty = player.last_dice_detail.get('difficulty') if hasattr(player, 'last_dice_detail') else None
-            success = player.last_dice_detail.get('success') if hasattr(player, 'last_dice_detail') else None
+            difficulty = player.last_dice_detail.get('difficulty') if player.last_dice_detail else None
+            success = player.last_dice_detail.get('success') if player.last_dice_detail else None
             
             difficulty_text = f" against DC {difficulty}" if difficulty is not None else ""
             success_text = " Success!" if success else " Failure!" if difficulty is not None else ""
             
             detail_msg = f"I rolled {roll_value} on {dice_type}{difficulty_text}{success_text}."
 
-        response = game.send_message(
-            detail_msg,
-            player_id=player_id,
-            room_state=room
-        )
+    # The room stays unlocked while the DM thinks
+    return game.send_message(
+        detail_msg,
+        player_id=player_id,
+        room_state=context
+    )
+
+def run_process_roll(room_id: str, player_id: str, roll_value, dice_type: str):
+    """Have the DM narrate the outcome of the player's last roll.
+
+    Uses the narration /roll_dice prefetched for this roll when there is one.
+    Returns the answer fields and the updated room; raises LookupError if the
+    room or player is gone.
+    """
+    response = None
+    prefetched = narration_prefetch.take(room_id, player_id, (roll_value, dice_type))
+    if prefetched is not None:
+        if not prefetched.done.wait(PREFETCH_WAIT):
+            logging.warning("Prefetched narration for room %s still running after %ss, asking again", room_id,
+                            PREFETCH_WAIT, extra={'room_id': room_id})
+        elif prefetched.status == 'done':
+            response = prefetched.result
+        else:
+            logging.warning("Prefetched narration for room %s failed, asking again: %s", room_id,
+                            prefetched.error, extra={'room_id': room_id})
+    if response is None:
+        response = narrate_roll(room_id, player_id, roll_value, dice_type)
+    
+    with get_room_lock(room_id):
+        room, player = room_and_player(room_id, player_id)
         
         # Add DM's response if there is one
         dm_message_id = None
@@ -740,26 +815,7 @@ def process_roll():
             dm_message_id = add_room_message(room_id, response['message'], 'dm', detailed_result=getattr(player, 'last_dice_detail', None))
         
         # Update player states based on players_update
-        for player_update in response.get('players_update', []):
-            target_pid = player_update.get('player_id')
-            if not target_pid or target_pid not in room.players:
-                continue
-            
-            target_player = room.players[target_pid]
-            
-            # Update player stats if provided
-            if 'health_points' in player_update:
-                target_player.health_points = player_update['health_points']
-            if 'gold' in player_update:
-                target_player.gold = player_update['gold']
-            if 'damage' in player_update:
-                target_player.damage = player_update['damage']
-            if 'level' in player_update:
-                target_player.level = player_update['level']
-            if 'magic_1lvl' in player_update:
-                target_player.magic_1lvl = player_update['magic_1lvl']
-            if 'magic_2lvl' in player_update:
-                target_player.magic_2lvl = player_update['magic_2lvl']
+        apply_player_updates(room, response.get('players_update', []), ROLL_FIELD_MAP)
         
         # Update room combat state if needed
         combat_result = response.get('combat_result', {})
@@ -775,24 +831,51 @@ def process_roll():
         player.last_dice_roll = None
         
         # Update room state
-        room_manager.update_room(room)
+        write_room(room)
+        summarizer.maybe_schedule(room)
         
-        # Get the latest messages for this room
-        latest_messages = get_new_messages(room_id)
-        
-        # Create player data with preserved ability scores
-        player_data = player.model_dump()
-        if not player_data.get('ability_scores') and hasattr(player, 'ability_scores'):
-            player_data['ability_scores'] = player.ability_scores
-        
-        return jsonify({
+        return {
             'message': response.get('message', ''),
-            'player': player_data,
-            'room': room.model_dump(),
-            'messages': latest_messages,
-            'last_message_id': latest_messages[-1]['id'] if latest_messages else None,
             'dm_message_id': dm_message_id
+        }, room
+
+@app.route('/process_roll', methods=['POST'])
+def process_roll():
+    if 'room_id' not in session or 'player_id' not in session:
+        return jsonify({'error': 'Not in a room'}), 400
+    
+    room_id = session['room_id']
+    player_id = session['player_id']
+    data = request.get_json()
+    roll_value = data.get('roll')
+    dice_type = data.get('dice_type', 'd20')
+    
+    if data.get('async'):
+        return queue_llm_job('process_roll', room_id, player_id, run_process_roll, roll_value, dice_type,
+                             key=job_key(player_id, 'process_roll', roll_value, dice_type))
+    
+    try:
+        result, room = run_process_roll(room_id, player_id, roll_value, dice_type)
+    except LookupError as e:
+        return jsonify({'error': str(e)}), 404
+    
+    if 'since_revision' in data:
+        return jsonify({
+            **result,
+            **room_state_delta(room, player_id, data.get('since_revision'), data.get('last_message_id'))
         })
+    
+    # Get the latest messages for this room
+    latest_messages = get_new_messages(room_id)
+    
+    # Models are encoded natively by the JSON provider, extra attributes included
+    return jsonify({
+        **result,
+        'player': room.players.get(player_id),
+        'room': room,
+        'messages': latest_messages,
+        'last_message_id': latest_messages[-1]['id'] if latest_messages else None
+    })
 
 @app.route('/save_game', methods=['POST'])
 def save_game():
@@ -822,36 +905,46 @@ def load_game():
     
     current_player = None
     if room and session.get('player_id') in room.players:
-        current_player = room.players[session.get('player_id')].model_dump()
+        current_player = room.players[session.get('player_id')]
 
     return jsonify({
         'status': 'success',
         'message': 'Game loaded successfully',
-        'room': room.model_dump(),
+        'room': room,
         'player': current_player
     })
 
 @app.route('/list_saves')
 def list_saves():
-    saves = [f.stem.replace('room_', '') for f in Path('saves').glob('room_*.json')]
-    return jsonify({'saves': '\n'.join(saves)})
+    """List room saves from the save catalog, filtered and paginated"""
+    offset = max(request.args.get('offset', 0, type=int), 0)
+    limit = min(max(request.args.get('limit', 50, type=int), 1), 200)
+    total, entries = room_manager.save_index.query(
+        kind='room',
+        language=request.args.get('language'),
+        player=request.args.get('player'),
+        class_name=request.args.get('class'),
+        offset=offset,
+        limit=limit
+    )
+    return jsonify({
+        'saves': '\n'.join(entry['room_id'] for entry in entries),
+        'entries': entries,
+        'total': total,
+        'offset': offset,
+        'limit': limit
+    })
 
 def add_room_message(room_id: str, message: str, message_type: str = 'system', player_name: str = None, detailed_result=None):
     """Add a message to the room's message history with an ID"""
-    if room_id not in room_messages:
-        room_messages[room_id] = []
     # Prevent duplicate DM messages from being added by checking the last few messages
-    if message_type == 'dm' and room_messages[room_id]:
-        for msg in room_messages[room_id][-5:]:
+    if message_type == 'dm':
+        for msg in room_manager.get_messages(room_id, limit=5):
             if msg['type'] == 'dm' and msg['message'] == message:
                 return msg['id']
 
-    # Get the next message ID
-    next_id = len(room_messages[room_id]) + 1
-
     # Create message data
     message_data = {
-        'id': next_id,
         'message': message,
         'type': message_type,
         'timestamp': datetime.now().isoformat(),
@@ -860,47 +953,105 @@ def add_room_message(room_id: str, message: str, message_type: str = 'system', p
     if detailed_result is not None:
         message_data['detailed_result'] = detailed_result
 
-    room_messages[room_id].append(message_data)
-
-    # Keep only the last 100 messages
-    if len(room_messages[room_id]) > 100:
-        room_messages[room_id] = room_messages[room_id][-100:]
-
-    # Also update room's message history
-    room = room_manager.get_room(room_id)
-    if room:
-        if not hasattr(room, 'message_history'):
-            room.message_history = []
-        room_message = RoomMessage(
-            type=message_type,
-            message=message,
-            player_name=player_name,
-            timestamp=datetime.now()
-        )
-        # Optionally add detailed_result as an extra attribute
-        if detailed_result is not None:
-            room_message.__dict__['detailed_result'] = detailed_result
-        room.message_history.append(room_message)
-        # Keep only last 100 messages
-        if len(room.message_history) > 100:
-            room.message_history = room.message_history[-100:]
-        room_manager.update_room(room)
-    
-    return next_id
+    # The room manager assigns the ID and mirrors the message into the room's history
+    return room_manager.add_message(room_id, message_data)
 
 def get_new_messages(room_id: str, last_message_id: str = None):
     """Get messages newer than last_message_id"""
-    if room_id not in room_messages:
-        return []
-    
     if last_message_id is None:
-        return room_messages[room_id][-50:]  # Return last 50 messages instead of limited amount
+        return room_manager.get_messages(room_id)  # Return last 50 messages instead of limited amount
     
     try:
-        last_id = int(last_message_id)
-        return [msg for msg in room_messages[room_id] if msg['id'] > last_id]
+        return room_manager.get_messages(room_id, int(last_message_id))
     except (ValueError, TypeError):
-        return room_messages[room_id][-50:]
+        logging.error(f"Invalid last_message_id: {last_message_id}")
+        return room_manager.get_messages(room_id)
+
+# Room fields that never go into deltas: history is sent as messages, the rest is
+# bookkeeping or prompt context
+DELTA_ROOM_EXCLUDE = {'players', 'message_history', 'last_activity', 'version', 'summary', 'summary_through'}
+
+def optional_int(value) -> Optional[int]:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+def room_state_delta(room, player_id: str, since_revision=None, last_message_id=None) -> dict:
+    """Room changes since the client's revision, or a full snapshot on a revision gap"""
+    revision = room_manager.revision(room.room_id) or 0
+    fragments = {pid: player_fragment(p, room.language) for pid, p in room.players.items()}
+    delta = room_manager.deltas.diff(room.room_id, revision, room.model_dump(exclude=DELTA_ROOM_EXCLUDE),
+                                     {pid: f.data for pid, f in fragments.items()}, optional_int(since_revision))
+    if delta['full']:
+        # Whole players go out pre-encoded
+        delta['players'] = {pid: f.raw for pid, f in fragments.items()}
+    # A full snapshot replaces the client's message list; a delta appends to it
+    messages = get_new_messages(room.room_id, None if delta['full'] else last_message_id)
+    return {
+        **delta,
+        'player': delta['players'].get(player_id),
+        'messages': messages,
+        'last_message_id': messages[-1]['id'] if messages else optional_int(last_message_id)
+    }
+
+def spectator_allowed(room_id: str, token: Optional[str]) -> bool:
+    """Whether token opens the room's spectator feed; the room is read without being touched"""
+    room = room_manager.peek_room(room_id)
+    if room is None or not room.spectator_token or not token:
+        return False
+    return hmac.compare_digest(room.spectator_token.encode(), token.encode())
+
+def spectator_payload(room_id: str, since_revision=None, last_message_id=None) -> Optional[dict]:
+    """What spectators see of a room: the delta protocol without a player of their own.
+
+    Watching a room neither restores it from disk nor keeps it from expiring.
+    """
+    room = room_manager.peek_room(room_id)
+    if room is None:
+        return None
+    delta = room_state_delta(room, None, since_revision, last_message_id)
+    del delta['player']
+    return delta
+
+# Spectator streams share one encoded copy of each room change
+broadcaster = RoomBroadcaster(spectator_payload, dumps_json,
+                              room_manager.revision, room_manager.wait_for_revision)
+
+@app.route('/spectator_link', methods=['POST'])
+def spectator_link():
+    """The host's link to the room's spectator feed; {"reset": true} replaces the old one"""
+    if 'room_id' not in session or 'player_id' not in session:
+        return jsonify({'error': 'Not in a room'}), 400
+    
+    room_id = session['room_id']
+    with get_room_lock(room_id):
+        room = room_manager.get_room(room_id)
+        if not room:
+            return jsonify({'error': 'Room not found'}), 404
+        if room.host_id != session['player_id']:
+            return jsonify({'error': 'Only the host can share the room'}), 403
+        if not room.spectator_token or (request.get_json(silent=True) or {}).get('reset'):
+            room.spectator_token = secrets.token_urlsafe(16)
+            write_room(room)
+        token = room.spectator_token
+    return jsonify({'status': 'success', 'url': url_for('spectate', room_id=room_id, token=token)})
+
+@app.route('/spectate/<room_id>')
+def spectate(room_id):
+    """Read-only server-sent event feed of a room, for holders of its ?token=.
+
+    The first event is a snapshot, later ones are deltas (or a snapshot after
+    a revision gap or when this client fell behind). Messages in a snapshot
+    may repeat ones already sent; clients de-duplicate them by id.
+    """
+    # A wrong token looks like a missing room, so ids cannot be probed
+    if not spectator_allowed(room_id, request.args.get('token')):
+        return jsonify({'status': 'error', 'message': 'Room not found'}), 404
+    stream = broadcaster.stream(room_id)
+    if stream is None:
+        return jsonify({'status': 'error', 'message': 'Room not found'}), 404
+    return Response(stream, mimetype='text/event-stream', headers=SSE_HEADERS)
 
 # New endpoints for multi-page support
 @app.route('/character')
@@ -917,44 +1068,52 @@ def game():
 def serve_translation(filename):
     return send_from_directory('translations', filename)
 
-def load_translations(lang):
-    try:
-        with open(Path('translations') / f'{lang}.json', 'r', encoding='utf-8') as f:
-            return json.load(f)
-    except:
-        return {}
-
 @app.template_filter('trans')
 def translate_filter(key):
-    lang = session.get('language', 'en')
-    translations = load_translations(lang)
-    return translations.get(key, key)
+    return translation_catalog.translate(session.get('language', 'en'), key)
 
-PlayerState.model_config = {**PlayerState.model_config, "extra": "allow"}
+@app.route('/translate', methods=['POST'])
+def translate_keys():
+    """Translate a batch of keys in one request"""
+    data = request.json or {}
+    keys = data.get('keys')
+    if not isinstance(keys, list):
+        return jsonify({'error': 'keys must be a list'}), 400
+    lang = data.get('lang') or session.get('language', 'en')
+    if lang not in translation_catalog.languages:
+        lang = 'en'
+    return jsonify({'lang': lang, 'translations': translation_catalog.translate_many(lang, map(str, keys))})
 
 # New endpoint to compute effective ability scores based on selected race and class
 @app.route('/get_effective_stats')
 def get_effective_stats():
-    race = request.args.get('race')
-    class_name = request.args.get('class')
+    race = canonical_race(request.args.get('race')) or request.args.get('race')
+    class_name = canonical_class(request.args.get('class')) or request.args.get('class')
     if not race or not class_name:
         return jsonify({'error': 'race and class query parameters required'}), 400
     
-    # Get the default stats for the chosen class
-    class_defaults = CLASS_CONFIGS.get(class_name, {}).get("default_stats", {
-        "strength": 10,
-        "dexterity": 10,
-        "constitution": 10,
-        "intelligence": 10,
-        "wisdom": 10,
-        "charisma": 10
-    })
-    # Get racial bonus
-    race_bonus = RACE_CONFIGS.get(race, {}).get("ability_scores", {})
-    effective = {}
-    for ability in ["strength", "dexterity", "constitution", "intelligence", "wisdom", "charisma"]:
-        effective[ability] = class_defaults.get(ability, 10) + race_bonus.get(ability, 0)
-    return jsonify(effective)
+    response = jsonify(dict(get_character_stats(race, class_name)['ability_scores']))
+    response.add_etag()
+    response.headers['Cache-Control'] = 'public, max-age=3600'
+    return response.make_conditional(request)
+
+@app.route('/get_character_table')
+def get_character_table():
+    """Starting stats, modifiers and saving throws for every race x class"""
+    response = Response(CHARACTER_TABLE_JSON, mimetype='application/json')
+    response.set_etag(CHARACTER_TABLE_ETAG)
+    response.headers['Cache-Control'] = 'public, max-age=3600'
+    return response.make_conditional(request)
+
+# /metrics answers loopback scrapers only unless METRICS_PUBLIC=1
+METRICS_PUBLIC = os.getenv('METRICS_PUBLIC', '0') == '1'
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """Counters, gauges and latency histograms in the Prometheus text format"""
+    if not METRICS_PUBLIC and request.remote_addr not in ('127.0.0.1', '::1'):
+        return jsonify({'error': 'Forbidden'}), 403
+    return Response(metrics.REGISTRY.render(), content_type=metrics.CONTENT_TYPE)
 
 @app.route('/send_message', methods=['POST'])
 def send_message():
@@ -975,7 +1134,7 @@ try:
 except ImportError:
     pass
 
-PlayerState.model_config = {**PlayerState.model_config, "extra": "allow"}
-
 if __name__ == '__main__':
+    # The dev server reloads code on change; pick up edited translation files too
+    translation_catalog.auto_reload = True
     app.run(debug=True, host='0.0.0.0', port=8000)
\ No newline at end of file
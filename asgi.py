@@ -0,0 +1,224 @@
+"""
+ASGI entry point for the game server:
+
+    pip install -e ".[asgi]"
+    uvicorn asgi:app --host 0.0.0.0 --port 8000
+
+Requests that mostly wait are held on the event loop: long polls of
+/get_room_state?wait=..., /llm_job/<id>?wait=... and the /spectate/<room_id>
+streams. An idle player or spectator then costs a coroutine rather than a
+worker thread, so one process can keep thousands of them open. Every other
+request, and the answer to a long poll once it stops waiting, runs the Flask
+app unchanged through a2wsgi on a pool of ASGI_WSGI_THREADS threads.
+"""
+
+import asyncio
+import os
+from contextlib import suppress
+from io import BytesIO
+from typing import Dict, List, Optional, Tuple
+
+from a2wsgi import WSGIMiddleware
+from a2wsgi.wsgi import build_environ
+from flask import request, session
+from werkzeug.exceptions import HTTPException
+
+from app import (app as flask_app, broadcaster, known_revision, llm_jobs, room_manager, spectator_allowed,
+                 LONG_POLL_MAX_SECONDS)
+from broadcast import SSE_HEADERS
+from llm_jobs import Job
+from sqlite_room_manager import SQLiteRoomManager, REVISION_POLL_INTERVAL
+
+# Threads running Flask for requests that do not wait on the loop
+ASGI_WSGI_THREADS = int(os.getenv('ASGI_WSGI_THREADS', 32))
+
+
+def with_query_arg(scope: dict, name: str, value: Optional[str] = None) -> dict:
+    """A copy of scope whose query string sets `name` to `value`, or drops it when value is None"""
+    key = name.encode('latin-1')
+    parts = [part for part in scope.get('query_string', b'').split(b'&')
+             if part and part.split(b'=', 1)[0] != key]
+    if value is not None:
+        parts.append(key + b'=' + value.encode('latin-1'))
+    return {**scope, 'query_string': b'&'.join(parts)}
+
+
+async def until_disconnect(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+
+class ChangeWatch:
+    """Wakes long polls when their room's revision moves or their job finishes.
+
+    The room manager calls back on every revision bump made in this process
+    and a job calls back when it finishes; both hand the wake-up to the loop.
+    Rooms in the shared SQLite database can also be changed by other worker
+    processes, which cannot call back here, so while anyone waits on such a
+    room its revision is re-read every REVISION_POLL_INTERVAL seconds as well.
+    """
+
+    def __init__(self, executor, shared_rooms: bool):
+        self.executor = executor
+        self.shared_rooms = shared_rooms
+        self._rooms: Dict[str, List[Tuple[Optional[int], asyncio.Future]]] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def revision_change(self, room_id: str, known: Optional[int], timeout: float):
+        """Return once the room's revision differs from `known`, or after `timeout` seconds"""
+        self._loop = asyncio.get_running_loop()
+        future = self._loop.create_future()
+        waiting = self._rooms.get(room_id)
+        if waiting is None:
+            waiting = self._rooms[room_id] = []
+            room_manager.add_revision_listener(room_id, self._bumped)
+        waiting.append((known, future))
+        try:
+            # Listening before reading, so a bump in between is not missed
+            revision = await self._loop.run_in_executor(self.executor, room_manager.revision, room_id)
+            if revision != known:
+                return
+            if self.shared_rooms and self._task is None:
+                self._task = asyncio.ensure_future(self._poll())
+            with suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(future, timeout)
+        finally:
+            waiting.remove((known, future))
+            if not waiting and self._rooms.get(room_id) is waiting:
+                del self._rooms[room_id]
+                room_manager.remove_revision_listener(room_id, self._bumped)
+
+    async def job(self, job: Job, timeout: float):
+        """Return once `job` is done, or after `timeout` seconds"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        job.add_done_callback(lambda: loop.call_soon_threadsafe(self._resolve, future))
+        with suppress(asyncio.TimeoutError):
+            await asyncio.wait_for(future, timeout)
+
+    def _bumped(self, room_id: str):
+        """Revision listener; runs on the thread that wrote the room"""
+        with suppress(RuntimeError):  # the loop has closed
+            self._loop.call_soon_threadsafe(self._wake, room_id)
+
+    def _wake(self, room_id: str):
+        for _, future in self._rooms.get(room_id, ()):
+            self._resolve(future)
+
+    @staticmethod
+    def _resolve(future: asyncio.Future):
+        if not future.done():
+            future.set_result(None)
+
+    def _revisions(self, room_ids: List[str]) -> Dict[str, Optional[int]]:
+        return {room_id: room_manager.revision(room_id) for room_id in room_ids}
+
+    async def _poll(self):
+        """Catch revisions bumped by other worker processes"""
+        loop = asyncio.get_running_loop()
+        while self._rooms:
+            await asyncio.sleep(REVISION_POLL_INTERVAL)
+            revisions = await loop.run_in_executor(self.executor, self._revisions, list(self._rooms))
+            for room_id, revision in revisions.items():
+                for known, future in self._rooms.get(room_id, ()):
+                    if revision != known:
+                        self._resolve(future)
+        self._task = None
+
+
+class GameServer:
+    """The game server's ASGI application"""
+
+    def __init__(self, wsgi_app, threads: int = ASGI_WSGI_THREADS):
+        self.wsgi_app = wsgi_app
+        self.wsgi = WSGIMiddleware(wsgi_app, workers=threads)
+        self.executor = self.wsgi.executor
+        self.watch = ChangeWatch(self.executor, isinstance(room_manager, SQLiteRoomManager))
+        # Flask endpoint -> coroutine(scope, view_args, receive, send) run before the app;
+        # it returns the scope to pass on, or None once it has answered itself
+        self.waiting_handlers = {
+            'get_room_state': self.room_state,
+            'llm_job_status': self.llm_job_status,
+            'spectate': self.spectate,
+        }
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'http':
+            scope = await self.before_app(scope, receive, send)
+            if scope is None:
+                return
+        await self.wsgi(scope, receive, send)
+
+    def request_context(self, scope):
+        """A Flask request context for the request's URL, cookies and headers; the body is not read"""
+        return self.wsgi_app.request_context(build_environ(scope, BytesIO()))
+
+    async def before_app(self, scope, receive, send) -> Optional[dict]:
+        environ = build_environ(scope, BytesIO())
+        try:
+            endpoint, args = self.wsgi_app.url_map.bind_to_environ(environ).match()
+        except HTTPException:
+            return scope
+        handler = self.waiting_handlers.get(endpoint)
+        if handler is None:
+            return scope
+        return await handler(scope, args, receive, send)
+
+    async def room_state(self, scope, args, receive, send):
+        """Wait out a /get_room_state long poll on the loop, then answer it without waiting"""
+        with self.request_context(scope):
+            room_id = session.get('room_id')
+            wait = min(max(request.args.get('wait', 0, type=float), 0), LONG_POLL_MAX_SECONDS)
+            known = known_revision(room_id) if room_id and wait else None
+        if not room_id or not wait or known is None:
+            return scope
+        await self.watch.revision_change(room_id, known, wait)
+        # Still a long poll to Flask, so no change answers 304, but one that does not block again
+        return with_query_arg(scope, 'wait', '0')
+
+    async def llm_job_status(self, scope, args, receive, send):
+        """Wait for a job on the loop, then report it without waiting"""
+        with self.request_context(scope):
+            job = llm_jobs.get(args['job_id'])
+            wait = min(max(request.args.get('wait', 0, type=float), 0), LONG_POLL_MAX_SECONDS)
+            allowed = job is not None and job.room_id == session.get('room_id')
+        # Jobs of other worker processes are polled from the job store by Flask
+        if not allowed or not wait or not llm_jobs.is_local(job):
+            return scope
+        await self.watch.job(job, wait)
+        return with_query_arg(scope, 'wait')
+
+    async def spectate(self, scope, args, receive, send):
+        """Serve a spectator stream from the loop; unknown rooms and wrong tokens get Flask's 404"""
+        with self.request_context(scope):
+            token = request.args.get('token')
+        loop = asyncio.get_running_loop()
+        if not await loop.run_in_executor(self.executor, spectator_allowed, args['room_id'], token):
+            return scope
+        stream = await broadcaster.astream(args['room_id'])
+        if stream is None:
+            return scope
+        headers = [(b'content-type', b'text/event-stream; charset=utf-8')]
+        headers += [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in SSE_HEADERS.items()]
+        await send({'type': 'http.response.start', 'status': 200, 'headers': headers})
+
+        async def forward():
+            async for chunk in stream:
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+
+        streaming = asyncio.ensure_future(forward())
+        disconnect = asyncio.ensure_future(until_disconnect(receive))
+        try:
+            await asyncio.wait({streaming, disconnect}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for task in (streaming, disconnect):
+                task.cancel()
+                with suppress(asyncio.CancelledError, OSError):
+                    await task
+            await stream.aclose()
+        return None
+
+
+app = GameServer(flask_app)
@@ -0,0 +1,112 @@
+"""
+WebSocket transport for the battle screen, served with the battle UI over ASGI:
+
+    uvicorn battle_socket:app --port 5000
+
+The battle page keeps one socket open to /api/battle_socket and sends each
+action as a JSON text frame, {"id": 1, "action": "attack", "data": {...}}.
+The server runs the handler of the matching /api/<action> POST on the
+battle session named by the socket's cookie, and answers
+{"id": 1, "result": {...}, "state": {...}}. `result` is what the POST would
+return; `state` is the server's HP, positions, movement, spell slots and
+effects after the action. A state-only frame is sent when the socket opens.
+When the handler answers with an error status or a body that is not JSON,
+the frame is {"id": 1, "error": "...", "status": 500, "state": {...}}
+instead. Plain HTTP requests go to the web UI unchanged, through a2wsgi.
+"""
+
+import asyncio
+import json
+import os
+
+from a2wsgi import WSGIMiddleware
+from flask import session
+from werkzeug.http import parse_cookie
+from werkzeug.test import EnvironBuilder
+
+from serialization import RawJSON, dumps
+from webui import app as webui_app, battle_state
+
+BATTLE_SOCKET_PATH = '/api/battle_socket'
+# Threads running the web UI's handlers, for HTTP requests and socket frames alike
+ASGI_WSGI_THREADS = int(os.getenv('ASGI_WSGI_THREADS', 32))
+
+# Action -> how its data reaches the handler: as a form, as JSON, or not at all
+ACTIONS = {
+    'attack': 'form',
+    'roll_dice': 'form',
+    'cast_spell': 'json',
+    'enemy_attack': None,
+    'end_turn': None,
+    'turn': 'json',
+}
+
+
+class BattleServer:
+    """The web UI's ASGI application, with the battle socket"""
+
+    def __init__(self, wsgi_app, threads: int):
+        self.wsgi_app = wsgi_app
+        self.wsgi = WSGIMiddleware(wsgi_app, workers=threads)
+        self.executor = self.wsgi.executor
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'websocket' and scope['path'] == BATTLE_SOCKET_PATH:
+            await self.battle_socket(scope, receive, send)
+        else:
+            await self.wsgi(scope, receive, send)
+
+    async def battle_socket(self, scope, receive, send):
+        await receive()
+        cookie = '; '.join(value.decode('latin-1') for name, value in scope.get('headers', ()) if name == b'cookie')
+        sid = parse_cookie(cookie).get(self.wsgi_app.config['SESSION_COOKIE_NAME'])
+        loop = asyncio.get_running_loop()
+        # Reads the battle database, so off the loop
+        battle = await loop.run_in_executor(self.executor, self.wsgi_app.session_interface.lookup, sid)
+        if battle is None or 'character' not in battle:
+            # No battle to play; the page falls back to HTTP, which says so
+            await send({'type': 'websocket.close', 'code': 1008})
+            return
+        await send({'type': 'websocket.accept'})
+        await send({'type': 'websocket.send', 'text': dumps({'state': battle_state(battle)})})
+
+        while True:
+            message = await receive()
+            if message['type'] == 'websocket.disconnect':
+                return
+            frame = message.get('text')
+            if frame is None:
+                frame = (message.get('bytes') or b'').decode('utf-8', 'replace')
+            reply = await loop.run_in_executor(self.executor, self.run_action, cookie, frame)
+            await send({'type': 'websocket.send', 'text': reply})
+
+    def run_action(self, cookie: str, frame: str) -> str:
+        """Run one action frame through its HTTP handler and encode the reply"""
+        try:
+            request = json.loads(frame)
+            action = request['action']
+            data = request.get('data') or {}
+        except (ValueError, KeyError, TypeError, AttributeError):
+            return dumps({'error': 'Malformed frame'})
+        reply_id = request.get('id')
+        if not isinstance(action, str) or action not in ACTIONS:
+            return dumps({'id': reply_id, 'error': f'Unknown action: {action}'})
+        kind = ACTIONS[action]
+        environ = EnvironBuilder(path=f'/api/{action}', method='POST', headers={'Cookie': cookie},
+                                 data=data if kind == 'form' else None,
+                                 json=data if kind == 'json' else None).get_environ()
+        # The request context holds the battle's lock until the state is read (see webui.hold_battle)
+        with self.wsgi_app.request_context(environ):
+            response = self.wsgi_app.full_dispatch_request()
+            state = battle_state(session)
+        if response.status_code >= 400 or not response.is_json:
+            # Error pages are HTML, which must not be spliced into the frame
+            body = response.get_json(silent=True) if response.is_json else None
+            error = body.get('error') if isinstance(body, dict) else None
+            return dumps({'id': reply_id, 'error': error or f'HTTP error! status: {response.status_code}',
+                          'status': response.status_code, 'state': state})
+        # The handler's JSON goes out as it was encoded
+        return dumps({'id': reply_id, 'result': RawJSON(response.get_data(as_text=True).rstrip()), 'state': state})
+
+
+app = BattleServer(webui_app, ASGI_WSGI_THREADS)
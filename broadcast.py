@@ -0,0 +1,294 @@
+"""
+Read-only live feed of a room for spectators, as server-sent events.
+
+Each watched room has one pump thread that waits for the room's revision to
+move, builds the change once, encodes it once and appends the same bytes to
+every subscriber's queue. A subscriber that falls SPECTATOR_QUEUE_LIMIT
+events behind has its backlog dropped and gets one snapshot of the current
+state instead, shared by all subscribers that need one at that revision.
+Spectators therefore cost a queue append per change, not a room read and an
+encode each. stream() serves a worker thread, astream() an event loop.
+"""
+
+import asyncio
+import logging
+import os
+import threading
+import time
+from collections import deque
+from typing import Callable, Deque, Dict, List, NamedTuple, Optional, Set
+
+from metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+# Events a subscriber may have waiting before its backlog is replaced by a snapshot
+SPECTATOR_QUEUE_LIMIT = int(os.getenv('SPECTATOR_QUEUE_LIMIT', 32))
+# Streams end after this long and the browser reconnects, which frees the worker thread
+SPECTATOR_STREAM_SECONDS = float(os.getenv('SPECTATOR_STREAM_SECONDS', 300))
+KEEPALIVE_SECONDS = 15
+# How long the pump waits for a change before checking whether anyone still watches
+PUMP_WAIT_SECONDS = 5
+
+SPECTATOR_EVENTS = REGISTRY.counter('dnd_spectator_events_total',
+                                    'Spectator feed events by outcome (published, delivered, resync)')
+
+# Response headers of a spectator stream; the proxy one keeps nginx from buffering it
+SSE_HEADERS = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+
+KEEPALIVE = b': keepalive\n\n'
+CLOSED = b'event: closed\ndata: {}\n\n'
+
+
+def sse_event(event: str, data: str, event_id: Optional[int] = None) -> bytes:
+    """One server-sent event; data must be a single line, as compact JSON is"""
+    head = f'id: {event_id}\n' if event_id is not None else ''
+    return f'{head}event: {event}\ndata: {data}\n\n'.encode('utf-8')
+
+
+class _Snapshot(NamedTuple):
+    revision: int
+    last_message_id: Optional[int]
+    event: bytes
+
+
+class Subscriber:
+    __slots__ = ('queue', 'resync', 'closed', 'wake')
+
+    def __init__(self, wake: Optional[Callable[[], None]] = None):
+        self.queue: Deque[bytes] = deque()
+        # Set when the backlog was dropped; the stream sends a fresh snapshot next
+        self.resync = False
+        self.closed = False
+        # Called after the queue changes, for streams that do not wait on the channel's condition
+        self.wake = wake
+
+
+class _Channel:
+    def __init__(self, room_id: str):
+        self.room_id = room_id
+        self.subscribers: Set[Subscriber] = set()
+        self.cond = threading.Condition()
+        # What the pump last published
+        self.revision: Optional[int] = None
+        self.last_message_id: Optional[int] = None
+        self.snapshot: Optional[_Snapshot] = None
+        self.pump: Optional[threading.Thread] = None
+        # Streams between finding this channel and subscribing; guarded by the registry lock
+        self.joining = 0
+
+
+class RoomBroadcaster:
+    """Fans room changes out to spectator streams.
+
+    build(room_id, since_revision, last_message_id) returns the room payload
+    with 'revision' and 'last_message_id' keys, as a snapshot when
+    since_revision is None and as a delta otherwise, or None when the room is
+    gone. encode turns a payload into compact JSON. revision and
+    wait_for_revision are the room manager's methods of those names.
+    """
+
+    def __init__(self, build: Callable[[str, Optional[int], Optional[int]], Optional[dict]],
+                 encode: Callable[[dict], str],
+                 revision: Callable[[str], Optional[int]],
+                 wait_for_revision: Callable[[str, Optional[int], float], Optional[int]],
+                 queue_limit: int = SPECTATOR_QUEUE_LIMIT):
+        self.build = build
+        self.encode = encode
+        self.revision = revision
+        self.wait_for_revision = wait_for_revision
+        self.queue_limit = queue_limit
+        self._channels: Dict[str, _Channel] = {}
+        self._lock = threading.Lock()
+        REGISTRY.gauge('dnd_spectators', 'Open spectator streams', self.spectators)
+
+    def spectators(self) -> int:
+        with self._lock:
+            return sum(len(channel.subscribers) for channel in self._channels.values())
+
+    def stream(self, room_id: str, max_seconds: float = SPECTATOR_STREAM_SECONDS):
+        """SSE byte chunks for one spectator, or None if the room does not exist"""
+        joined = self._join(room_id)
+        if joined is None:
+            return None
+        return self._events(*joined, max_seconds)
+
+    async def astream(self, room_id: str, max_seconds: float = SPECTATOR_STREAM_SECONDS):
+        """Like stream(), as an async iterator that waits on the event loop instead of a thread"""
+        loop = asyncio.get_running_loop()
+        ready = asyncio.Event()
+        joined = await loop.run_in_executor(None, self._join, room_id,
+                                            lambda: loop.call_soon_threadsafe(ready.set))
+        if joined is None:
+            return None
+        return self._aevents(*joined, ready, max_seconds)
+
+    def _join(self, room_id: str, wake: Optional[Callable[[], None]] = None):
+        # The registry lock makes lookup-or-create atomic, and joining keeps
+        # _forget from dropping the channel before this stream subscribes
+        with self._lock:
+            channel = self._channels.get(room_id)
+            if channel is None:
+                channel = self._channels[room_id] = _Channel(room_id)
+            channel.joining += 1
+        try:
+            first = self._snapshot(channel)
+            if first is None:
+                return None
+            subscriber = Subscriber(wake)
+            with channel.cond:
+                channel.subscribers.add(subscriber)
+                if channel.pump is None:
+                    if channel.revision is None:
+                        channel.revision, channel.last_message_id = first.revision, first.last_message_id
+                    channel.pump = threading.Thread(target=self._pump, args=(channel,),
+                                                    name=f'spectate-{room_id}', daemon=True)
+                    channel.pump.start()
+            return channel, subscriber, first.event
+        finally:
+            with self._lock:
+                channel.joining -= 1
+            self._forget(channel)
+
+    def _events(self, channel: _Channel, subscriber: Subscriber, first: bytes, max_seconds: float):
+        deadline = time.monotonic() + max_seconds
+        try:
+            yield first
+            while True:
+                with channel.cond:
+                    if not (subscriber.queue or subscriber.resync or subscriber.closed):
+                        channel.cond.wait(max(min(KEEPALIVE_SECONDS, deadline - time.monotonic()), 0))
+                pending = self._take(channel, subscriber)
+                if pending is None:
+                    break
+                for chunk in pending:
+                    yield chunk
+                if not pending:
+                    if subscriber.closed or time.monotonic() >= deadline:
+                        break
+                    yield KEEPALIVE
+            yield CLOSED
+        finally:
+            self._leave(channel, subscriber)
+
+    async def _aevents(self, channel: _Channel, subscriber: Subscriber, first: bytes,
+                       ready: asyncio.Event, max_seconds: float):
+        loop = asyncio.get_running_loop()
+        deadline = time.monotonic() + max_seconds
+        try:
+            yield first
+            while True:
+                if not (subscriber.queue or subscriber.resync or subscriber.closed):
+                    try:
+                        await asyncio.wait_for(ready.wait(),
+                                               max(min(KEEPALIVE_SECONDS, deadline - time.monotonic()), 0))
+                    except asyncio.TimeoutError:
+                        pass
+                ready.clear()
+                if subscriber.resync:
+                    # A snapshot may read the database, so it is built off the loop
+                    pending = await loop.run_in_executor(None, self._take, channel, subscriber)
+                else:
+                    pending = self._take(channel, subscriber)
+                if pending is None:
+                    break
+                for chunk in pending:
+                    yield chunk
+                if not pending:
+                    if subscriber.closed or time.monotonic() >= deadline:
+                        break
+                    yield KEEPALIVE
+            yield CLOSED
+        finally:
+            self._leave(channel, subscriber)
+
+    def _take(self, channel: _Channel, subscriber: Subscriber) -> Optional[List[bytes]]:
+        """The subscriber's queued events, or a snapshot after a resync; None once the room is gone"""
+        with channel.cond:
+            pending = list(subscriber.queue)
+            subscriber.queue.clear()
+            resync, subscriber.resync = subscriber.resync, False
+        if not resync:
+            return pending
+        snapshot = self._snapshot(channel)
+        if snapshot is None:
+            return None
+        SPECTATOR_EVENTS.inc(outcome='resync')
+        return [snapshot.event]
+
+    def _leave(self, channel: _Channel, subscriber: Subscriber):
+        with channel.cond:
+            channel.subscribers.discard(subscriber)
+        self._forget(channel)
+
+    def _snapshot(self, channel: _Channel) -> Optional[_Snapshot]:
+        """Encoded full state of the room, built at most once per revision"""
+        cached = channel.snapshot
+        if cached is not None and cached.revision == self.revision(channel.room_id):
+            return cached
+        payload = self.build(channel.room_id, None, None)
+        if payload is None:
+            return None
+        snapshot = _Snapshot(payload['revision'], payload.get('last_message_id'),
+                             sse_event('snapshot', self.encode(payload), payload['revision']))
+        channel.snapshot = snapshot
+        return snapshot
+
+    def _pump(self, channel: _Channel):
+        try:
+            while True:
+                with channel.cond:
+                    if not channel.subscribers:
+                        channel.pump = None
+                        break
+                    known = channel.revision
+                revision = self.wait_for_revision(channel.room_id, known, PUMP_WAIT_SECONDS)
+                if revision == known:
+                    continue
+                payload = self.build(channel.room_id, known, channel.last_message_id) if revision is not None else None
+                if payload is None:
+                    self._close(channel)
+                    break
+                channel.revision = payload['revision']
+                channel.last_message_id = payload.get('last_message_id')
+                kind = 'snapshot' if payload.get('full') else 'delta'
+                self._publish(channel, sse_event(kind, self.encode(payload), payload['revision']))
+        except Exception:
+            logger.error("Spectator feed for room %s failed", channel.room_id, exc_info=True,
+                         extra={'room_id': channel.room_id})
+            self._close(channel)
+        self._forget(channel)
+
+    def _publish(self, channel: _Channel, event: bytes):
+        with channel.cond:
+            for subscriber in channel.subscribers:
+                if subscriber.resync:
+                    continue
+                if len(subscriber.queue) >= self.queue_limit:
+                    # Too far behind: drop the backlog and catch up with one snapshot
+                    subscriber.queue.clear()
+                    subscriber.resync = True
+                else:
+                    subscriber.queue.append(event)
+                if subscriber.wake is not None:
+                    subscriber.wake()
+            delivered = len(channel.subscribers)
+            channel.cond.notify_all()
+        SPECTATOR_EVENTS.inc(outcome='published')
+        SPECTATOR_EVENTS.inc(delivered, outcome='delivered')
+
+    def _close(self, channel: _Channel):
+        """End every stream of a room that is gone"""
+        with channel.cond:
+            for subscriber in channel.subscribers:
+                subscriber.closed = True
+                if subscriber.wake is not None:
+                    subscriber.wake()
+            channel.pump = None
+            channel.cond.notify_all()
+
+    def _forget(self, channel: _Channel):
+        with self._lock, channel.cond:
+            if (not channel.subscribers and channel.pump is None and not channel.joining
+                    and self._channels.get(channel.room_id) is channel):
+                del self._channels[channel.room_id]
@@ -1,5 +1,8 @@
+import hashlib
+import json
 import logging
 from random import randint
+from types import MappingProxyType
 logger = logging.getLogger(__name__)
 
 RACE_CONFIGS = {
@@ -271,6 +274,42 @@ CLASS_TRANSLATIONS = {
     }
 }
 
+def normalize_name(name):
+    """Normalize a race or class name for lookups"""
+    return " ".join(str(name).split()).casefold()
+
+def _build_name_index(translations):
+    """Map every canonical and localized name, normalized, to its canonical name"""
+    index = {}
+    # Canonical names win over a localized name that happens to collide with them
+    for names in translations.values():
+        for canonical in names:
+            index.setdefault(normalize_name(canonical), canonical)
+    # Earlier entries win for ambiguous localized names (e.g. ru 'Гном' is a Dwarf)
+    for names in translations.values():
+        for canonical, local_name in names.items():
+            index.setdefault(normalize_name(local_name), canonical)
+    return index
+
+RACE_NAME_INDEX = _build_name_index(RACE_TRANSLATIONS)
+CLASS_NAME_INDEX = _build_name_index(CLASS_TRANSLATIONS)
+
+def canonical_race(name):
+    """Canonical race name for any localized spelling, or None if unknown"""
+    return RACE_NAME_INDEX.get(normalize_name(name)) if name else None
+
+def canonical_class(name):
+    """Canonical class name for any localized spelling, or None if unknown"""
+    return CLASS_NAME_INDEX.get(normalize_name(name)) if name else None
+
+def localized_race(race, language):
+    """Display name of a canonical race in the given language"""
+    return RACE_TRANSLATIONS.get(language, RACE_TRANSLATIONS['en']).get(race, race)
+
+def localized_class(class_name, language):
+    """Display name of a canonical class in the given language"""
+    return CLASS_TRANSLATIONS.get(language, CLASS_TRANSLATIONS['en']).get(class_name, class_name)
+
 RACE_STATS = {
     'Human': {'hp': 15, 'damage': '2-7', 'gold': 5},
     'Elf': {'hp': 10, 'damage': '1-12', 'gold': 5},
@@ -304,23 +343,11 @@ ENEMIES = {
 
 def get_race_stats(race_name):
     """Get race stats, handling translations"""
-    # Convert localized name to English if needed
-    for lang in RACE_TRANSLATIONS.values():
-        for eng_name, local_name in lang.items():
-            if local_name == race_name:
-                race_name = eng_name
-                break
-    return RACE_STATS.get(race_name, RACE_STATS['Human'])
+    return RACE_STATS.get(canonical_race(race_name), RACE_STATS['Human'])
 
 def get_class_bonuses(class_name):
     """Get class bonuses, handling translations"""
-    # Convert localized name to English if needed
-    for lang in CLASS_TRANSLATIONS.values():
-        for eng_name, local_name in lang.items():
-            if local_name == class_name:
-                class_name = eng_name
-                break
-    return CLASS_BONUSES.get(class_name, CLASS_BONUSES['Warrior'])
+    return CLASS_BONUSES.get(canonical_class(class_name), CLASS_BONUSES['Warrior'])
 
 def get_enemy(enemy_type):
     """Get a copy of enemy stats"""
@@ -337,14 +364,15 @@ def roll_with_modifier(dice_count, dice_sides, ability_score):
     modifier = calculate_ability_modifier(ability_score)
     result = total + modifier
     logger.info(
-        f"roll_with_modifier: Rolling {dice_count}d{dice_sides}: Rolls={rolls}, Sum={total}, "
-        f"Ability Score={ability_score}, Modifier={(ability_score - 10)//2}, Total result={result}"
+        "roll_with_modifier: Rolling %sd%s: Rolls=%s, Sum=%s, Ability Score=%s, Modifier=%s, Total result=%s",
+        dice_count, dice_sides, rolls, total, ability_score, modifier, result
     )
     return result
 
 def get_attack_roll(character_race, character_class, ability_scores):
     logger.info(
-        f"get_attack_roll: character_race={character_race}, character_class={character_class}, ability_scores={ability_scores}"
+        "get_attack_roll: character_race=%s, character_class=%s, ability_scores=%s",
+        character_race, character_class, ability_scores
     )
     race_config = RACE_CONFIGS[character_race]
     class_config = CLASS_CONFIGS[character_class]
@@ -354,26 +382,97 @@ def get_attack_roll(character_race, character_class, ability_scores):
     damage_from_roll = roll_with_modifier(dice_count, dice_sides, total_ability_score)
     damage = damage_from_roll + class_config["damage_bonus"]
     logger.info(
-        f"get_attack_roll: Rolls damage from roll_with_modifier={damage_from_roll} plus class damage_bonus={class_config['damage_bonus']} equals total damage={damage}"
+        "get_attack_roll: Rolls damage from roll_with_modifier=%s plus class damage_bonus=%s equals total damage=%s",
+        damage_from_roll, class_config['damage_bonus'], damage
     )
     return damage
 
+def saving_throw_modifier(total_ability_score, ability, class_config):
+    """Ability modifier plus the +2 proficiency bonus for the class's saving throws"""
+    modifier = calculate_ability_modifier(total_ability_score)
+    if ability in class_config["saving_throws"]:
+        modifier += 2
+    return modifier
+
 def get_saving_throw(character_race, character_class, ability_scores, ability):
     logger.info(
-        f"get_saving_throw: character_race={character_race}, character_class={character_class}, ability_scores={ability_scores}, ability={ability}"
+        "get_saving_throw: character_race=%s, character_class=%s, ability_scores=%s, ability=%s",
+        character_race, character_class, ability_scores, ability
     )
     race_config = RACE_CONFIGS[character_race]
     class_config = CLASS_CONFIGS[character_class]
     total_ability_score = ability_scores[ability] + race_config["ability_scores"][ability]
     base_modifier = calculate_ability_modifier(total_ability_score)
-    modifier = base_modifier
-    if ability in class_config["saving_throws"]:
-        modifier += 2
-        prof_bonus = 2
-    else:
-        prof_bonus = 0
+    modifier = saving_throw_modifier(total_ability_score, ability, class_config)
+    prof_bonus = modifier - base_modifier
     logger.info(
         f"get_saving_throw: For ability {ability}, total_ability_score={total_ability_score}, "
         f"base modifier={base_modifier}, proficiency bonus={prof_bonus}, final modifier={modifier}"
     )
-    return modifier 
\ No newline at end of file
+    return modifier 
+
+ABILITIES = ("strength", "dexterity", "constitution", "intelligence", "wisdom", "charisma")
+
+def build_character_stats(race, class_name):
+    """Starting stats for a race and class, as DnDGame.initialize_character used to compute them"""
+    race_stats = get_race_stats(race)
+    class_bonuses = get_class_bonuses(class_name)
+    class_config = CLASS_CONFIGS.get(class_name, {})
+    defaults = class_config.get("default_stats", {})
+    race_bonus = RACE_CONFIGS.get(race, {}).get("ability_scores", {})
+
+    ability_scores = {a: defaults.get(a, 10) + race_bonus.get(a, 0) for a in ABILITIES}
+    return {
+        'race': race,
+        'class_name': class_name,
+        'level': 1,
+        'health_points': race_stats['hp'] + class_bonuses['hp_bonus'],
+        'gold': race_stats['gold'] + class_bonuses['gold_bonus'],
+        # Base damage is the top of the race's damage range (e.g. "2-7")
+        'damage': int(race_stats['damage'].split('-')[1]),
+        'magic_1lvl': class_bonuses['magic'],
+        'magic_2lvl': max(0, class_bonuses['magic'] - 1),
+        'ability_scores': ability_scores,
+        'modifiers': {a: calculate_ability_modifier(score) for a, score in ability_scores.items()},
+        'saving_throws': {
+            a: saving_throw_modifier(score, a, class_config) if class_config else calculate_ability_modifier(score)
+            for a, score in ability_scores.items()
+        },
+        'primary_ability': class_config.get("primary_ability"),
+    }
+
+def _build_character_table():
+    table = {
+        (race, class_name): build_character_stats(race, class_name)
+        for race in RACE_CONFIGS
+        for class_name in CLASS_CONFIGS
+    }
+    payload = json.dumps(
+        {race: {c: table[(race, c)] for c in CLASS_CONFIGS} for race in RACE_CONFIGS},
+        ensure_ascii=False, sort_keys=True, separators=(',', ':')
+    ).encode('utf-8')
+    frozen = MappingProxyType({key: _freeze(stats) for key, stats in table.items()})
+    return frozen, payload, hashlib.sha1(payload).hexdigest()
+
+def _freeze(value):
+    """Read-only view of nested dicts, so callers cannot change the shared table"""
+    if isinstance(value, dict):
+        return MappingProxyType({key: _freeze(item) for key, item in value.items()})
+    return value
+
+# Every race x class combination, computed once at import; entries are read-only mappings
+CHARACTER_TABLE, CHARACTER_TABLE_JSON, CHARACTER_TABLE_ETAG = _build_character_table()
+
+def get_character_stats(race, class_name):
+    """Precomputed starting stats for a race and class, accepting localized names.
+
+    The result is read-only; copy it (and its ability_scores, modifiers and
+    saving_throws) before changing anything.
+    """
+    race = canonical_race(race) or race
+    class_name = canonical_class(class_name) or class_name
+    stats = CHARACTER_TABLE.get((race, class_name))
+    if stats is None:
+        # Unknown combination: fall back to the same defaults the table was built with
+        stats = build_character_stats(race, class_name)
+    return stats
@@ -0,0 +1,108 @@
+import os
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from threading import Condition
+from typing import Deque, Dict, Optional
+
+from metrics import REGISTRY, STAGE_SECONDS
+
+# Gemini requests in flight at once for the whole process
+GEMINI_CONCURRENCY = int(os.getenv('GEMINI_CONCURRENCY', 8))
+# Prompt tokens a room may send per round before the next room gets a turn
+SCHEDULER_QUANTUM = int(os.getenv('GEMINI_SCHEDULER_QUANTUM', 2000))
+# Requests one room may have waiting for a slot
+SCHEDULER_ROOM_DEPTH = int(os.getenv('GEMINI_SCHEDULER_ROOM_DEPTH', 4))
+
+# Calls made outside any room (the battle web UI, the CLI) share one queue
+DEFAULT_FLOW = '-'
+
+
+class SchedulerFull(Exception):
+    """Raised when a room already has too many Gemini requests waiting"""
+
+
+class _Waiter:
+    __slots__ = ('cost', 'granted')
+
+    def __init__(self, cost: int):
+        self.cost = cost
+        self.granted = False
+
+
+class FairScheduler:
+    """Admits Gemini requests across rooms with deficit round-robin.
+
+    At most `concurrency` requests run at once. When more are waiting, rooms
+    take turns: each turn a room earns `quantum` tokens of credit and may send
+    requests while its credit covers their prompt size, so a room that sends
+    many or large prompts cannot crowd out the others.
+    """
+
+    def __init__(self, concurrency: int = GEMINI_CONCURRENCY, quantum: int = SCHEDULER_QUANTUM,
+                 room_depth: int = SCHEDULER_ROOM_DEPTH):
+        self.concurrency = concurrency
+        self.quantum = quantum
+        self.room_depth = room_depth
+        self._cond = Condition()
+        # Rooms with waiting requests, in round-robin order
+        self._queues: "OrderedDict[str, Deque[_Waiter]]" = OrderedDict()
+        self._deficit: Dict[str, int] = {}
+        self._in_flight = 0
+
+    @contextmanager
+    def slot(self, room_id: Optional[str], cost: int):
+        """Wait for this room's turn, then hold one of the concurrent request slots"""
+        flow = room_id or DEFAULT_FLOW
+        waiter = _Waiter(max(cost, 1))
+        started = time.perf_counter()
+        with self._cond:
+            queue = self._queues.get(flow)
+            if queue is None:
+                queue = self._queues[flow] = deque()
+                self._deficit[flow] = 0
+            if len(queue) >= self.room_depth:
+                raise SchedulerFull("Too many requests are waiting for the Dungeon Master in this room")
+            queue.append(waiter)
+            self._dispatch()
+            while not waiter.granted:
+                self._cond.wait()
+        STAGE_SECONDS.observe(time.perf_counter() - started, stage='gemini_queue_wait')
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._in_flight -= 1
+                self._dispatch()
+
+    def _dispatch(self):
+        # Called with the condition held
+        granted = False
+        while self._in_flight < self.concurrency and self._queues:
+            flow, queue = next(iter(self._queues.items()))
+            head = queue[0]
+            if self._deficit[flow] < head.cost:
+                # Out of credit: earn this round's quantum and go to the back of the line
+                self._deficit[flow] += self.quantum
+                self._queues.move_to_end(flow)
+                continue
+            self._deficit[flow] -= head.cost
+            queue.popleft()
+            head.granted = True
+            granted = True
+            self._in_flight += 1
+            if not queue:
+                # An idle room does not bank credit for later
+                del self._queues[flow]
+                del self._deficit[flow]
+        if granted:
+            self._cond.notify_all()
+
+    def waiting(self) -> int:
+        return sum(len(queue) for queue in self._queues.values())
+
+
+scheduler = FairScheduler()
+
+REGISTRY.gauge('dnd_gemini_waiting', 'Gemini requests waiting for a slot', scheduler.waiting)
+REGISTRY.gauge('dnd_gemini_in_flight', 'Gemini requests in flight', lambda: scheduler._in_flight)
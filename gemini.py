@@ -7,6 +7,10 @@ from gemini_schema import GAME_RESPONSE_SCHEMA, PLAYER_UPDATE_SCHEMA, DICE_ROLL_
 import json
 import time
 import logging
+from metrics import GEMINI_CALLS, GEMINI_RATE_LIMITED, GEMINI_KEY_ROTATIONS, GEMINI_TOKENS, stage_timer
+from token_budget import Usage, estimate_tokens
+from fair_scheduler import SchedulerFull, scheduler
+from response_parser import error_response, merge_portion, parse_game_response
 
 COMPOSITE_SCHEMA = {
     "type": "object",
@@ -45,8 +49,16 @@ class Gemini:
             types.SafetySetting(category="HARM_CATEGORY_DANGEROUS_CONTENT", threshold="BLOCK_NONE"),
         ]
         
+        # Token usage of the most recent call
+        self.last_usage = None
+        
         self._initialize_client()
 
+    @property
+    def key_label(self):
+        """Names the key in use for accounting without revealing it"""
+        return f"key{self.current_key_index + 1}"
+
     def _load_api_keys(self, provided_key=None):
         """Load API keys from environment variables"""
         keys = []
@@ -71,8 +83,39 @@ class Gemini:
         """Rotate to next available API key"""
         self.current_key_index = (self.current_key_index + 1) % len(self.api_keys)
         self._initialize_client()
+        GEMINI_KEY_ROTATIONS.inc()
         self.logger.info(f"Rotated to API key {self.current_key_index + 1}/{len(self.api_keys)}")
 
+    def _record_usage(self, response, call, prompt):
+        """Keep the token counts of a response, estimating those Gemini did not report"""
+        metadata = getattr(response, 'usage_metadata', None)
+        prompt_tokens = getattr(metadata, 'prompt_token_count', None)
+        output_tokens = getattr(metadata, 'candidates_token_count', None)
+        estimated = prompt_tokens is None or output_tokens is None
+        if prompt_tokens is None:
+            prompt_tokens = estimate_tokens(str(prompt)) + estimate_tokens(self.system_instruction)
+        if output_tokens is None:
+            output_tokens = estimate_tokens(getattr(response, 'text', None) or '')
+        if self.last_usage is not None:
+            # A follow-up call for the same answer adds to the first one
+            previous = self.last_usage
+            self.last_usage = Usage(previous.prompt_tokens + prompt_tokens, previous.output_tokens + output_tokens,
+                                    previous.estimated or estimated)
+        else:
+            self.last_usage = Usage(prompt_tokens, output_tokens, estimated)
+        GEMINI_TOKENS.inc(prompt_tokens, direction='prompt', call=call, key=self.key_label)
+        GEMINI_TOKENS.inc(output_tokens, direction='output', call=call, key=self.key_label)
+
+    def _rate_limited(self, call):
+        """Count a request rejected with 429"""
+        GEMINI_CALLS.inc(call=call, outcome='rate_limited')
+        GEMINI_RATE_LIMITED.inc()
+
+    def _slot(self, room_id, prompt):
+        """Wait for the room's fair share of the process-wide Gemini request slots"""
+        cost = estimate_tokens(str(prompt)) + estimate_tokens(self.system_instruction)
+        return scheduler.slot(room_id, cost)
+
     def _handle_rate_limit(self, retries):
         """Handle rate limit error by rotating keys or waiting"""
         if retries < len(self.api_keys):
@@ -82,89 +125,117 @@ class Gemini:
             self.logger.warning(f"All API keys exhausted. Waiting {self.retry_delay} seconds before retry.")
             return self.retry_delay
 
-    def send_message(self, prompt):
+    def send_message(self, prompt, room_id=None):
         """Send a message to the chat and return the response."""
+        self.last_usage = None
         retries = 0
         while retries < self.max_retries:
             try:
-                response = self.client.models.generate_content(
-                    model=self.model,
-                    contents=prompt,
-                    config=types.GenerateContentConfig(
-                        system_instruction=self.system_instruction,
-                        temperature=self.temperature,
-                        safety_settings=self.safety_settings
+                with self._slot(room_id, prompt), stage_timer('gemini'):
+                    response = self.client.models.generate_content(
+                        model=self.model,
+                        contents=prompt,
+                        config=types.GenerateContentConfig(
+                            system_instruction=self.system_instruction,
+                            temperature=self.temperature,
+                            safety_settings=self.safety_settings
+                        )
                     )
-                )
+                GEMINI_CALLS.inc(call='text', outcome='ok')
+                self._record_usage(response, 'text', prompt)
                 return response.text
+            except SchedulerFull:
+                # The caller answers 503; the rejection is not a DM message
+                GEMINI_CALLS.inc(call='text', outcome='rejected')
+                raise
             except Exception as e:
                 if "429" in str(e) and retries < self.max_retries - 1:
+                    self._rate_limited('text')
                     wait_time = self._handle_rate_limit(retries)
                     if wait_time > 0:
-                        time.sleep(wait_time)
+                        with stage_timer('rate_limit_sleep'):
+                            time.sleep(wait_time)
                     retries += 1
                     continue
+                GEMINI_CALLS.inc(call='text', outcome='error')
                 return f"Error: {str(e)}"
     
-    def send_structured_message(self, prompt):
+    def send_structured_message(self, prompt, room_id=None):
         """Send a message and get a structured response using multiple schemas."""
+        self.last_usage = None
         retries = 0
         while retries < self.max_retries:
             try:
-                response = self.client.models.generate_content(
-                    model=self.model,
-                    contents=prompt,
-                    config=types.GenerateContentConfig(
-                        system_instruction=self.system_instruction,
-                        temperature=self.temperature,
-                        safety_settings=self.safety_settings,
-                        response_mime_type="application/json",
-                        response_schema=COMPOSITE_SCHEMA
-                    )
-                )
-                
-                if hasattr(response, 'text'):
-                    try:
-                        return json.loads(response.text)
-                    except json.JSONDecodeError:
-                        return {
-                            "message": response.text,
-                            "state_update": None,
-                            "combat_result": None,
-                            "required_action": None
-                        }
-                else:
-                    # Fallback to normal response
+                with self._slot(room_id, prompt), stage_timer('gemini'):
                     response = self.client.models.generate_content(
                         model=self.model,
                         contents=prompt,
                         config=types.GenerateContentConfig(
                             system_instruction=self.system_instruction,
                             temperature=self.temperature,
-                            safety_settings=self.safety_settings
+                            safety_settings=self.safety_settings,
+                            response_mime_type="application/json",
+                            response_schema=COMPOSITE_SCHEMA
                         )
                     )
-                    return {
-                        "message": response.text,
-                        "state_update": None,
-                        "combat_result": None,
-                        "required_action": None
-                    }
+                GEMINI_CALLS.inc(call='structured', outcome='ok')
+                self._record_usage(response, 'structured', prompt)
+                
+                parsed = parse_game_response(getattr(response, 'text', None))
+                if parsed.repairs:
+                    self.logger.info("Repaired structured response: %s", ", ".join(parsed.repairs))
+                if parsed.missing:
+                    parsed = self._request_missing(prompt, parsed, room_id)
+                if 'message' not in parsed.data:
+                    return error_response("Error: Gemini returned no usable answer")
+                return parsed.data
                     
+            except SchedulerFull:
+                GEMINI_CALLS.inc(call='structured', outcome='rejected')
+                raise
             except Exception as e:
                 if "429" in str(e) and retries < self.max_retries - 1:
+                    self._rate_limited('structured')
                     wait_time = self._handle_rate_limit(retries)
                     if wait_time > 0:
-                        time.sleep(wait_time)
+                        with stage_timer('rate_limit_sleep'):
+                            time.sleep(wait_time)
                     retries += 1
                     continue
+                GEMINI_CALLS.inc(call='structured', outcome='error')
                 self.logger.error(f"Error: {str(e)}")
-                return {
-                    "message": f"Error: {str(e)}",
-                    "state_update": None,
-                    "combat_result": None,
-                    "required_action": None
-                }
+                return error_response(f"Error: {str(e)}")
+
+    def _request_missing(self, prompt, parsed, room_id=None):
+        """Ask only for the parts of an answer that could not be recovered"""
+        schema = {
+            "type": "object",
+            "properties": {name: COMPOSITE_SCHEMA["properties"][name] for name in parsed.missing},
+            "required": parsed.missing
+        }
+        so_far = json.dumps(parsed.data, ensure_ascii=False, default=lambda model: model.model_dump(exclude_none=True))
+        follow_up = (f"{prompt}\n\nYour answer so far:\n{so_far}\n\n"
+                     f"Reply with only the missing fields: {', '.join(parsed.missing)}.")
+        try:
+            with self._slot(room_id, follow_up), stage_timer('gemini'):
+                response = self.client.models.generate_content(
+                    model=self.model,
+                    contents=follow_up,
+                    config=types.GenerateContentConfig(
+                        system_instruction=self.system_instruction,
+                        temperature=self.temperature,
+                        safety_settings=self.safety_settings,
+                        response_mime_type="application/json",
+                        response_schema=schema
+                    )
+                )
+        except Exception as e:
+            GEMINI_CALLS.inc(call='portion', outcome='error')
+            self.logger.warning("Requesting %s again failed: %s", parsed.missing, e)
+            return parsed
+        GEMINI_CALLS.inc(call='portion', outcome='ok')
+        self._record_usage(response, 'portion', follow_up)
+        return merge_portion(parsed, getattr(response, 'text', None))
 
     def create_chat(self):
         """Create and return a new chat session."""
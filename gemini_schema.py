@@ -1,14 +1,32 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field, field_validator
+from pydantic_core import core_schema
 from typing import Optional, List, Dict, Union
 from datetime import datetime
+import copy
+from character_config import canonical_race, canonical_class
 
 class RoomMessage(BaseModel):
-    user_message: str
-    dm_response: str
+    id: Optional[int] = None
+    type: str
+    message: str
     player_name: Optional[str] = None
-    timestamp: datetime = datetime.now()
+    timestamp: datetime
+    detailed_result: Optional[dict] = None
 
-class PlayerState(BaseModel):
+    @property
+    def user_message(self) -> str:
+        return self.message
+
+    @property
+    def dm_response(self) -> str:
+        return self.message if self.type == 'dm' else ""
+
+class PlayerData(BaseModel):
+    """Every field of a player, as stored in saves and sent to clients.
+
+    Used to validate players where they enter the process (new players,
+    saves, the database); rooms hold them as PlayerState records.
+    """
     id: str
     name: str
     race: str
@@ -22,6 +40,8 @@ class PlayerState(BaseModel):
     last_dice_roll: Optional[int] = None
     dice_roll_needed: bool = False
     dice_type: Optional[str] = None
+    # Modifier, proficiency, reason and DC of the roll the DM asked for
+    dice_modifier: Optional[dict] = None
     is_active: bool = True
     last_activity: Optional[datetime] = None
     strength: int = 10
@@ -30,7 +50,90 @@ class PlayerState(BaseModel):
     intelligence: int = 10
     wisdom: int = 10
     charisma: int = 10
+    ability_scores: Optional[Dict[str, int]] = None
     last_dice_detail: Optional[dict] = None
+    version: int = 0
+
+    @field_validator('race')
+    @classmethod
+    def _canonical_race(cls, value: str) -> str:
+        # Always store the canonical (English) name, whatever language it arrived in
+        return canonical_race(value) or value
+
+    @field_validator('class_name')
+    @classmethod
+    def _canonical_class(cls, value: str) -> str:
+        return canonical_class(value) or value
+
+class PlayerState:
+    """A player in a room, with the fields of PlayerData in a fixed slot layout.
+
+    Rooms keep these in memory and read or assign them on every request, so
+    they are plain slotted records: values are validated once on the way in
+    and assignments are not validated, like on the pydantic model before.
+    """
+    FIELDS = tuple(PlayerData.model_fields)
+    # Fields holding dicts, which can change in place without an assignment
+    DICT_FIELDS = ('dice_modifier', 'ability_scores', 'last_dice_detail')
+    __slots__ = FIELDS + ('_revision', '_fragments')
+
+    def __init__(self, **values):
+        data = PlayerData(**values)
+        for name in self.FIELDS:
+            object.__setattr__(self, name, getattr(data, name))
+        # Bumped on every field assignment; keys the serialized payloads cached in _fragments
+        object.__setattr__(self, '_revision', 0)
+        object.__setattr__(self, '_fragments', {})
+
+    def __setattr__(self, name, value):
+        object.__setattr__(self, name, value)
+        if not name.startswith('_'):
+            self._revision += 1
+
+    def __repr__(self):
+        return f"PlayerState(id={self.id!r}, name={self.name!r}, race={self.race!r}, class_name={self.class_name!r})"
+
+    def __deepcopy__(self, memo):
+        # Copies (prompt context snapshots) skip validation and start with an empty payload cache
+        clone = object.__new__(PlayerState)
+        for name in self.FIELDS:
+            object.__setattr__(clone, name, copy.deepcopy(getattr(self, name), memo))
+        object.__setattr__(clone, '_revision', 0)
+        object.__setattr__(clone, '_fragments', {})
+        return clone
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'PlayerState':
+        """Validate stored or received player data; unknown keys are ignored"""
+        return cls(**data)
+
+    def to_dict(self, exclude=()) -> dict:
+        """JSON-ready field values; dict values are copies"""
+        if exclude:
+            data = {name: getattr(self, name) for name in self.FIELDS if name not in exclude}
+        else:
+            data = {name: getattr(self, name) for name in self.FIELDS}
+        for name in _PLAYER_DICT_FIELDS:
+            if data.get(name) is not None:
+                data[name] = dict(data[name])
+        for name in _PLAYER_DATETIME_FIELDS:
+            if data.get(name) is not None:
+                data[name] = data[name].isoformat()
+        return data
+
+    @classmethod
+    def __get_pydantic_core_schema__(cls, source, handler):
+        # Lets RoomState hold players: dicts are validated into records,
+        # records pass through, and dumps use to_dict()
+        return core_schema.no_info_plain_validator_function(
+            lambda value: value if isinstance(value, cls) else cls.from_dict(value),
+            serialization=core_schema.plain_serializer_function_ser_schema(lambda player: player.to_dict()),
+        )
+
+# Fields to_dict() copies or formats instead of passing through
+_PLAYER_DICT_FIELDS = PlayerState.DICT_FIELDS
+_PLAYER_DATETIME_FIELDS = tuple(name for name, field in PlayerData.model_fields.items()
+                                if field.annotation in (datetime, Optional[datetime]))
 
 class RoomState(BaseModel):
     room_id: str
@@ -43,7 +146,14 @@ class RoomState(BaseModel):
     last_activity: Optional[datetime] = None
     created_at: datetime = datetime.now()
     message_history: List[RoomMessage] = []
+    # Running summary of the turns up to message summary_through, kept short for prompts
+    summary: str = ''
+    summary_through: Optional[int] = None
     has_started: bool = False
+    version: int = 0
+    # Secret of the room's /spectate link, made when the host first shares it.
+    # Left out of every dump sent to clients; the room managers store it explicitly.
+    spectator_token: Optional[str] = Field(default=None, exclude=True)
 
 class PlayerUpdate(BaseModel):
     player_id: str
@@ -73,6 +183,23 @@ class DiceRoll(BaseModel):
     reason: Optional[str] = None
     modifier: Optional[Dict[str, Union[str, bool]]] = None
 
+class DiceRollRequest(BaseModel):
+    dice_type: str = 'd20'
+    dice_roll_needed: Optional[bool] = None
+    ability_modifier: Optional[str] = None
+    proficient: Optional[bool] = None
+    difficulty: Optional[int] = None
+    reason: Optional[str] = None
+
+class GameResponse(BaseModel):
+    """A DM answer as described by COMPOSITE_SCHEMA, used to validate what Gemini returns"""
+    message: str
+    player_update_required: bool = False
+    dice_roll_required: bool = False
+    combat_started: bool = False
+    players_update: List[PlayerUpdate] = []
+    dice_roll_request: Optional[DiceRollRequest] = None
+
 # Define the schema as a dictionary that matches Gemini's expected format
 GAME_RESPONSE_SCHEMA = {
     "type": "object",
@@ -0,0 +1,345 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from threading import Event, Lock
+from typing import Any, Callable, Deque, Dict, Hashable, List, Optional, Set
+
+from metrics import REGISTRY, STAGE_SECONDS
+
+logger = logging.getLogger(__name__)
+
+LLM_WORKERS = int(os.getenv('LLM_WORKERS', 8))
+# Jobs queued or running at once, per room and for the whole process
+LLM_ROOM_QUEUE_LIMIT = int(os.getenv('LLM_ROOM_QUEUE_LIMIT', 3))
+LLM_QUEUE_LIMIT = int(os.getenv('LLM_QUEUE_LIMIT', 64))
+# How long finished jobs can still be looked up
+JOB_RESULT_TTL = 300
+# How often a poll for a job running in another process re-reads its row
+JOB_POLL_INTERVAL = 0.25
+
+JOB_SCHEMA = """
+CREATE TABLE IF NOT EXISTS llm_jobs (
+    id TEXT PRIMARY KEY,
+    room_id TEXT NOT NULL,
+    player_id TEXT,
+    kind TEXT NOT NULL,
+    status TEXT NOT NULL,
+    result TEXT,
+    error TEXT,
+    updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_llm_jobs_updated ON llm_jobs(updated);
+"""
+
+JOBS = REGISTRY.counter('dnd_llm_jobs_total', 'LLM jobs by kind and outcome')
+
+
+class QueueFull(Exception):
+    """Raised when a room or the whole process already has too many LLM jobs waiting"""
+
+
+class Job:
+    __slots__ = ('id', 'room_id', 'player_id', 'kind', 'key', 'status', 'result', 'error',
+                 'created', 'finished', 'done', '_callbacks', '_callbacks_lock')
+
+    def __init__(self, room_id: str, player_id: str, kind: str, key: Optional[Hashable] = None,
+                 job_id: Optional[str] = None):
+        self.id = job_id or uuid.uuid4().hex
+        self.room_id = room_id
+        self.player_id = player_id
+        self.kind = kind
+        # Jobs with equal keys do the same thing; a queued one absorbs repeats
+        self.key = key
+        self.status = 'queued'
+        self.result: Optional[dict] = None
+        self.error: Optional[str] = None
+        self.created = time.monotonic()
+        self.finished: Optional[float] = None
+        self.done = Event()
+        self._callbacks: List[Callable[[], None]] = []
+        self._callbacks_lock = Lock()
+
+    def finish(self):
+        """Mark the job done and run the callbacks waiting for it"""
+        with self._callbacks_lock:
+            self.done.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback()
+
+    def add_done_callback(self, callback: Callable[[], None]):
+        """Call `callback()` from the finishing thread once the job is done, or now if it already is"""
+        with self._callbacks_lock:
+            if not self.done.is_set():
+                self._callbacks.append(callback)
+                return
+        callback()
+
+    def as_dict(self) -> dict:
+        return {'job_id': self.id, 'kind': self.kind, 'status': self.status,
+                'result': self.result, 'error': self.error}
+
+
+class JobStore:
+    """Job states kept in a SQLite database shared by the worker processes.
+
+    A job runs in the process that accepted it, but its status and result
+    are written here as they change, so a poll that reaches another worker
+    can still report it.
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._local = threading.local()
+        self._connection().executescript(JOB_SCHEMA)
+
+    def _connection(self) -> sqlite3.Connection:
+        """Get this thread's connection, opening it on first use"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=30000")
+            self._local.conn = conn
+        return conn
+
+    def save(self, job: Job):
+        result = None if job.result is None else json.dumps(job.result, default=str)
+        self._connection().execute(
+            "INSERT OR REPLACE INTO llm_jobs (id, room_id, player_id, kind, status, result, error, updated) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (job.id, job.room_id, job.player_id, job.kind, job.status, result, job.error, time.time()))
+
+    def load(self, job_id: str) -> Optional[Job]:
+        """A snapshot of the job as last written; its done event is set once it finished"""
+        row = self._connection().execute(
+            "SELECT room_id, player_id, kind, status, result, error FROM llm_jobs WHERE id = ?",
+            (job_id,)).fetchone()
+        if row is None:
+            return None
+        room_id, player_id, kind, status, result, error = row
+        job = Job(room_id, player_id, kind, job_id=job_id)
+        job.status = status
+        job.result = None if result is None else json.loads(result)
+        job.error = error
+        if status in ('done', 'error'):
+            job.finish()
+        return job
+
+    def remove(self, job_id: str):
+        self._connection().execute("DELETE FROM llm_jobs WHERE id = ?", (job_id,))
+
+    def prune(self, ttl: float):
+        self._connection().execute(
+            "DELETE FROM llm_jobs WHERE status IN ('done', 'error') AND updated < ?", (time.time() - ttl,))
+
+
+class LLMJobQueue:
+    """Runs LLM-backed actions on a dedicated worker pool.
+
+    Request threads submit a job and answer at once; the job publishes its
+    outcome to the room (messages, player state) like the synchronous path
+    would, and the job's result stays available by id for a while so the
+    submitting client can pick it up. Jobs of one room run one after another.
+    Submissions beyond the per-room or global limit raise QueueFull instead
+    of piling up, and a submission whose key matches a job still waiting in
+    the room's queue is collapsed into that job. Background submissions
+    (speculative work nobody waits for yet) are only accepted while a worker
+    is idle and the room has no job, so they are the first to be shed.
+
+    With a JobStore, job states are also written to the shared database, so
+    get() and wait() work for jobs accepted by another worker process.
+    Limits, ordering and collapsing still apply per process.
+    """
+
+    def __init__(self, workers: int = LLM_WORKERS, room_limit: int = LLM_ROOM_QUEUE_LIMIT,
+                 total_limit: int = LLM_QUEUE_LIMIT, store: Optional[JobStore] = None):
+        self.workers = workers
+        self.store = store
+        self.room_limit = room_limit
+        self.total_limit = total_limit
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='llm-job')
+        self._jobs: Dict[str, Job] = {}
+        self._active: Dict[str, int] = {}
+        # A room runs one job at a time, so its DM turns happen in order
+        self._running: Set[str] = set()
+        self._waiting: Dict[str, Deque[tuple]] = {}
+        # Jobs holding a slot whose prepare step is still running
+        self._preparing: Dict[str, List[Job]] = {}
+        self._active_total = 0
+        self._lock = Lock()
+        REGISTRY.gauge('dnd_llm_jobs_active', 'LLM jobs queued or running', lambda: self._active_total)
+
+    def check_capacity(self, room_id: str):
+        """Raise QueueFull if a job for this room would be rejected right now"""
+        if self._active_total >= self.total_limit:
+            raise QueueFull("The Dungeon Master is busy, please try again in a moment")
+        if self._active.get(room_id, 0) >= self.room_limit:
+            raise QueueFull("Too many actions are waiting for the Dungeon Master in this room")
+
+    def find_queued(self, room_id: str, key: Hashable) -> Optional[Job]:
+        """A job of the room with this key that has not started yet; the caller collapses into it"""
+        with self._lock:
+            return self._find_queued(room_id, key)
+
+    def _find_queued(self, room_id: str, key: Hashable) -> Optional[Job]:
+        # Called with the lock held
+        waiting = [job for job, _, _ in self._waiting.get(room_id, ())]
+        for job in self._preparing.get(room_id, []) + waiting:
+            if job.key == key:
+                JOBS.inc(kind=job.kind, outcome='collapsed')
+                return job
+        return None
+
+    def submit(self, room_id: str, player_id: str, kind: str, fn: Callable[..., dict], *args,
+               key: Optional[Hashable] = None, prepare: Optional[Callable[[], Any]] = None,
+               background: bool = False) -> Job:
+        """Queue fn(*args); with a key, a matching job still waiting is returned instead.
+
+        prepare() runs once the job holds its slot and before it can start, and
+        its result is passed to fn as one more argument. Side effects that only
+        an accepted job may have (posting the player's message) belong there,
+        so a QueueFull leaves nothing behind. If prepare raises, the slot is
+        freed and the exception propagates. A background job raises QueueFull
+        unless it can start right away without delaying other work.
+        """
+        job = Job(room_id, player_id, kind, key)
+        with self._lock:
+            self._prune()
+            if key is not None:
+                queued = self._find_queued(room_id, key)
+                if queued is not None:
+                    return queued
+            if background and (self._active_total >= self.workers or room_id in self._active):
+                JOBS.inc(kind=kind, outcome='shed')
+                raise QueueFull("No idle worker for background work")
+            self.check_capacity(room_id)
+            self._active[room_id] = self._active.get(room_id, 0) + 1
+            self._active_total += 1
+            self._jobs[job.id] = job
+            if prepare is not None:
+                self._preparing.setdefault(room_id, []).append(job)
+
+        try:
+            if self.store is not None:
+                self.store.save(job)
+            if prepare is not None:
+                args += (prepare(),)
+        except BaseException:
+            with self._lock:
+                if prepare is not None:
+                    self._unprepare(job)
+                self._release_slot(room_id)
+                del self._jobs[job.id]
+            if self.store is not None:
+                self.store.remove(job.id)
+            raise
+
+        with self._lock:
+            if prepare is not None:
+                self._unprepare(job)
+            if room_id in self._running:
+                self._waiting.setdefault(room_id, deque()).append((job, fn, args))
+                return job
+            self._running.add(room_id)
+        self._pool.submit(self._run, job, fn, args)
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        """The job with this id, or a snapshot from the store if another process runs it"""
+        job = self._jobs.get(job_id)
+        if job is None and self.store is not None:
+            job = self.store.load(job_id)
+        return job
+
+    def is_local(self, job: Job) -> bool:
+        """Whether this process runs the job, so its done event is set when it finishes"""
+        return self._jobs.get(job.id) is job
+
+    def wait(self, job: Job, timeout: float) -> Job:
+        """Block until the job finishes or the timeout expires, and return its latest state"""
+        if self.is_local(job) or self.store is None:
+            job.done.wait(timeout)
+            return job
+        # Run by another process: re-read its row until it finishes
+        deadline = time.monotonic() + timeout
+        while not job.done.is_set():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            time.sleep(min(JOB_POLL_INTERVAL, remaining))
+            job = self.store.load(job.id) or job
+        return job
+
+    def _run(self, job: Job, fn: Callable[..., dict], args: tuple):
+        STAGE_SECONDS.observe(time.monotonic() - job.created, stage='job_queue_wait')
+        job.status = 'running'
+        self._save(job)
+        try:
+            job.result = fn(*args)
+            job.status = 'done'
+        except Exception as e:
+            logger.error("LLM job %s (%s) for room %s failed", job.id, job.kind, job.room_id,
+                         exc_info=True, extra={'room_id': job.room_id})
+            job.error = str(e)
+            job.status = 'error'
+        finally:
+            JOBS.inc(kind=job.kind, outcome=job.status)
+            job.finished = time.monotonic()
+            self._save(job)
+            with self._lock:
+                self._release_slot(job.room_id)
+                waiting = self._waiting.get(job.room_id)
+                following = waiting.popleft() if waiting else None
+                if not waiting:
+                    self._waiting.pop(job.room_id, None)
+                if following is None:
+                    self._running.discard(job.room_id)
+            job.finish()
+            if following is not None:
+                self._pool.submit(self._run, *following)
+
+    def _save(self, job: Job):
+        """Publish the job's state to the store; a failed write only costs other workers' polls"""
+        if self.store is None:
+            return
+        try:
+            self.store.save(job)
+        except Exception:
+            logger.error("Failed to store state of LLM job %s", job.id, exc_info=True,
+                         extra={'room_id': job.room_id})
+
+    def _release_slot(self, room_id: str):
+        # Called with the lock held
+        remaining = self._active.get(room_id, 1) - 1
+        if remaining:
+            self._active[room_id] = remaining
+        else:
+            self._active.pop(room_id, None)
+        self._active_total -= 1
+
+    def _unprepare(self, job: Job):
+        # Called with the lock held
+        preparing = self._preparing[job.room_id]
+        preparing.remove(job)
+        if not preparing:
+            del self._preparing[job.room_id]
+
+    def _prune(self):
+        # Called with the lock held
+        cutoff = time.monotonic() - JOB_RESULT_TTL
+        expired = [job_id for job_id, job in self._jobs.items()
+                   if job.finished is not None and job.finished < cutoff]
+        for job_id in expired:
+            del self._jobs[job_id]
+        if expired and self.store is not None:
+            self.store.prune(JOB_RESULT_TTL)
@@ -0,0 +1,141 @@
+"""
+Non-blocking logging shared by the game servers.
+
+Request threads only put records on an in-memory queue. A background
+QueueListener thread formats them and does the actual file and terminal
+writes, so a slow disk or a busy console never holds up a request. The log
+file is written as JSON lines (one object per record); the console stays
+human readable.
+"""
+
+import atexit
+import copy
+import json
+import logging
+import os
+import queue
+import random
+import threading
+from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener, TimedRotatingFileHandler
+from pathlib import Path
+
+# Long prompts and model responses are cut to this many characters, except for
+# the sampled fraction of records that keep the full text
+PROMPT_LOG_LIMIT = int(os.getenv('LOG_PROMPT_LIMIT', 500))
+PROMPT_LOG_SAMPLE_RATE = float(os.getenv('LOG_PROMPT_SAMPLE_RATE', 0.05))
+
+# Attributes every LogRecord has; anything else came in through `extra=`
+_RECORD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {'message', 'asctime'}
+
+_listener = None
+_listener_guard = threading.Lock()
+
+
+class GetRoomStateFilter(logging.Filter):
+    def filter(self, record):
+        return "GET /get_room_state" not in record.getMessage()
+
+
+class JsonLineFormatter(logging.Formatter):
+    """Formats each record as a single JSON object"""
+
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'thread': record.threadName,
+            'message': record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS and not key.startswith('_'):
+                entry[key] = value
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class _DeferredQueueHandler(QueueHandler):
+    """QueueHandler that leaves formatting to the listener thread.
+
+    The stock handler runs the formatter, including traceback rendering, in
+    the logging thread. Here only the message arguments are merged, since they
+    may be mutated after the call returns; the rest happens on the listener.
+    """
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+class Abbreviated:
+    """Log argument that shortens long text only when the record is emitted"""
+
+    __slots__ = ('text', 'limit')
+
+    def __init__(self, text, limit=PROMPT_LOG_LIMIT):
+        self.text = text
+        self.limit = limit
+
+    def __str__(self):
+        text = str(self.text)
+        if self.limit is None or len(text) <= self.limit:
+            return text
+        return f"{text[:self.limit]}... [{len(text) - self.limit} more chars]"
+
+
+def sampled_prompt(text):
+    """Wrap a prompt or model response for logging, keeping it whole only for a sampled few"""
+    if random.random() < PROMPT_LOG_SAMPLE_RATE:
+        return Abbreviated(text, limit=None)
+    return Abbreviated(text)
+
+
+def setup_logging(logs_dir="logs"):
+    """Route the root logger through a queue to a background listener thread.
+
+    Safe to call more than once; only the first call installs the pipeline.
+    """
+    global _listener
+    with _listener_guard:
+        if _listener is not None:
+            return _listener
+
+        logs_dir = Path(logs_dir)
+        logs_dir.mkdir(exist_ok=True)
+
+        # Daily rotated JSON lines file
+        file_handler = TimedRotatingFileHandler(
+            logs_dir / "game.log",
+            when="midnight",
+            interval=1,
+            backupCount=30,  # Keep 30 days of logs
+            encoding='utf-8'
+        )
+        file_handler.setLevel(os.getenv('LOG_FILE_LEVEL', 'INFO').upper())
+        file_handler.setFormatter(JsonLineFormatter())
+
+        console_handler = logging.StreamHandler()
+        console_handler.setLevel(os.getenv('LOG_CONSOLE_LEVEL', 'DEBUG').upper())
+        console_handler.setFormatter(logging.Formatter(
+            '%(asctime)s - %(levelname)s - %(message)s',
+            datefmt='%Y-%m-%d %H:%M:%S'
+        ))
+
+        log_queue = queue.SimpleQueue()
+        queue_handler = _DeferredQueueHandler(log_queue)
+        # Drop the polling noise before it is even queued
+        queue_handler.addFilter(GetRoomStateFilter())
+
+        root_logger = logging.getLogger()
+        root_logger.setLevel(min(file_handler.level, console_handler.level))
+        root_logger.handlers = [queue_handler]
+
+        _listener = QueueListener(log_queue, file_handler, console_handler, respect_handler_level=True)
+        _listener.start()
+        # Flush whatever is still queued when the process exits
+        atexit.register(_listener.stop)
+        return _listener
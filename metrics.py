@@ -0,0 +1,221 @@
+"""
+In-process metrics rendered in the Prometheus text format.
+
+Counters and histograms are updated directly by the code being measured;
+gauges are read from callbacks when /metrics is scraped. With several worker
+processes each one reports its own numbers, so scrape them individually.
+"""
+
+import bisect
+import time
+from contextlib import contextmanager
+from threading import Lock
+from typing import Callable, Dict, Iterable, List, Tuple
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Request stages are mostly milliseconds; Gemini calls take seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+def _label_key(labels: Dict[str, object]) -> LabelKey:
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(key: Iterable[Tuple[str, str]]) -> str:
+    key = list(key)
+    if not key:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in key) + '}'
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    kind = 'untyped'
+
+    def __init__(self, name: str, documentation: str):
+        self.name = name
+        self.documentation = documentation
+        self._lock = Lock()
+
+    def header(self) -> List[str]:
+        return [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+
+    def render(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    """Monotonically increasing count, optionally split by labels"""
+
+    kind = 'counter'
+
+    def __init__(self, name: str, documentation: str):
+        super().__init__(name, documentation)
+        self._values: Dict[LabelKey, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(_label_key(labels), 0)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        return self.header() + [f'{self.name}{_format_labels(k)} {_format_value(v)}' for k, v in values]
+
+
+class Histogram(_Metric):
+    """Distribution of observed values in cumulative buckets"""
+
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation)
+        self.buckets = tuple(sorted(buckets))
+        # label key -> (per-bucket counts with a trailing +Inf slot, sum)
+        self._series: Dict[LabelKey, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, **labels):
+        key = _label_key(labels)
+        position = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = ([0] * (len(self.buckets) + 1), [0.0])
+            series[0][position] += 1
+            series[1][0] += value
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the duration of the with block"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            series = sorted((key, list(counts), total[0]) for key, (counts, total) in self._series.items())
+        lines = self.header()
+        for key, counts, total in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                labels = _format_labels(key + (('le', _format_value(bound)),))
+                lines.append(f'{self.name}_bucket{labels} {cumulative}')
+            lines.append(f'{self.name}_sum{_format_labels(key)} {_format_value(total)}')
+            lines.append(f'{self.name}_count{_format_labels(key)} {cumulative}')
+        return lines
+
+
+class Gauge(_Metric):
+    """Current value read from a callback at scrape time"""
+
+    kind = 'gauge'
+
+    def __init__(self, name: str, documentation: str, callback: Callable[[], float]):
+        super().__init__(name, documentation)
+        self.callback = callback
+
+    def render(self) -> List[str]:
+        return self.header() + [f'{self.name} {_format_value(self.callback())}']
+
+
+class CounterFunc(Gauge):
+    """Counter whose value is kept elsewhere and read at scrape time"""
+
+    kind = 'counter'
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = Lock()
+
+    def register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str) -> Counter:
+        return self.register(Counter(name, documentation))
+
+    def histogram(self, name: str, documentation: str, buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, buckets))
+
+    def gauge(self, name: str, documentation: str, callback: Callable[[], float]) -> Gauge:
+        return self.register(Gauge(name, documentation, callback))
+
+    def counter_func(self, name: str, documentation: str, callback: Callable[[], float]) -> CounterFunc:
+        return self.register(CounterFunc(name, documentation, callback))
+
+    def render(self) -> str:
+        """Every metric in the Prometheus text exposition format"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            try:
+                lines.extend(metric.render())
+            except Exception:
+                # A broken gauge callback must not take the whole scrape down
+                continue
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+REQUEST_SECONDS = REGISTRY.histogram(
+    'dnd_request_seconds', 'HTTP request duration by endpoint')
+STAGE_SECONDS = REGISTRY.histogram(
+    'dnd_stage_seconds', 'Duration of the stages of a request (game_init, lock_wait, prompt_build, gemini, serialize, ...)')
+GEMINI_CALLS = REGISTRY.counter(
+    'dnd_gemini_calls_total', 'Gemini requests by call type and outcome')
+GEMINI_RATE_LIMITED = REGISTRY.counter(
+    'dnd_gemini_rate_limited_total', 'Gemini responses rejected with HTTP 429')
+GEMINI_KEY_ROTATIONS = REGISTRY.counter(
+    'dnd_gemini_key_rotations_total', 'Switches to the next Gemini API key')
+GEMINI_TOKENS = REGISTRY.counter(
+    'dnd_gemini_tokens_total', 'Gemini tokens by direction, call type and API key (estimated when not reported)')
+CACHE_LOOKUPS = REGISTRY.counter(
+    'dnd_cache_lookups_total', 'Cache lookups by cache and result (hit or miss)')
+
+
+def stage_timer(stage: str):
+    """Time one stage of a request into dnd_stage_seconds"""
+    return STAGE_SECONDS.time(stage=stage)
+
+
+class TimedLock:
+    """Wraps a room lock so time spent waiting for it is recorded as the lock_wait stage"""
+
+    def __init__(self, lock):
+        self.lock = lock
+
+    def __enter__(self):
+        started = time.perf_counter()
+        result = self.lock.__enter__()
+        STAGE_SECONDS.observe(time.perf_counter() - started, stage='lock_wait')
+        return result
+
+    def __exit__(self, *exc_info):
+        return self.lock.__exit__(*exc_info)
+
@@ -0,0 +1,66 @@
+import logging
+import time
+from threading import Lock
+from typing import Callable, Dict, Hashable, Optional, Tuple
+
+from llm_jobs import Job, LLMJobQueue, QueueFull
+from metrics import CACHE_LOOKUPS
+
+logger = logging.getLogger(__name__)
+
+# Narrations nobody asked for within this many seconds are dropped
+PREFETCH_TTL = 120
+# How long /process_roll waits for a narration still in flight before asking Gemini itself
+PREFETCH_WAIT = 30
+
+
+class NarrationPrefetch:
+    """DM narrations started before the client asks for them.
+
+    /roll_dice starts narrating a roll the DM asked for right away, since the
+    client follows up with /process_roll. The narration runs as a background
+    job of the LLM job queue: it is only started while a worker is idle and
+    the room has nothing else queued, so under load it is skipped and
+    /process_roll asks Gemini itself. A started narration cannot be stopped,
+    but it only reads the room and costs one call.
+
+    The pending narration is kept per player together with a token describing
+    the roll; take() hands it over only if the token still matches, so a
+    stale or mismatched guess is never used.
+    """
+
+    def __init__(self, jobs: LLMJobQueue, ttl: float = PREFETCH_TTL):
+        self.jobs = jobs
+        self.ttl = ttl
+        # (room_id, player_id) -> (token, job, started)
+        self._pending: Dict[Tuple[str, str], Tuple[Hashable, Job, float]] = {}
+        self._lock = Lock()
+
+    def start(self, room_id: str, player_id: str, token: Hashable, fn: Callable[..., dict], *args) -> Optional[Job]:
+        """Run fn(*args) in the background as the player's next narration, if a worker is free"""
+        try:
+            job = self.jobs.submit(room_id, player_id, 'narration_prefetch', fn, *args, background=True)
+        except QueueFull:
+            with self._lock:
+                self._pending.pop((room_id, player_id), None)
+            return None
+        with self._lock:
+            self._prune()
+            self._pending[(room_id, player_id)] = (token, job, time.monotonic())
+        return job
+
+    def take(self, room_id: str, player_id: str, token: Hashable) -> Optional[Job]:
+        """The player's pending narration job if it was started for this token"""
+        with self._lock:
+            entry = self._pending.pop((room_id, player_id), None)
+        if entry is None or entry[0] != token or time.monotonic() - entry[2] > self.ttl:
+            CACHE_LOOKUPS.inc(cache='narration', result='miss')
+            return None
+        CACHE_LOOKUPS.inc(cache='narration', result='hit' if entry[1].done.is_set() else 'in_flight')
+        return entry[1]
+
+    def _prune(self):
+        # Called with the lock held
+        cutoff = time.monotonic() - self.ttl
+        for key in [key for key, (_, _, started) in self._pending.items() if started < cutoff]:
+            del self._pending[key]
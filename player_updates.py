@@ -0,0 +1,78 @@
+import logging
+from typing import Callable, Dict, Iterable, List, Tuple, Union
+
+from pydantic import TypeAdapter, ValidationError
+
+from gemini_schema import PlayerState, PlayerUpdate, RoomState
+
+logger = logging.getLogger(__name__)
+
+FieldMap = Tuple[Tuple[str, Callable[[int], int]], ...]
+
+_ADAPTER = TypeAdapter(PlayerUpdate)
+
+
+def validate_player_update(raw: Union[dict, PlayerUpdate]) -> PlayerUpdate:
+    """Check one players_update item, coercing numbers sent as strings; raises ValidationError"""
+    if isinstance(raw, PlayerUpdate):
+        return raw
+    return _ADAPTER.validate_python(raw)
+
+
+def _at_least(minimum: int) -> Callable[[int], int]:
+    return lambda value: max(value, minimum)
+
+
+def _field_map(clamps: Dict[str, Callable[[int], int]]) -> FieldMap:
+    return tuple((name, clamp) for name, clamp in clamps.items()
+                 if name in PlayerUpdate.model_fields and name in PlayerState.FIELDS)
+
+
+# Fields the DM may change after a game action, each with the bounds applied
+# before the value is stored on the player
+FIELD_MAP: FieldMap = _field_map({
+    'health_points': _at_least(0),
+    'gold': _at_least(0),
+    'damage': _at_least(0),
+})
+
+# After a dice roll the DM may also level players up and grant spell slots
+ROLL_FIELD_MAP: FieldMap = FIELD_MAP + _field_map({
+    'level': _at_least(1),
+    'magic_1lvl': _at_least(0),
+    'magic_2lvl': _at_least(0),
+})
+
+
+def apply_player_updates(room: RoomState, updates: Iterable[Union[dict, PlayerUpdate]],
+                         fields: FieldMap = FIELD_MAP) -> List[str]:
+    """Apply the DM's players_update items to the room's players.
+
+    Each item is validated once, then the stat fields in `fields` are clamped
+    and set in a single pass. Items for unknown players or that fail validation are skipped.
+    Returns the ids of the players that changed.
+    """
+    changed = []
+    for raw in updates or ():
+        try:
+            update = validate_player_update(raw)
+        except ValidationError as e:
+            logger.warning("Skipping invalid player update %s: %s", raw, e.errors(include_url=False))
+            continue
+        player = room.players.get(update.player_id)
+        if player is None:
+            logger.warning("Skipping update for unknown player %s in room %s", update.player_id, room.room_id,
+                           extra={'room_id': room.room_id})
+            continue
+        touched = False
+        for name, clamp in fields:
+            value = getattr(update, name)
+            if value is None:
+                continue
+            value = clamp(value)
+            if value != getattr(player, name):
+                setattr(player, name, value)
+                touched = True
+        if touched:
+            changed.append(update.player_id)
+    return changed
@@ -159,4 +159,18 @@ GAME_START_PROMPTS = {
     - A hook to start the adventure
     - A mysterious figure or event that draws the player in
     Keep it concise but engaging. Make it feel personal to the player's race and class."""
-} 
\ No newline at end of file
+} 
+# Summary prompts - for folding old turns into a room's running story summary
+SUMMARY_PROMPTS = {
+    "ru": """Вы ведёте краткую летопись игры D&D для Мастера.
+    Объедините предыдущую летопись и новые сообщения в одну сжатую сводку (не более {max_words} слов).
+    Сохраните: важные события и решения игроков, имена NPC и мест, полученные предметы и золото,
+    ранения, незавершённые задания и угрозы. Не выдумывайте ничего нового.
+    Ответьте только текстом сводки.""",
+
+    "en": """You keep a short chronicle of a D&D game for the Dungeon Master.
+    Merge the previous chronicle and the new messages into one compact summary (at most {max_words} words).
+    Keep: important events and player decisions, names of NPCs and places, items and gold gained,
+    injuries, unfinished quests and threats. Do not invent anything new.
+    Reply with the summary text only."""
+}
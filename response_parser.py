@@ -0,0 +1,202 @@
+"""
+Parsing of Gemini's structured DM answers.
+
+Gemini normally returns valid JSON for COMPOSITE_SCHEMA, but now and then the
+text comes wrapped in a code fence, cut off in the middle of an object, or
+with a field of the wrong type. parse_game_response() repairs what it can of
+that first answer and validates every field on its own, so one bad field does
+not throw the rest away. It also reports which parts are still missing, so
+the caller can ask Gemini for just those instead of the whole answer again.
+"""
+
+import json
+import re
+from typing import List, NamedTuple, Optional, Tuple
+
+from pydantic import TypeAdapter, ValidationError
+
+from gemini_schema import GameResponse
+from metrics import REGISTRY
+from player_updates import validate_player_update
+
+REPAIRS = REGISTRY.counter('dnd_gemini_response_repairs_total',
+                           'Fixes applied to structured Gemini answers, by kind')
+
+# Validators are built once; players_update is checked item by item
+_FIELD_ADAPTERS = {name: TypeAdapter(field.annotation) for name, field in GameResponse.model_fields.items()
+                   if name != 'players_update'}
+_FLAGS = ('player_update_required', 'dice_roll_required', 'combat_started')
+
+_FENCE = re.compile(r'^```[a-zA-Z]*\s*|\s*```$')
+_TRAILING_COMMA = re.compile(r',\s*([}\]])')
+# Cut points tried when closing a truncated object
+MAX_TRUNCATION_CUTS = 20
+
+
+class ParsedResponse(NamedTuple):
+    data: dict
+    # Parts to ask Gemini for again
+    missing: List[str]
+    repairs: List[str]
+
+
+def error_response(message: str) -> dict:
+    """An answer that carries only a message, shaped like a regular one"""
+    return {"message": message, "player_update_required": False,
+            "dice_roll_required": False, "combat_started": False}
+
+
+def _close(text: str, stack: List[str], in_string: bool) -> str:
+    return text + ('"' if in_string else '') + ''.join(reversed(stack))
+
+
+def _loads(text: str) -> Optional[dict]:
+    try:
+        value = json.loads(text)
+    except json.JSONDecodeError:
+        return None
+    return value if isinstance(value, dict) else None
+
+
+def extract_json(text: str) -> Tuple[Optional[dict], List[str]]:
+    """Find the JSON object in text, repairing the usual defects. Returns the object and the repairs made"""
+    repairs: List[str] = []
+    stripped = text.strip()
+    value = _loads(stripped)
+    if value is not None:
+        return value, repairs
+
+    if stripped.startswith('```'):
+        stripped = _FENCE.sub('', stripped)
+        repairs.append('fence')
+    start = stripped.find('{')
+    if start < 0:
+        return None, repairs
+    if start > 0:
+        repairs.append('surrounding_text')
+
+    # Walk the object to find where it ends, remembering each comma as a place to cut
+    stack: List[str] = []
+    cuts: List[Tuple[int, List[str]]] = []
+    in_string = escaped = False
+    end = None
+    for i in range(start, len(stripped)):
+        char = stripped[i]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == '\\':
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char in '{[':
+            stack.append('}' if char == '{' else ']')
+        elif char in '}]':
+            if stack:
+                stack.pop()
+            if not stack:
+                end = i + 1
+                break
+        elif char == ',':
+            cuts.append((i, list(stack)))
+
+    if end is not None:
+        body = stripped[start:end]
+        if end < len(stripped):
+            repairs.append('surrounding_text')
+        candidates = [body]
+    else:
+        repairs.append('truncated')
+        closed = _close(stripped[start:], stack, in_string)
+        # Dropping the half-written last member is safer than keeping a number or
+        # name cut short; only cut-off text (usually the narration) is kept as it is
+        dropped = [_close(stripped[start:i], kept, False) for i, kept in reversed(cuts[-MAX_TRUNCATION_CUTS:])]
+        candidates = [closed] + dropped if in_string else dropped + [closed]
+
+    for candidate in candidates:
+        value = _loads(candidate)
+        if value is None and _TRAILING_COMMA.search(candidate):
+            value = _loads(_TRAILING_COMMA.sub(r'\1', candidate))
+            if value is not None:
+                repairs.append('trailing_comma')
+        if value is not None:
+            return value, sorted(set(repairs))
+    return None, repairs
+
+
+def validate_game_response(raw: dict) -> ParsedResponse:
+    """Validate each field of a decoded answer, keeping the valid ones"""
+    data: dict = {}
+    repairs: List[str] = []
+    for name, adapter in _FIELD_ADAPTERS.items():
+        if raw.get(name) is None:
+            continue
+        try:
+            value = adapter.validate_python(raw[name])
+        except ValidationError:
+            repairs.append(f'invalid_{name}')
+            continue
+        data[name] = value.model_dump(exclude_none=True) if hasattr(value, 'model_dump') else value
+
+    updates = raw.get('players_update')
+    if isinstance(updates, list):
+        # Kept as PlayerUpdate models so applying them does not validate again
+        data['players_update'] = []
+        for item in updates:
+            try:
+                data['players_update'].append(validate_player_update(item))
+            except ValidationError:
+                repairs.append('invalid_players_update')
+    elif updates is not None:
+        repairs.append('invalid_players_update')
+
+    for flag in _FLAGS:
+        if flag not in data:
+            data[flag] = False
+            repairs.append('defaulted_flag')
+
+    missing = []
+    if not data.get('message'):
+        data.pop('message', None)
+        missing.append('message')
+    if data['dice_roll_required'] and 'dice_roll_request' not in data:
+        missing.append('dice_roll_request')
+    if data['player_update_required'] and not data.get('players_update'):
+        missing.append('players_update')
+    return ParsedResponse(data, missing, repairs)
+
+
+def parse_game_response(text: Optional[str]) -> ParsedResponse:
+    """Turn the text of a structured Gemini answer into a response dict"""
+    if not text or not text.strip():
+        record_repairs(['empty'])
+        return ParsedResponse({flag: False for flag in _FLAGS}, ['message'], ['empty'])
+    raw, repairs = extract_json(text)
+    if raw is None:
+        # Plain prose instead of JSON still makes a usable narration
+        parsed = ParsedResponse(error_response(text.strip()), [], repairs + ['prose'])
+    else:
+        parsed = validate_game_response(raw)
+        parsed = ParsedResponse(parsed.data, parsed.missing, repairs + parsed.repairs)
+    record_repairs(parsed.repairs)
+    return parsed
+
+
+def merge_portion(parsed: ParsedResponse, text: Optional[str]) -> ParsedResponse:
+    """Fill the missing parts of an answer from a follow-up answer that carries only those"""
+    raw, repairs = extract_json(text or '')
+    if raw is None:
+        record_repairs(repairs + ['portion_failed'])
+        return parsed
+    portion = validate_game_response({**parsed.data, **{name: raw.get(name) for name in parsed.missing}})
+    data = {**parsed.data, **{name: portion.data[name] for name in parsed.missing if name in portion.data}}
+    missing = [name for name in parsed.missing if name not in data or not data[name]]
+    record_repairs(repairs + ['portion_retry'])
+    return ParsedResponse(data, missing, parsed.repairs + repairs + ['portion_retry'])
+
+
+def record_repairs(repairs: List[str]):
+    for repair in repairs:
+        REPAIRS.inc(repair=repair)
@@ -0,0 +1,94 @@
+import logging
+from threading import Lock
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class _RoomSnapshot:
+    """Last observed room payload, with the revision at which each part last changed"""
+
+    def __init__(self, revision: int):
+        self.baseline = revision
+        self.revision = revision
+        self.fields: Dict[str, object] = {}
+        self.field_revs: Dict[str, int] = {}
+        self.players: Dict[str, dict] = {}
+        self.player_revs: Dict[str, Dict[str, int]] = {}
+        self.player_added: Dict[str, int] = {}
+        self.removed: Dict[str, int] = {}
+
+
+class RoomDeltaTracker:
+    """Computes room-state deltas between the revision a client has and the current one.
+
+    Every time a room is served at a new revision, its payload is compared with
+    the previous one and each changed room field and player field is stamped
+    with that revision. A client that sends back the revision it last saw then
+    receives only the parts stamped later. Clients older than the first revision
+    this process observed, or ahead of the current one, get a full snapshot.
+    """
+
+    def __init__(self):
+        self._rooms: Dict[str, _RoomSnapshot] = {}
+        self._lock = Lock()
+
+    def diff(self, room_id: str, revision: int, fields: dict, players: Dict[str, dict],
+             since: Optional[int] = None) -> dict:
+        """Return the changes since `since`, or a full snapshot if that revision is unknown"""
+        with self._lock:
+            snapshot = self._rooms.get(room_id)
+            if snapshot is None or revision < snapshot.revision:
+                snapshot = _RoomSnapshot(revision)
+                self._rooms[room_id] = snapshot
+                self._observe(snapshot, revision, fields, players)
+            elif revision != snapshot.revision:
+                self._observe(snapshot, revision, fields, players)
+
+            if since is None or since < snapshot.baseline or since > revision:
+                return {'revision': revision, 'full': True, 'room': dict(fields),
+                        'players': dict(players), 'removed_players': []}
+
+            changed_fields = {k: v for k, v in fields.items() if snapshot.field_revs.get(k, 0) > since}
+            changed_players = {}
+            for player_id, data in players.items():
+                if snapshot.player_added[player_id] > since:
+                    changed_players[player_id] = data
+                    continue
+                revs = snapshot.player_revs[player_id]
+                changed = {k: v for k, v in data.items() if revs.get(k, 0) > since}
+                if changed:
+                    changed_players[player_id] = changed
+            removed: List[str] = [pid for pid, rev in snapshot.removed.items() if rev > since]
+            return {'revision': revision, 'full': False, 'room': changed_fields,
+                    'players': changed_players, 'removed_players': removed}
+
+    @staticmethod
+    def _observe(snapshot: _RoomSnapshot, revision: int, fields: dict, players: Dict[str, dict]):
+        for key, value in fields.items():
+            if key not in snapshot.fields or snapshot.fields[key] != value:
+                snapshot.field_revs[key] = revision
+        snapshot.fields = dict(fields)
+
+        for player_id, data in players.items():
+            old = snapshot.players.get(player_id)
+            if old is None:
+                snapshot.player_added[player_id] = revision
+                snapshot.player_revs[player_id] = {key: revision for key in data}
+                snapshot.removed.pop(player_id, None)
+                continue
+            revs = snapshot.player_revs[player_id]
+            for key, value in data.items():
+                if key not in old or old[key] != value:
+                    revs[key] = revision
+        for player_id in snapshot.players.keys() - players.keys():
+            snapshot.removed[player_id] = revision
+            snapshot.player_revs.pop(player_id, None)
+            snapshot.player_added.pop(player_id, None)
+        snapshot.players = dict(players)
+        snapshot.revision = revision
+
+    def forget(self, room_id: str):
+        """Drop the snapshot of a room that left memory"""
+        with self._lock:
+            self._rooms.pop(room_id, None)
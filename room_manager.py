@@ -1,145 +1,536 @@
 import uuid
-from typing import Dict, Optional
-from gemini_schema import PlayerState, RoomState
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Set, Tuple
+from gemini_schema import PlayerState, RoomState, RoomMessage
+from save_index import SaveIndex
+from room_delta import RoomDeltaTracker
+from save_format import write_save, read_save, find_save, SAVE_SUFFIX, LEGACY_SUFFIX
+import heapq
 import json
+import logging
 import os
+import threading
+import time
 from pathlib import Path
-from datetime import datetime
+from datetime import datetime, timedelta
+from threading import Lock, RLock
+
+logger = logging.getLogger(__name__)
+
+# Number of messages kept per room, both for the UI feed and the LLM context
+MESSAGE_LIMIT = 100
+
+def dump_player(player: PlayerState) -> dict:
+    """Serialize a player to JSON-compatible data"""
+    return player.to_dict()
+
+def load_player(data: dict) -> PlayerState:
+    """Rebuild a player from dump_player output"""
+    return PlayerState.from_dict(data)
+
+def dump_room(room: RoomState) -> dict:
+    """Serialize a room to JSON-compatible data"""
+    data = room.model_dump(mode='json', exclude={'players'})
+    data['spectator_token'] = room.spectator_token
+    data['players'] = {pid: dump_player(p) for pid, p in room.players.items()}
+    return data
+
+def initial_revision(previous: int = 0) -> int:
+    """Starting revision for a room entering a manager.
+
+    Revisions start from the clock so they keep increasing across eviction,
+    hydration and restarts, and a client's old revision is never mistaken for
+    a new one.
+    """
+    return max(previous + 1, time.time_ns() // 1000)
+
+def load_room_state(data: dict) -> RoomState:
+    """Rebuild a room from dump_room output"""
+    players = {pid: load_player(p) for pid, p in data.get('players', {}).items()}
+    return RoomState(**{**data, 'players': players})
+
+class RoomLock:
+    """A room's lock, as handed out by RoomManager.room_lock.
+
+    The lock itself lives in the manager's table only while a thread holds or
+    waits for it: acquire() looks it up (creating it if needed) and the last
+    release() drops it. Rooms can then be evicted or discarded without ever
+    giving a second thread a fresh lock while the old one is still held.
+    """
+
+    def __init__(self, manager: "RoomManager", room_id: str):
+        self.manager = manager
+        self.room_id = room_id
+
+    def acquire(self, blocking: bool = True) -> bool:
+        lock = self.manager._use_lock(self.room_id)
+        if lock.acquire(blocking):
+            return True
+        self.manager._unuse_lock(self.room_id, release=False)
+        return False
+
+    def release(self):
+        self.manager._unuse_lock(self.room_id, release=True)
+
+    def __enter__(self):
+        return self.acquire()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+
+class _LockEntry:
+    __slots__ = ('lock', 'users')
+
+    def __init__(self, lock):
+        self.lock = lock
+        # Threads holding or waiting for the lock
+        self.users = 0
 
 class RoomManager:
-    def __init__(self):
-        self.rooms: Dict[str, RoomState] = {}
+    def __init__(self, idle_minutes: int = 60, max_resident_rooms: int = 1000):
+        # Resident rooms in least-recently-used order; the rest are hydrated
+        # from their save files on first access
+        self.rooms: "OrderedDict[str, RoomState]" = OrderedDict()
+        # Guards the LRU order: lookups reorder self.rooms while installs and evictions resize it
+        self._lru_lock = Lock()
+        self.max_resident_rooms = max_resident_rooms
+        self.messages: Dict[str, List[dict]] = {}
+        self.locks: Dict[str, _LockEntry] = {}
+        self._next_message_id: Dict[str, int] = {}
+        self._locks_guard = Lock()
+        # Per-room revision, bumped on every change clients can see
+        self.revisions: Dict[str, int] = {}
+        self.deltas = RoomDeltaTracker()
+        # Conditions long-polling requests wait on, created for watched rooms only
+        self._revision_watchers: Dict[str, threading.Condition] = {}
+        # Callbacks run on every revision bump of a room, e.g. to wake async waiters
+        self._revision_listeners: Dict[str, Set[Callable[[str], None]]] = {}
         self.save_folder = Path("saves")
         self.save_folder.mkdir(exist_ok=True)
+        self.save_index = SaveIndex.for_folder(self.save_folder)
+        
+        # Expiry bookkeeping: a min-heap of (last activity, room_id) with at most
+        # one entry per room; stale entries are re-pushed when they surface
+        self.idle_minutes = idle_minutes
+        self._expiry_heap: List[Tuple[float, str]] = []
+        self._scheduled: Set[str] = set()
+        self._expiry_lock = Lock()
+        self._reaper_stop = threading.Event()
+        self.stats = {'rooms_evicted': 0, 'rooms_spilled': 0, 'rooms_hydrated': 0, 'bytes_reclaimed': 0}
     
     def create_room(self, host_id: str, language: str = 'en') -> str:
         """Create a new room and return its ID"""
         room_id = str(uuid.uuid4())[:8]  # Use first 8 chars for shorter codes
-        self.rooms[room_id] = RoomState(
+        self._install(RoomState(
             room_id=room_id,
             host_id=host_id,
             players={},
             language=language
-        )
+        ))
         return room_id
     
     def join_room(self, room_id: str, player_id: str, player_name: str) -> Optional[RoomState]:
         """Add a player to a room"""
-        if room_id not in self.rooms:
-            return None
-            
-        room = self.rooms[room_id]
-        if player_id not in room.players:
-            room.players[player_id] = PlayerState(
-                id=player_id,
-                name=player_name,
-                race="",
-                class_name="",
-                health_points=0,
-                gold=0,
-                damage=0,
-                level=0,
-                magic_1lvl=0,
-                magic_2lvl=0,
-                strength=10,
-                dexterity=10,
-                constitution=10,
-                intelligence=10,
-                wisdom=10,
-                charisma=10
-            )
-        return room
+        # Locked so the reaper cannot spill the room before the new player is in it
+        with self.room_lock(room_id):
+            room = self.get_room(room_id)
+            if room is None:
+                return None
+                
+            if player_id not in room.players:
+                room.players[player_id] = self._new_player(player_id, player_name)
+                self._bump_revision(room_id)
+            return room
+    
+    @staticmethod
+    def _new_player(player_id: str, player_name: str) -> PlayerState:
+        """Create a fresh player that has not chosen a race and class yet"""
+        return PlayerState(
+            id=player_id,
+            name=player_name,
+            race="",
+            class_name="",
+            health_points=0,
+            gold=0,
+            damage=0,
+            level=0,
+            magic_1lvl=0,
+            magic_2lvl=0,
+            strength=10,
+            dexterity=10,
+            constitution=10,
+            intelligence=10,
+            wisdom=10,
+            charisma=10
+        )
     
     def leave_room(self, room_id: str, player_id: str) -> bool:
         """Remove a player from a room"""
-        if room_id not in self.rooms:
-            return False
-            
-        room = self.rooms[room_id]
-        if player_id not in room.players:
-            return False
+        # Locked so the reaper cannot spill the room between the change and a deletion
+        with self.room_lock(room_id):
+            room = self.get_room(room_id)
+            if room is None:
+                return False
+                
+            if player_id not in room.players:
+                return False
+                
+            # Remove player from room
+            del room.players[player_id]
+            self._bump_revision(room_id)
+
+            # Only change host if leaving player was the host
+            if player_id == room.host_id:
+                if room.players:
+                    # Assign new host from remaining players
+                    room.host_id = next(iter(room.players.keys()))
+                else:
+                    # Delete empty room
+                    self.delete_room(room_id)
             
-        # Remove player from room
-        del room.players[player_id]
-
-        # Only change host if leaving player was the host
-        if player_id == room.host_id:
-            if room.players:
-                # Assign new host from remaining players
-                room.host_id = next(iter(room.players.keys()))
-            else:
-                # Delete empty room
-                del self.rooms[room_id]
-        
-        return True
+            return True
     
     def get_room(self, room_id: str) -> Optional[RoomState]:
-        """Get room by ID"""
+        """Get room by ID, hydrating it from its save file if it is not resident"""
+        with self._lru_lock:
+            room = self.rooms.get(room_id)
+            if room is not None:
+                self.rooms.move_to_end(room_id)
+        if room is None:
+            room = self._hydrate(room_id)
+            if room is None:
+                return None
+        self.touch(room_id)
+        return room
+    
+    def peek_room(self, room_id: str) -> Optional[RoomState]:
+        """A resident room, read without hydrating it, reordering the LRU or stamping activity"""
         return self.rooms.get(room_id)
     
+    def _hydrate(self, room_id: str) -> Optional[RoomState]:
+        """Load a saved or evicted room back into memory"""
+        if f"room_{room_id}" not in self.save_index:
+            return None
+        with self.room_lock(room_id):
+            # Another thread may have hydrated it while we waited for the lock
+            if room_id in self.rooms:
+                return self.rooms[room_id]
+            room = self._read_save(room_id)
+            if room is None:
+                return None
+            self._install(room)
+            self.stats['rooms_hydrated'] += 1
+            logger.info(f"Hydrated room {room_id} from disk")
+            return room
+    
+    def _install(self, room: RoomState):
+        """Make a room resident, rebuilding its message feed and enforcing the LRU cap"""
+        room_id = room.room_id
+        with self._lru_lock:
+            self.rooms[room_id] = room
+            self.rooms.move_to_end(room_id)
+            lru_ids = list(self.rooms)[:max(0, len(self.rooms) - self.max_resident_rooms)]
+        self.revisions[room_id] = initial_revision(self.revisions.get(room_id, 0))
+        if room_id not in self.messages:
+            feed = []
+            for i, message in enumerate(room.message_history, start=1):
+                data = message.model_dump(mode='json')
+                if data['id'] is None:  # saved before messages carried their IDs
+                    data['id'] = i
+                if data['detailed_result'] is None:
+                    del data['detailed_result']
+                feed.append(data)
+            self.messages[room_id] = feed
+            self._next_message_id[room_id] = max((m['id'] for m in feed), default=0)
+        self.touch(room_id)
+        
+        # Evict least recently used rooms, skipping any a request is working on
+        for lru_id in lru_ids:
+            if lru_id != room_id:
+                self._evict(lru_id)
+    
+    def touch(self, room_id: str):
+        """Stamp room activity and make sure the room has an expiry entry"""
+        room = self.rooms.get(room_id)
+        if room is None:
+            return
+        room.last_activity = datetime.now()
+        self._reschedule(room_id, room.last_activity.timestamp())
+    
+    def discard_room(self, room_id: str) -> int:
+        """Drop a room with its message feed; returns the bytes released"""
+        with self._lru_lock:
+            room = self.rooms.pop(room_id, None)
+        messages = self.messages.pop(room_id, [])
+        self._next_message_id.pop(room_id, None)
+        self.revisions.pop(room_id, None)
+        self.deltas.forget(room_id)
+        self._notify_revision(room_id)
+        with self._locks_guard:
+            self._revision_watchers.pop(room_id, None)
+        with self._expiry_lock:
+            self._scheduled.discard(room_id)
+        
+        size = len(json.dumps(messages))
+        if room is not None:
+            size += len(room.model_dump_json())
+        return size
+    
+    def delete_room(self, room_id: str) -> int:
+        """Remove a room for good, save file included, so it is never hydrated again"""
+        size = self.discard_room(room_id)
+        name = f"room_{room_id}"
+        for suffix in (SAVE_SUFFIX, LEGACY_SUFFIX):
+            (self.save_folder / f"{name}{suffix}").unlink(missing_ok=True)
+        self.save_index.remove(name)
+        return size
+    
     def update_player(self, room_id: str, player_state: PlayerState) -> bool:
         """Update player state in a room"""
-        if room_id not in self.rooms:
+        room = self.get_room(room_id)
+        if room is None:
             return False
             
-        room = self.rooms[room_id]
         if player_state.id in room.players:
             room.players[player_state.id] = player_state
+            self._bump_revision(room_id)
             return True
         return False
     
     def update_room(self, room_state: RoomState) -> bool:
-        """Update entire room state"""
-        if room_state.room_id not in self.rooms:
-            return False
-            
-        # Preserve language when updating room state
-        old_room = self.rooms[room_state.room_id]
-        room_state.language = old_room.language
-        self.rooms[room_state.room_id] = room_state
+        """Update entire room state; False if the room was deleted"""
+        room_id = room_state.room_id
+        with self.room_lock(room_id):
+            with self._lru_lock:
+                old_room = self.rooms.get(room_id)
+                if old_room is not None:
+                    # Preserve language when updating room state
+                    room_state.language = old_room.language
+                    room_state.version += 1
+                    self.rooms[room_id] = room_state
+            if old_room is None:
+                # Deleted rooms stay deleted
+                if f"room_{room_id}" not in self.save_index:
+                    return False
+                # Spilled since the caller read it: the caller's copy is the newest state
+                room_state.version += 1
+                self._install(room_state)
+                self.stats['rooms_hydrated'] += 1
+        self._bump_revision(room_id)
         return True
     
+    def _bump_revision(self, room_id: str):
+        self.revisions[room_id] = self.revisions.get(room_id, 0) + 1
+        self._notify_revision(room_id)
+    
+    def _notify_revision(self, room_id: str):
+        watcher = self._revision_watchers.get(room_id)
+        if watcher is not None:
+            with watcher:
+                watcher.notify_all()
+        with self._locks_guard:
+            listeners = list(self._revision_listeners.get(room_id, ()))
+        for listener in listeners:
+            listener(room_id)
+    
+    def add_revision_listener(self, room_id: str, listener: Callable[[str], None]):
+        """Call `listener(room_id)` from the writing thread whenever this process bumps the room's revision"""
+        with self._locks_guard:
+            self._revision_listeners.setdefault(room_id, set()).add(listener)
+    
+    def remove_revision_listener(self, room_id: str, listener: Callable[[str], None]):
+        with self._locks_guard:
+            listeners = self._revision_listeners.get(room_id)
+            if listeners is not None:
+                listeners.discard(listener)
+                if not listeners:
+                    del self._revision_listeners[room_id]
+    
+    def wait_for_revision(self, room_id: str, known: int, timeout: float) -> Optional[int]:
+        """Block until the room's revision moves past `known` or the timeout expires"""
+        with self._locks_guard:
+            watcher = self._revision_watchers.setdefault(room_id, threading.Condition())
+        with watcher:
+            watcher.wait_for(lambda: self.revisions.get(room_id) != known, timeout)
+        return self.revisions.get(room_id)
+    
+    def revision(self, room_id: str) -> Optional[int]:
+        """Current revision of a resident room, or None if it is not in memory"""
+        return self.revisions.get(room_id)
+    
+    def room_lock(self, room_id: str) -> RoomLock:
+        """The lock serializing read-modify-write cycles on a room"""
+        return RoomLock(self, room_id)
+    
+    def _new_lock(self, room_id: str):
+        return RLock()
+    
+    def _use_lock(self, room_id: str):
+        """Register a thread about to acquire the room's lock and return the lock"""
+        with self._locks_guard:
+            entry = self.locks.get(room_id)
+            if entry is None:
+                entry = self.locks[room_id] = _LockEntry(self._new_lock(room_id))
+            entry.users += 1
+            return entry.lock
+    
+    def _unuse_lock(self, room_id: str, release: bool):
+        """Release the room's lock (or give up waiting) and drop it once nobody uses it"""
+        with self._locks_guard:
+            entry = self.locks[room_id]
+            if release:
+                entry.lock.release()
+            entry.users -= 1
+            if entry.users == 0:
+                del self.locks[room_id]
+    
+    def add_message(self, room_id: str, message_data: dict) -> Optional[int]:
+        """Append a message to the room feed and its LLM history, returning its ID"""
+        if room_id not in self.rooms:
+            return None
+        with self.room_lock(room_id):
+            message_id = self._next_message_id.get(room_id, 0) + 1
+            self._next_message_id[room_id] = message_id
+            message_data = {'id': message_id, **message_data}
+            
+            messages = self.messages.setdefault(room_id, [])
+            messages.append(message_data)
+            if len(messages) > MESSAGE_LIMIT:
+                del messages[:-MESSAGE_LIMIT]
+            
+            room = self.rooms.get(room_id)
+            if room:
+                room.message_history.append(RoomMessage(**message_data))
+                if len(room.message_history) > MESSAGE_LIMIT:
+                    room.message_history = room.message_history[-MESSAGE_LIMIT:]
+            self._bump_revision(room_id)
+            return message_id
+    
+    def get_messages(self, room_id: str, last_message_id: Optional[int] = None, limit: int = 50) -> List[dict]:
+        """Get messages newer than last_message_id, or the latest `limit` messages"""
+        messages = self.messages.get(room_id, [])
+        if last_message_id is None:
+            return messages[-limit:]
+        return [msg for msg in messages if msg['id'] > last_message_id]
+    
     def save_room(self, room_id: str) -> bool:
         """Save room state to file"""
-        if room_id not in self.rooms:
+        room = self.get_room(room_id)
+        if room is None:
             return False
-            
-        room = self.rooms[room_id]
-        save_path = self.save_folder / f"room_{room_id}.json"
+        return self._write_save(room)
+    
+    def _write_save(self, room: RoomState) -> bool:
+        """Write a room to its save file"""
+        save_path = self.save_folder / f"room_{room.room_id}{SAVE_SUFFIX}"
         
         try:
-            with save_path.open('w') as f:
-                json.dump(room.dict(), f, indent=2)
+            data = dump_room(room)
+            write_save(save_path, data)
+            # A legacy JSON save for the same room is superseded now
+            save_path.with_suffix(LEGACY_SUFFIX).unlink(missing_ok=True)
+            self.save_index.add(save_path.stem, save_path, data)
             return True
         except Exception:
+            logger.error(f"Failed to save room {room.room_id}", exc_info=True)
             return False
     
     def load_room(self, room_id: str) -> Optional[RoomState]:
         """Load room state from file"""
-        save_path = self.save_folder / f"room_{room_id}.json"
+        room = self._read_save(room_id)
+        if room is not None:
+            with self.room_lock(room_id):
+                self._install(room)
+        return room
+    
+    def _read_save(self, room_id: str) -> Optional[RoomState]:
+        """Read a saved room from file without installing it"""
+        save_path = find_save(self.save_folder, f"room_{room_id}")
         
-        if not save_path.exists():
+        if save_path is None:
             return None
             
         try:
-            with save_path.open('r') as f:
-                data = json.load(f)
-                room = RoomState(**data)
-                self.rooms[room_id] = room
-                return room
+            return load_room_state(read_save(save_path))
         except Exception:
+            logger.error(f"Failed to read save for room {room_id}", exc_info=True)
             return None
     
-    def cleanup_inactive_rooms(self, max_age_minutes: int = 60):
-        """Remove rooms that have been inactive for too long"""
-        current_time = datetime.now()
-        rooms_to_remove = []
+    def cleanup_inactive_rooms(self, max_age_minutes: Optional[int] = None):
+        """Spill rooms that have been inactive for too long to disk and evict them"""
+        max_age = timedelta(minutes=self.idle_minutes if max_age_minutes is None else max_age_minutes)
+        cutoff = (datetime.now() - max_age).timestamp()
+        evicted = 0
+        
+        while True:
+            with self._expiry_lock:
+                if not self._expiry_heap or self._expiry_heap[0][0] > cutoff:
+                    break
+                _, room_id = heapq.heappop(self._expiry_heap)
+                self._scheduled.discard(room_id)
+            
+            room = self.rooms.get(room_id)
+            if room is None:
+                continue
+            if room.last_activity and room.last_activity.timestamp() > cutoff:
+                # Touched since this entry was pushed; reschedule at its real deadline
+                self._reschedule(room_id, room.last_activity.timestamp())
+                continue
+            
+            if self._evict(room_id):
+                evicted += 1
+            else:
+                # A request is working on the room right now, so it is not idle
+                self.touch(room_id)
         
-        for room_id, room in self.rooms.items():
-            if room.last_activity:
-                age = (current_time - room.last_activity).total_seconds() / 60
-                if age > max_age_minutes:
-                    rooms_to_remove.append(room_id)
+        if evicted:
+            logger.info(f"Evicted {evicted} idle rooms, {len(self.rooms)} rooms live")
+        return evicted
+    
+    def _evict(self, room_id: str) -> bool:
+        """Spill a resident room to disk and drop it from memory unless it is in use"""
+        room = self.rooms.get(room_id)
+        if room is None:
+            return False
+        lock = self.room_lock(room_id)
+        if not lock.acquire(blocking=False):
+            return False
+        try:
+            # Deleted (or replaced) while we were getting the lock: nothing to spill
+            if self.rooms.get(room_id) is not room:
+                return False
+            if self._write_save(room):
+                self.stats['rooms_spilled'] += 1
+            self.stats['bytes_reclaimed'] += self.discard_room(room_id)
+            self.stats['rooms_evicted'] += 1
+            return True
+        finally:
+            lock.release()
+    
+    def _reschedule(self, room_id: str, timestamp: float):
+        """Push an expiry entry for a room unless it already has one"""
+        with self._expiry_lock:
+            if room_id not in self._scheduled:
+                self._scheduled.add(room_id)
+                heapq.heappush(self._expiry_heap, (timestamp, room_id))
+    
+    def get_stats(self) -> dict:
+        """Room counters for monitoring"""
+        players = sum(len(room.players) for room in list(self.rooms.values()))
+        return {'rooms_live': len(self.rooms), 'players_live': players, **self.stats}
+    
+    def start_reaper(self, interval_seconds: int = 60):
+        """Evict idle rooms periodically from a daemon thread"""
+        def run():
+            while not self._reaper_stop.wait(interval_seconds):
+                try:
+                    self.cleanup_inactive_rooms()
+                except Exception:
+                    logger.error("Room reaper failed", exc_info=True)
         
-        for room_id in rooms_to_remove:
-            del self.rooms[room_id] 
\ No newline at end of file
+        thread = threading.Thread(target=run, name="room-reaper", daemon=True)
+        thread.start()
+        return thread
+    
+    def stop_reaper(self):
+        self._reaper_stop.set() 
\ No newline at end of file
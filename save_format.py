@@ -0,0 +1,177 @@
+"""
+Compact save file format shared by room saves and DnDGame quicksaves.
+
+A save file is a fixed header followed by zlib-compressed compact JSON:
+
+    magic     4 bytes   b'DNDS'
+    schema    1 byte    SCHEMA_VERSION the payload was written with
+    codec     1 byte    CODEC_ZLIB_JSON
+    checksum  4 bytes   CRC32 of the compressed payload
+    length    8 bytes   size of the compressed payload
+
+Files are written and read in chunks, so a save never has to exist as one
+big string in memory. Plain indented .json saves from older versions are
+still readable and can be converted with `python save_format.py convert`.
+"""
+
+import json
+import os
+import sqlite3
+import struct
+import sys
+import zlib
+from contextlib import closing
+from pathlib import Path
+from typing import Callable, Dict, Iterator, Optional
+
+MAGIC = b'DNDS'
+SCHEMA_VERSION = 1
+CODEC_ZLIB_JSON = 1
+HEADER = struct.Struct('>4sBBIQ')
+SAVE_SUFFIX = '.sav'
+LEGACY_SUFFIX = '.json'
+CHUNK_SIZE = 64 * 1024
+
+
+class SaveFormatError(Exception):
+    """Raised when a save file is corrupt or was written by a newer version"""
+
+
+def _migrate_room_v0(data: dict) -> dict:
+    """Legacy room saves stored history as user_message/dm_response pairs"""
+    history = []
+    for message in data.get('message_history', []):
+        if 'type' in message:
+            history.append(message)
+            continue
+        timestamp = message.get('timestamp')
+        if message.get('user_message'):
+            history.append({'type': 'player', 'message': message['user_message'],
+                            'player_name': message.get('player_name'), 'timestamp': timestamp})
+        if message.get('dm_response'):
+            history.append({'type': 'dm', 'message': message['dm_response'], 'timestamp': timestamp})
+    return {**data, 'message_history': history}
+
+
+# Upgrade steps keyed by the schema version they upgrade from
+MIGRATIONS: Dict[int, Callable[[dict], dict]] = {
+    0: lambda data: _migrate_room_v0(data) if 'room_id' in data else data,
+}
+
+
+def migrate(data: dict, schema: int) -> dict:
+    """Bring a payload written with an older schema up to SCHEMA_VERSION"""
+    if schema > SCHEMA_VERSION:
+        raise SaveFormatError(f"Save uses schema {schema}, newer than supported {SCHEMA_VERSION}")
+    for version in range(schema, SCHEMA_VERSION):
+        data = MIGRATIONS[version](data)
+    return data
+
+
+def _encode(data: dict) -> Iterator[bytes]:
+    encoder = json.JSONEncoder(ensure_ascii=False, separators=(',', ':'))
+    compressor = zlib.compressobj(level=6)
+    for piece in encoder.iterencode(data):
+        chunk = compressor.compress(piece.encode('utf-8'))
+        if chunk:
+            yield chunk
+    yield compressor.flush()
+
+
+def write_save(path, data: dict):
+    """Write data to path in the compact format, replacing the file atomically"""
+    path = Path(path)
+    tmp_path = path.with_name(path.name + '.tmp')
+    checksum = 0
+    length = 0
+    with tmp_path.open('wb') as f:
+        f.write(HEADER.pack(MAGIC, SCHEMA_VERSION, CODEC_ZLIB_JSON, 0, 0))
+        for chunk in _encode(data):
+            f.write(chunk)
+            checksum = zlib.crc32(chunk, checksum)
+            length += len(chunk)
+        f.seek(0)
+        f.write(HEADER.pack(MAGIC, SCHEMA_VERSION, CODEC_ZLIB_JSON, checksum, length))
+    os.replace(tmp_path, path)
+
+
+def read_save(path) -> dict:
+    """Read a compact or legacy JSON save, migrated to the current schema"""
+    path = Path(path)
+    with path.open('rb') as f:
+        header = f.read(HEADER.size)
+        if not header.startswith(MAGIC):
+            # Legacy indented JSON written before the compact format existed
+            f.seek(0)
+            return migrate(json.loads(f.read().decode('utf-8')), 0)
+
+        if len(header) < HEADER.size:
+            raise SaveFormatError(f"{path}: truncated header")
+        _, schema, codec, checksum, length = HEADER.unpack(header)
+        if codec != CODEC_ZLIB_JSON:
+            raise SaveFormatError(f"{path}: unknown codec {codec}")
+
+        decompressor = zlib.decompressobj()
+        parts = []
+        crc = 0
+        remaining = length
+        while remaining > 0:
+            chunk = f.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                raise SaveFormatError(f"{path}: truncated payload")
+            crc = zlib.crc32(chunk, crc)
+            parts.append(decompressor.decompress(chunk))
+            remaining -= len(chunk)
+        if crc != checksum:
+            raise SaveFormatError(f"{path}: checksum mismatch")
+        parts.append(decompressor.flush())
+
+    return migrate(json.loads(b''.join(parts).decode('utf-8')), schema)
+
+
+def find_save(folder, name: str) -> Optional[Path]:
+    """Locate a save by name, preferring the compact file over a legacy one"""
+    for suffix in (SAVE_SUFFIX, LEGACY_SUFFIX):
+        path = Path(folder) / f"{name}{suffix}"
+        if path.exists():
+            return path
+    return None
+
+
+def convert_folder(folder, keep_legacy: bool = False) -> int:
+    """Convert every legacy .json save in folder to the compact format"""
+    converted = 0
+    for legacy_path in Path(folder).glob(f'*{LEGACY_SUFFIX}'):
+        if legacy_path.name == 'index.json':
+            continue
+        try:
+            data = read_save(legacy_path)
+        except (OSError, ValueError, SaveFormatError) as e:
+            print(f"Skipping {legacy_path.name}: {e}")
+            continue
+        new_path = legacy_path.with_suffix(SAVE_SUFFIX)
+        write_save(new_path, data)
+        print(f"{legacy_path.name}: {legacy_path.stat().st_size} -> {new_path.stat().st_size} bytes")
+        if not keep_legacy:
+            legacy_path.unlink()
+        converted += 1
+
+    # File names changed, so have the save index rebuild itself on next start
+    index_path = Path(folder) / 'index.db'
+    if converted and index_path.exists():
+        with closing(sqlite3.connect(index_path)) as conn:
+            conn.execute("PRAGMA user_version = 0")
+    return converted
+
+
+def main():
+    if len(sys.argv) < 2 or sys.argv[1] != 'convert':
+        print("Usage: python save_format.py convert [saves_folder] [--keep]")
+        return
+    folder = next((arg for arg in sys.argv[2:] if not arg.startswith('--')), 'saves')
+    converted = convert_folder(folder, keep_legacy='--keep' in sys.argv)
+    print(f"Converted {converted} save(s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,210 @@
+import json
+import logging
+import sqlite3
+import threading
+from datetime import datetime
+from pathlib import Path
+from threading import Lock
+from typing import Dict, List, Optional, Set, Tuple
+
+from save_format import read_save, SAVE_SUFFIX, LEGACY_SUFFIX
+
+logger = logging.getLogger(__name__)
+
+# Bumped whenever the shape of a catalog entry changes, forcing a rebuild
+INDEX_VERSION = 2
+# The catalog used to be a JSON file rewritten on every save
+LEGACY_INDEX = 'index.json'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS saves (
+    name TEXT PRIMARY KEY,
+    last_activity TEXT NOT NULL,
+    entry TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_saves_activity ON saves(last_activity, name);
+
+CREATE TABLE IF NOT EXISTS save_keys (
+    field TEXT NOT NULL,
+    value TEXT NOT NULL,
+    name TEXT NOT NULL,
+    PRIMARY KEY (field, value, name)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_save_keys_name ON save_keys(name);
+"""
+
+_instances: Dict[Path, "SaveIndex"] = {}
+_instances_guard = Lock()
+
+
+def describe_save(data: dict) -> dict:
+    """Summarize save data into the fields the catalog can be queried by"""
+    if 'room_id' in data:
+        players = [
+            {'name': p.get('name'), 'race': p.get('race'), 'class_name': p.get('class_name')}
+            for p in data.get('players', {}).values()
+        ]
+        return {
+            'kind': 'room',
+            'room_id': data['room_id'],
+            'language': data.get('language', 'en'),
+            'players': players,
+            'last_activity': data.get('last_activity') or data.get('created_at'),
+        }
+    # Single player DnDGame quicksave
+    players = []
+    if data.get('player_race') or data.get('player_class'):
+        players.append({'name': None, 'race': data.get('player_race'), 'class_name': data.get('player_class')})
+    return {
+        'kind': 'game',
+        'room_id': None,
+        'language': data.get('language', 'en'),
+        'players': players,
+        'last_activity': None,
+    }
+
+
+class SaveIndex:
+    """Catalog of saves, so listing them never has to open or scan save files.
+
+    The catalog lives in saves/index.db, a SQLite database shared by every
+    process writing to the folder. It maps each save name (the file name
+    without its suffix, e.g. room_1a2b3c4d) to a summary that is updated on
+    every write, with the fields it can be filtered by in their own indexed
+    table. It is rebuilt from the folder contents if it is new or was written
+    by an older version.
+    """
+
+    def __init__(self, save_folder: Path, filename: str = "index.db"):
+        self.save_folder = Path(save_folder)
+        self.path = self.save_folder / filename
+        self._local = threading.local()
+        conn = self._connection()
+        conn.executescript(SCHEMA)
+        (version,) = conn.execute("PRAGMA user_version").fetchone()
+        if version != INDEX_VERSION:
+            self.rebuild()
+
+    @classmethod
+    def for_folder(cls, save_folder) -> "SaveIndex":
+        """Shared catalog for a folder, so one process opens it once"""
+        key = Path(save_folder).resolve()
+        with _instances_guard:
+            if key not in _instances:
+                _instances[key] = cls(save_folder)
+            return _instances[key]
+
+    def _connection(self) -> sqlite3.Connection:
+        """Get this thread's connection, opening it on first use"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def rebuild(self) -> int:
+        """Scan the saves folder once and write a fresh catalog; returns the number of saves"""
+        entries = {}
+        for save_path in sorted(self.save_folder.iterdir()):
+            if save_path.suffix not in (SAVE_SUFFIX, LEGACY_SUFFIX) or save_path.name == LEGACY_INDEX:
+                continue
+            # The compact file wins over a legacy one with the same name
+            if save_path.stem in entries and save_path.suffix == LEGACY_SUFFIX:
+                continue
+            try:
+                entry = describe_save(read_save(save_path))
+            except Exception:
+                logger.warning(f"Skipping unreadable save {save_path.name}")
+                continue
+            stat = save_path.stat()
+            if entry['last_activity'] is None:
+                entry['last_activity'] = datetime.fromtimestamp(stat.st_mtime).isoformat()
+            entries[save_path.stem] = {'file': save_path.name, 'size': stat.st_size, **entry}
+
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM save_keys")
+            conn.execute("DELETE FROM saves")
+            for name, entry in entries.items():
+                self._insert(conn, name, entry)
+            conn.execute(f"PRAGMA user_version = {INDEX_VERSION}")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+        (self.save_folder / LEGACY_INDEX).unlink(missing_ok=True)
+        logger.info(f"Rebuilt save index with {len(entries)} saves")
+        return len(entries)
+
+    @staticmethod
+    def _filter_keys(entry: dict) -> Set[Tuple[str, str]]:
+        keys = {('kind', entry.get('kind')), ('language', entry.get('language'))}
+        for player in entry.get('players', []):
+            if player.get('name'):
+                keys.add(('player', player['name'].lower()))
+            if player.get('class_name'):
+                keys.add(('class_name', player['class_name'].lower()))
+        return {(field, value) for field, value in keys if value is not None}
+
+    def _insert(self, conn: sqlite3.Connection, name: str, entry: dict):
+        conn.execute("INSERT OR REPLACE INTO saves (name, last_activity, entry) VALUES (?, ?, ?)",
+                     (name, entry.get('last_activity') or '', json.dumps(entry, ensure_ascii=False)))
+        conn.execute("DELETE FROM save_keys WHERE name = ?", (name,))
+        conn.executemany("INSERT INTO save_keys (field, value, name) VALUES (?, ?, ?)",
+                         [(field, value, name) for field, value in self._filter_keys(entry)])
+
+    def __contains__(self, name: str) -> bool:
+        return self._connection().execute("SELECT 1 FROM saves WHERE name = ?", (name,)).fetchone() is not None
+
+    def get(self, name: str) -> Optional[dict]:
+        row = self._connection().execute("SELECT entry FROM saves WHERE name = ?", (name,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def add(self, name: str, save_path: Path, data: dict):
+        """Record a freshly written save and its summary"""
+        entry = {'file': Path(save_path).name, 'size': Path(save_path).stat().st_size, **describe_save(data)}
+        if entry['last_activity'] is None:
+            entry['last_activity'] = datetime.now().isoformat()
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            self._insert(conn, name, entry)
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def remove(self, name: str):
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute("DELETE FROM save_keys WHERE name = ?", (name,))
+        conn.execute("DELETE FROM saves WHERE name = ?", (name,))
+        conn.execute("COMMIT")
+
+    def query(self, kind: Optional[str] = None, language: Optional[str] = None,
+              player: Optional[str] = None, class_name: Optional[str] = None,
+              offset: int = 0, limit: int = 50) -> Tuple[int, List[dict]]:
+        """Return (total matches, one page of entries), most recently active first"""
+        filters = [('kind', kind), ('language', language),
+                   ('player', player.lower() if player else None),
+                   ('class_name', class_name.lower() if class_name else None)]
+        filters = [key for key in filters if key[1]]
+
+        where = ' AND '.join(["name IN (SELECT name FROM save_keys WHERE field = ? AND value = ?)"] * len(filters))
+        where = f"WHERE {where}" if where else ''
+        params = [part for key in filters for part in key]
+        conn = self._connection()
+        # Both reads see the same snapshot of the catalog
+        conn.execute("BEGIN")
+        try:
+            (total,) = conn.execute(f"SELECT COUNT(*) FROM saves {where}", params).fetchone()
+            # The activity index yields rows in page order, so only the page is read
+            rows = conn.execute(
+                f"SELECT name, entry FROM saves {where} ORDER BY last_activity DESC, name DESC LIMIT ? OFFSET ?",
+                params + [limit, offset]).fetchall()
+        finally:
+            conn.execute("COMMIT")
+        return total, [{'name': name, **json.loads(entry)} for name, entry in rows]
@@ -0,0 +1,144 @@
+"""
+JSON serialization for API responses.
+
+FastJSONProvider replaces Flask's default provider. It uses orjson when it is
+installed and the stdlib encoder otherwise, encodes pydantic models through
+their native model_dump_json, and splices RawJSON fragments into the output
+verbatim. Player payloads are cached on the PlayerState itself and reused
+until the player changes, so polling never re-encodes unchanged players.
+"""
+
+import copy
+import json
+import re
+import secrets
+from datetime import date, datetime
+from typing import Any, Dict, NamedTuple
+
+from flask.json.provider import DefaultJSONProvider
+from pydantic import BaseModel
+
+from character_config import localized_race, localized_class
+from gemini_schema import PlayerState
+from metrics import CACHE_LOOKUPS, stage_timer
+
+try:
+    import orjson
+    if not hasattr(orjson, 'Fragment'):  # orjson < 3.9 cannot embed raw fragments
+        orjson = None
+except ImportError:
+    orjson = None
+
+
+class RawJSON:
+    """Already-encoded JSON that is embedded in a response as is"""
+
+    __slots__ = ('text',)
+
+    def __init__(self, text: str):
+        self.text = text
+
+    def __repr__(self):
+        return f"RawJSON({self.text[:40]!r})"
+
+
+def _default(o: Any) -> Any:
+    if isinstance(o, BaseModel):
+        return RawJSON(o.model_dump_json())
+    if isinstance(o, PlayerState):
+        return o.to_dict()
+    if isinstance(o, (datetime, date)):
+        # ISO 8601, the same format pydantic and the message feed use
+        return o.isoformat()
+    if isinstance(o, (set, frozenset)):
+        return list(o)
+    return DefaultJSONProvider.default(o)
+
+
+def _orjson_default(o: Any) -> Any:
+    if isinstance(o, RawJSON):
+        return orjson.Fragment(o.text)
+    return _default(o)
+
+
+def dumps(obj: Any, **kwargs: Any) -> str:
+    """Encode obj, splicing in RawJSON fragments"""
+    if orjson is not None and not kwargs.get('indent'):
+        option = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+        if kwargs.get('sort_keys'):
+            option |= orjson.OPT_SORT_KEYS
+        return orjson.dumps(obj, default=_orjson_default, option=option).decode('utf-8')
+
+    # The stdlib encoder cannot emit raw text, so fragments go in as unique
+    # placeholder strings that are swapped for the fragment afterwards
+    fragments = []
+    nonce = secrets.token_hex(4)
+
+    def default(o: Any) -> Any:
+        if isinstance(o, RawJSON):
+            fragments.append(o.text)
+            return f"\x00{nonce}:{len(fragments) - 1}\x00"
+        return _default(o)
+
+    kwargs.setdefault('ensure_ascii', False)
+    text = json.dumps(obj, default=default, **kwargs)
+    if not fragments:
+        return text
+    placeholder = re.compile(r'"\\u0000' + nonce + r':(\d+)\\u0000"')
+    return placeholder.sub(lambda m: fragments[int(m.group(1))], text)
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """Flask JSON provider backed by dumps() above"""
+
+    ensure_ascii = False
+
+    def dumps(self, obj: Any, **kwargs: Any) -> str:
+        kwargs.setdefault('sort_keys', self.sort_keys)
+        kwargs.setdefault('ensure_ascii', self.ensure_ascii)
+        kwargs.pop('default', None)
+        with stage_timer('serialize'):
+            return dumps(obj, **kwargs)
+
+    def loads(self, s, **kwargs: Any) -> Any:
+        if orjson is not None and not kwargs:
+            return orjson.loads(s)
+        return json.loads(s, **kwargs)
+
+
+class PlayerFragment(NamedTuple):
+    data: dict
+    raw: RawJSON
+
+
+# Bookkeeping the client never needs
+PLAYER_PAYLOAD_EXCLUDE = {'version'}
+
+
+def serialize_player(player: PlayerState, language: str) -> dict:
+    """Player data for clients, with race and class names in the room's language"""
+    player_data = player.to_dict(exclude=PLAYER_PAYLOAD_EXCLUDE)
+    if player.race and player.class_name:
+        player_data['race'] = localized_race(player.race, language)
+        player_data['class_name'] = localized_class(player.class_name, language)
+    return player_data
+
+
+def player_fragment(player: PlayerState, language: str) -> PlayerFragment:
+    """Serialized player, cached on the player until any of its fields changes.
+
+    Assignments bump the player's revision; the dict fields are also compared
+    with a copy taken when the fragment was built, so a change made in place
+    (player.dice_modifier['reason'] = ...) is not served stale either.
+    """
+    cache: Dict[str, tuple] = player._fragments
+    cached = cache.get(language)
+    dicts = tuple(getattr(player, name) for name in PlayerState.DICT_FIELDS)
+    if cached is not None and cached[0] == player._revision and cached[1] == dicts:
+        CACHE_LOOKUPS.inc(cache='player_fragment', result='hit')
+        return cached[2]
+    CACHE_LOOKUPS.inc(cache='player_fragment', result='miss')
+    data = serialize_player(player, language)
+    fragment = PlayerFragment(data, RawJSON(dumps(data, sort_keys=True, separators=(',', ':'))))
+    cache[language] = (player._revision, copy.deepcopy(dicts), fragment)
+    return fragment
@@ -0,0 +1,97 @@
+/**
+ * Battle transport
+ * Sends battle actions over one WebSocket (see battle_socket.py) and falls
+ * back to the /api/<action> POSTs when the page is served without one.
+ */
+
+(function() {
+    // Actions whose handlers read a form rather than JSON
+    const FORM_ACTIONS = new Set(['attack', 'roll_dice']);
+
+    let opening = null;
+    // Set once a socket failed to open, so later actions go straight to HTTP
+    let unsupported = !('WebSocket' in window);
+    let nextId = 1;
+    const pending = new Map();
+
+    function handleFrame(frame) {
+        if (frame.state) {
+            // The server's view of the battle after each action
+            window.battleState = frame.state;
+            window.dispatchEvent(new CustomEvent('battlestate', { detail: frame.state }));
+        }
+        if (frame.id !== undefined && pending.has(frame.id)) {
+            const { resolve, reject } = pending.get(frame.id);
+            pending.delete(frame.id);
+            if (frame.status) {
+                // The handler failed, as a non-OK response does over HTTP
+                reject(new Error(frame.error));
+            } else {
+                resolve(frame.result || { error: frame.error });
+            }
+        }
+    }
+
+    function connect() {
+        if (unsupported) {
+            return Promise.resolve(null);
+        }
+        if (!opening) {
+            opening = new Promise(resolve => {
+                const scheme = location.protocol === 'https:' ? 'wss:' : 'ws:';
+                const socket = new WebSocket(`${scheme}//${location.host}/api/battle_socket`);
+                let opened = false;
+                socket.onopen = () => {
+                    opened = true;
+                    resolve(socket);
+                };
+                socket.onmessage = event => handleFrame(JSON.parse(event.data));
+                socket.onclose = () => {
+                    // Reconnect on the next action if the socket had worked
+                    unsupported = unsupported || !opened;
+                    opening = null;
+                    pending.forEach(({ reject }) => reject(new Error('Battle connection closed')));
+                    pending.clear();
+                    resolve(null);
+                };
+            });
+        }
+        return opening;
+    }
+
+    async function postAction(action, data) {
+        const options = { method: 'POST' };
+        if (FORM_ACTIONS.has(action)) {
+            options.headers = { 'Content-Type': 'application/x-www-form-urlencoded' };
+            options.body = new URLSearchParams(data).toString();
+        } else if (Object.keys(data).length) {
+            options.headers = { 'Content-Type': 'application/json' };
+            options.body = JSON.stringify(data);
+        }
+        const response = await fetch(`/api/${action}`, options);
+        if (!response.ok) {
+            throw new Error(`HTTP error! status: ${response.status}`);
+        }
+        return response.json();
+    }
+
+    /**
+     * Run a battle action on the server
+     * @param {string} action - 'attack', 'cast_spell', 'enemy_attack', 'end_turn', 'roll_dice' or 'turn'
+     * @param {Object} data - The action's parameters, as the matching /api endpoint takes them
+     * @returns {Promise<Object>} The endpoint's JSON answer
+     */
+    window.battleRequest = async function(action, data = {}) {
+        const socket = await connect();
+        if (!socket || socket.readyState !== WebSocket.OPEN) {
+            return postAction(action, data);
+        }
+        const id = nextId++;
+        return new Promise((resolve, reject) => {
+            pending.set(id, { resolve, reject });
+            socket.send(JSON.stringify({ id, action, data }));
+        });
+    };
+
+    document.addEventListener('DOMContentLoaded', connect);
+})();
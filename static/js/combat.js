@@ -40,24 +40,10 @@ class CombatManager {
             castSpellButton.disabled = true; // По умолчанию кнопка заклинаний отключена
         }
         
-        // Здесь могут быть другие действия при завершении хода
-        
-        // Отправляем запрос на сервер для завершения хода
-        fetch('/api/end_turn', {
-            method: 'POST'
-        })
-        .then(response => response.json())
-        .then(data => {
-            // Обработка ответа сервера
-            if (window.showNotification) {
-                window.showNotification("Your turn ended", 'info');
-            }
-            
-            // Здесь может быть обновление интерфейса или другие действия
-        })
-        .catch(error => {
-            console.error('Error ending turn:', error);
-        });
+        // The turn itself is sent by hexgrid.js, which also ends it on the server
+        if (window.showNotification) {
+            window.showNotification("Your turn ended", 'info');
+        }
     }
 
     handleAttackButtonClick(button, event) {
@@ -156,15 +142,7 @@ class CombatManager {
             const attackType = selectedAttack ? selectedAttack.dataset.attackType : "melee_attack";
             
             // Отправляем запрос на атаку
-            const response = await fetch('/api/attack', {
-                method: 'POST',
-                headers: {
-                    'Content-Type': 'application/x-www-form-urlencoded',
-                },
-                body: `attack_type=${attackType}`
-            });
-            
-            const data = await response.json();
+            const data = await window.battleRequest('attack', { attack_type: attackType });
             
             if (data.error) {
                 if (window.showNotification) {
@@ -256,19 +234,11 @@ class CombatManager {
         }
 
         try {
-            const response = await fetch('/api/cast_spell', {
-                method: 'POST',
-                headers: {
-                    'Content-Type': 'application/json'
-                },
-                body: JSON.stringify({
-                    spell_name: this.currentAttack.spellName,
-                    target: window.enemyPos || {}
-                })
+            const data = await window.battleRequest('cast_spell', {
+                spell_name: this.currentAttack.spellName,
+                target: window.enemyPos || {}
             });
 
-            const data = await response.json();
-
             if (data.error) {
                 if (window.showNotification) {
                     window.showNotification(data.error, 'error');
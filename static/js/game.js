@@ -139,7 +139,9 @@ const gameApp = Vue.createApp({
             timeoutId: null,
             transitionDuration: 500,
             animationDuration: 3000,
-            lastFace: null
+            lastFace: null,
+            revision: null,
+            lastMessageId: null
         };
     },
     computed: {
@@ -176,6 +178,41 @@ const gameApp = Vue.createApp({
             // Replace **text** with <strong>text</strong> for bold formatting
             return message.replace(/\*\*(.*?)\*\*/g, '<strong class="font-bold">$1</strong>');
         },
+        stateParams() {
+            // Tell the server what we already have so it only sends the changes
+            return { since_revision: this.revision, last_message_id: this.lastMessageId };
+        },
+        applyRoomState(data) {
+            if (this.revision !== null && data.revision < this.revision) {
+                // An older answer overtaken by a newer one: only its messages can be new
+                const known = new Set(this.messages.map(m => m.id));
+                this.messages = this.messages.concat((data.messages || []).filter(m => !known.has(m.id)));
+                return;
+            }
+            if (data.full) {
+                this.room = { ...data.room, players: data.players };
+                this.messages = data.messages || [];
+                if (data.player) {
+                    this.gameState = data.player;
+                }
+            } else {
+                const players = { ...(this.room.players || {}) };
+                (data.removed_players || []).forEach(pid => delete players[pid]);
+                Object.entries(data.players || {}).forEach(([pid, changes]) => {
+                    players[pid] = { ...(players[pid] || {}), ...changes };
+                });
+                this.room = { ...this.room, ...data.room, players };
+                const known = new Set(this.messages.map(m => m.id));
+                this.messages = this.messages.concat((data.messages || []).filter(m => !known.has(m.id)));
+                if (data.player) {
+                    this.gameState = { ...this.gameState, ...data.player };
+                }
+            }
+            this.revision = data.revision;
+            if (data.last_message_id != null) {
+                this.lastMessageId = data.last_message_id;
+            }
+        },
         resetCopyState() {
             if (this.codeCopied) {
                 this.wasJustCopied = true;
@@ -224,47 +261,22 @@ const gameApp = Vue.createApp({
             
             this.isLoading = true;
             try {
+                // The server queues the DM's turn; its messages arrive through the room poll
                 const response = await fetch('/game_action', {
                     method: 'POST',
                     headers: { 'Content-Type': 'application/json' },
-                    body: JSON.stringify({ action: messageText })
+                    body: JSON.stringify({ action: messageText, async: true })
                 });
                 const data = await response.json();
                 if (data.error) {
                     alert(data.error);
                 } else {
-                    // Store current ability scores if they exist
-                    const currentAbilityScores = this.gameState.ability_scores;
-                    
-                    // Update game state
-                    this.gameState = data.player;
-                    
-                    // Ensure ability scores are preserved
-                    if (!this.gameState.ability_scores && currentAbilityScores) {
-                        this.gameState.ability_scores = currentAbilityScores;
-                    }
-                    
-                    if (data.room) {
-                        this.room = data.room;
-                    }
-                    if (data.dice_roll_required) {
-                        this.diceNeeded = true;
-                        this.canRollDice = true;
-                        this.diceType = (data.dice_roll_request && data.dice_roll_request.dice_type) || 'd20';
-                        this.diceReason = (data.dice_roll_request && data.dice_roll_request.reason) || '';
-                        this.diceRollRequest = data.dice_roll_request;
-                        // Reset dice state for new roll
-                        this.currentFace = null;
-                        this.diceRolling = false;
-                        console.log('Dice roll request data:', data);
-                    } else {
-                        this.diceNeeded = false;
-                        this.canRollDice = false;
-                        this.diceReason = '';
-                        this.diceRollRequest = null;
-                    }
-                    if (data.messages) {
-                        this.messages = data.messages;
+                    this.pendingMessage = null;
+                    const job = await this.waitForJob(data.job_id);
+                    if (job && job.status === 'error') {
+                        alert(job.error);
+                    } else if (job) {
+                        this.applyDiceRequest(job.result);
                     }
                 }
             } catch (e) {
@@ -275,6 +287,37 @@ const gameApp = Vue.createApp({
                 this.isThinking = false;
             }
         },
+        async waitForJob(jobId) {
+            // Long-poll the queued DM turn until it finishes; null if the server lost it
+            while (true) {
+                const response = await fetch(`/llm_job/${jobId}?wait=25`, { cache: 'no-store' });
+                if (response.status === 404) {
+                    return null;
+                }
+                const job = await response.json();
+                if (job.status === 'done' || job.status === 'error') {
+                    return job;
+                }
+            }
+        },
+        applyDiceRequest(data) {
+            if (data.dice_roll_required) {
+                this.diceNeeded = true;
+                this.canRollDice = true;
+                this.diceType = (data.dice_roll_request && data.dice_roll_request.dice_type) || 'd20';
+                this.diceReason = (data.dice_roll_request && data.dice_roll_request.reason) || '';
+                this.diceRollRequest = data.dice_roll_request;
+                // Reset dice state for new roll
+                this.currentFace = null;
+                this.diceRolling = false;
+                console.log('Dice roll request data:', data);
+            } else {
+                this.diceNeeded = false;
+                this.canRollDice = false;
+                this.diceReason = '';
+                this.diceRollRequest = null;
+            }
+        },
         async rollDice() {
             // Check if rolling is allowed
             if (!this.canRollDice || this.diceRolling) return;
@@ -384,7 +427,8 @@ const gameApp = Vue.createApp({
                             body: JSON.stringify({ 
                                 roll: rollData.roll, 
                                 dice_type: this.diceType,
-                                detailed_result: rollData.detailed_result
+                                detailed_result: rollData.detailed_result,
+                                async: true
                             })
                         });
                         const processData = await processResponse.json();
@@ -392,19 +436,9 @@ const gameApp = Vue.createApp({
                         if (processData.error) {
                             alert(processData.error);
                         } else {
-                            // Store current ability scores if they exist
-                            const currentAbilityScores = this.gameState.ability_scores;
-                            
-                            // Update game state
-                            this.gameState = processData.player;
-                            
-                            // Ensure ability scores are preserved
-                            if (!this.gameState.ability_scores && currentAbilityScores) {
-                                this.gameState.ability_scores = currentAbilityScores;
-                            }
-                            
-                            if (processData.messages) {
-                                this.messages = processData.messages;
+                            const job = await this.waitForJob(processData.job_id);
+                            if (job && job.status === 'error') {
+                                alert(job.error);
                             }
                         }
                         
@@ -481,18 +515,11 @@ const gameApp = Vue.createApp({
         },
         async loadInitialState() {
             try {
-                const response = await fetch('/get_room_state');
+                // No revision yet, so the server answers with a full snapshot
+                const response = await fetch('/get_room_state?since_revision=');
                 const data = await response.json();
                 if (data.status === 'success') {
-                    if (data.player) {
-                        this.gameState = data.player;
-                        // Ensure ability_scores is properly set
-                        if (data.player.ability_scores) {
-                            this.gameState.ability_scores = data.player.ability_scores;
-                        }
-                    }
-                    this.messages = data.messages || [];
-                    this.room = data.room;
+                    this.applyRoomState(data);
                     if (data.dice_roll_required) {
                         this.diceNeeded = true;
                         this.diceType = data.dice_roll_request?.dice_type || 'd20';
@@ -504,6 +531,33 @@ const gameApp = Vue.createApp({
                 console.error(e);
             }
         },
+        async pollRoomState() {
+            // Long-poll: the server holds the request until the room changes, or answers 304
+            while (this.room.room_id) {
+                try {
+                    const params = new URLSearchParams({
+                        since_revision: this.revision ?? '',
+                        last_message_id: this.lastMessageId ?? '',
+                        wait: 25
+                    });
+                    const response = await fetch(`/get_room_state?${params}`, {
+                        cache: 'no-store',
+                        headers: { 'If-None-Match': `"${this.room.room_id}.${this.revision}"` }
+                    });
+                    if (response.status === 200) {
+                        const data = await response.json();
+                        if (data.status === 'success') {
+                            this.applyRoomState(data);
+                        }
+                    } else if (response.status !== 304) {
+                        await new Promise(resolve => setTimeout(resolve, 5000));
+                    }
+                } catch (e) {
+                    console.error(e);
+                    await new Promise(resolve => setTimeout(resolve, 5000));
+                }
+            }
+        },
         async customRoll() {
             // Build the dice command based on customType:
             let diceCommand = '';
@@ -534,7 +588,7 @@ const gameApp = Vue.createApp({
                 const processResponse = await fetch('/process_roll', {
                     method: 'POST',
                     headers: { 'Content-Type': 'application/json' },
-                    body: JSON.stringify({ roll: rollData.roll, dice_type: diceCommand })
+                    body: JSON.stringify({ roll: rollData.roll, dice_type: diceCommand, ...this.stateParams() })
                 });
                 const processData = await processResponse.json();
                 if (processData.error) {
@@ -543,13 +597,7 @@ const gameApp = Vue.createApp({
                 }
                 
                 // Update game state and messages
-                this.gameState = processData.player;
-                if (processData.room) {
-                    this.room = processData.room;
-                }
-                if (processData.messages) {
-                    this.messages = processData.messages;
-                }
+                this.applyRoomState(processData);
                 
                 // Show the outcome with detailed dice info and game response
                 alert(`Roll: ${rollData.roll}\nDetailed: ${JSON.stringify(rollData.detailed_result)}\n\nGame Response: ${processData.message || processData.response}`);
@@ -629,5 +677,6 @@ document.addEventListener('DOMContentLoaded', async () => {
     });
     
     const app = gameApp.mount('#game-app');
-    app.loadInitialState();
+    await app.loadInitialState();
+    app.pollRoomState();
 }); 
\ No newline at end of file
@@ -115,19 +115,20 @@ document.addEventListener('DOMContentLoaded', function() {
             
             drawHexGrid();
             
-            // Enemy turn
+            // End the player's turn and play the enemy's answer in one request
             try {
-                const response = await fetch('/api/enemy_attack', {
-                    method: 'POST',
-                    headers: {
-                        'Content-Type': 'application/json'
-                    }
-                });
-                if (!response.ok) {
-                    throw new Error(`HTTP error! status: ${response.status}`);
+                const turn = await window.battleRequest('turn', { actions: [{ type: 'end_turn' }] });
+                console.log('Turn response:', turn);
+                if (turn.error) {
+                    throw new Error(turn.error);
                 }
-                const data = await response.json();
-                console.log('Enemy turn response:', data);
+                const data = {
+                    combat_log: turn.combat_log.filter(Boolean).join(' '),
+                    character_hp: turn.state.character.hp,
+                    enemy_hp: turn.state.enemy.hp,
+                    enemy_pos: turn.state.enemy.pos,
+                    enemy_status: turn.enemy_status
+                };
                 
                 if (data.combat_log) {
                     if (typeof addToBattleLog === 'function') {
@@ -146,6 +147,11 @@ document.addEventListener('DOMContentLoaded', function() {
                     enemyHPElem.textContent = data.enemy_hp;
                 }
                 
+                if (typeof handleEnemyTurnResponse === 'function') {
+                    // Notifications about the enemy's move (ui.js)
+                    handleEnemyTurnResponse(data);
+                }
+                
                 if (data.enemy_pos) {
                     enemyPos = data.enemy_pos;
                     drawHexGrid();
@@ -932,17 +938,10 @@ function activateHoldPerson() {
                 }
                 
                 // Отправляем запрос на сервер
-                fetch('/api/cast_spell', {
-                    method: 'POST',
-                    headers: {
-                        'Content-Type': 'application/json'
-                    },
-                    body: JSON.stringify({
-                        spell_name: "Hold Person",
-                        target: window.holdPersonTarget
-                    })
+                window.battleRequest('cast_spell', {
+                    spell_name: "Hold Person",
+                    target: window.holdPersonTarget
                 })
-                .then(response => response.json())
                 .then(data => {
                     // Обработка успешного ответа
                     if (data.combat_log) {
@@ -74,7 +74,7 @@ class GameUI {
         }
     }
 
-    async handleEndTurn(buttonElement) {
+    handleEndTurn(buttonElement) {
         console.log("End turn clicked");
         
         // Show notification
@@ -90,53 +90,7 @@ class GameUI {
         document.getElementById('char_speed').textContent = `${window.playerSpeed}/${this.config.player.stats.speed}`;
         window.drawHexGrid();
         
-        // Enemy turn
-        try {
-            const response = await fetch('/api/enemy_attack', {
-                method: 'POST',
-                headers: {
-                    'Content-Type': 'application/json'
-                }
-            });
-            
-            if (!response.ok) {
-                throw new Error(`HTTP error! status: ${response.status}`);
-            }
-            
-            const data = await response.json();
-            console.log("Enemy turn response:", data);
-            
-            // Используем нашу новую функцию для обработки хода врага
-            if (typeof handleEnemyTurnResponse === 'function') {
-                handleEnemyTurnResponse(data);
-            } else {
-                // Резервный вариант, если функция не определена
-                if (data.combat_log) {
-                    window.showNotification(data.combat_log, "info");
-                }
-                
-                // Update UI
-                document.getElementById('char_hp').textContent = data.character_hp;
-                document.getElementById('enemy_hp').textContent = data.enemy_hp;
-                
-                // Update enemy position
-                if (data.enemy_pos) {
-                    const oldPos = JSON.stringify(window.enemyPos);
-                    const newPos = JSON.stringify(data.enemy_pos);
-                    
-                    window.enemyPos = data.enemy_pos;
-                    window.drawHexGrid();
-                    
-                    // Показываем сообщение только если позиция действительно изменилась
-                    if (oldPos !== newPos) {
-                        window.showNotification("Enemy has moved!", "info");
-                    }
-                }
-            }
-        } catch (error) {
-            console.error('Error during enemy turn:', error);
-            window.showNotification('Error during enemy turn: ' + error.message, "error", buttonElement);
-        }
+        // The turn itself is sent by hexgrid.js, which renders the enemy's answer
     }
 
     changeTerrain(terrainType) {
@@ -0,0 +1,125 @@
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+from typing import Dict, List, Optional, Set
+
+from DEF import DnDGame, history_after, history_message_id
+from fair_scheduler import SchedulerFull
+from gemini import Gemini
+from metrics import REGISTRY, stage_timer
+from prompts import SUMMARY_PROMPTS
+from token_budget import estimate_tokens, ledger
+
+logger = logging.getLogger(__name__)
+
+# Fold older turns once the unsummarized transcript grows past this many tokens
+SUMMARY_TRIGGER_TOKENS = int(os.getenv('SUMMARY_TRIGGER_TOKENS', 1200))
+# Newest messages that always stay verbatim in the prompt
+SUMMARY_KEEP_RECENT = int(os.getenv('SUMMARY_KEEP_RECENT', 4))
+SUMMARY_MAX_WORDS = 250
+SUMMARY_WORKERS = int(os.getenv('SUMMARY_WORKERS', 2))
+
+SUMMARIES = REGISTRY.counter('dnd_summaries_total', 'Room summarization jobs by outcome')
+
+
+def unsummarized(room) -> List:
+    """Messages of the room's history that the running summary does not cover yet"""
+    return history_after(room.message_history, room.summary_through)
+
+
+class RoomSummarizer:
+    """Folds the older turns of each room's transcript into RoomState.summary.
+
+    maybe_schedule() is cheap and is called on the request path after a room
+    changes; the Gemini call that writes the summary runs in a worker pool and
+    stores its result under the room lock, so it never delays a player action.
+    At most one job per room is in flight.
+    """
+
+    def __init__(self, room_manager, workers: int = SUMMARY_WORKERS):
+        self.room_manager = room_manager
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='summarizer')
+        self._pending: Set[str] = set()
+        # Gemini clients per worker thread: a client keeps the usage and API key
+        # of its current call on itself, so threads must not share one
+        self._local = threading.local()
+        self._lock = Lock()
+
+    def maybe_schedule(self, room) -> bool:
+        """Queue a summarization job if the room's transcript outgrew the threshold"""
+        pending = unsummarized(room)
+        if len(pending) <= SUMMARY_KEEP_RECENT:
+            return False
+        transcript = "".join(DnDGame.format_history_entry(msg) for msg in pending)
+        if estimate_tokens(transcript) < SUMMARY_TRIGGER_TOKENS:
+            return False
+        fold = pending[:-SUMMARY_KEEP_RECENT]
+        through = history_message_id(fold[-1])
+        if through is None:
+            return False
+
+        with self._lock:
+            if room.room_id in self._pending:
+                return False
+            self._pending.add(room.room_id)
+        text = "".join(DnDGame.format_history_entry(msg) for msg in fold)
+        self._pool.submit(self._run, room.room_id, room.language, room.summary, room.summary_through, through, text)
+        return True
+
+    def _client(self, language: str) -> Gemini:
+        """This worker thread's client for the language"""
+        clients: Optional[Dict[str, Gemini]] = getattr(self._local, 'clients', None)
+        if clients is None:
+            clients = self._local.clients = {}
+        if language not in clients:
+            prompt = SUMMARY_PROMPTS.get(language, SUMMARY_PROMPTS['en'])
+            clients[language] = Gemini(API_KEY=os.getenv('GEMINI_API_KEY'),
+                                       system_instruction=prompt.format(max_words=SUMMARY_MAX_WORDS),
+                                       temperature=0.3)
+        return clients[language]
+
+    def _summarize(self, room_id: str, language: str, previous: str, text: str) -> Optional[str]:
+        client = self._client(language)
+        prompt = f"Previous chronicle:\n{previous or '(none)'}\n\nNew messages:\n{text}"
+        with stage_timer('summarize'):
+            try:
+                summary = client.send_message(prompt, room_id=room_id)
+            except SchedulerFull as e:
+                logger.warning("Summarizing room %s skipped: %s", room_id, e, extra={'room_id': room_id})
+                return None
+        if client.last_usage is not None:
+            ledger.record(room_id, client.key_label, client.last_usage)
+        if not summary or summary.startswith("Error:"):
+            logger.warning("Summarizing room %s failed: %s", room_id, summary, extra={'room_id': room_id})
+            return None
+        return summary.strip()
+
+    def _run(self, room_id: str, language: str, previous: str, previous_through: Optional[int],
+             through: int, text: str):
+        try:
+            summary = self._summarize(room_id, language, previous, text)
+            if summary is None:
+                SUMMARIES.inc(outcome='error')
+                return
+            with self.room_manager.room_lock(room_id):
+                room = self.room_manager.get_room(room_id)
+                # Dropped if the room is gone or another job already moved the summary on
+                if room is None or room.summary_through != previous_through:
+                    SUMMARIES.inc(outcome='discarded')
+                    return
+                room.summary = summary
+                room.summary_through = through
+                if not self.room_manager.update_room(room):
+                    SUMMARIES.inc(outcome='discarded')
+                    return
+            SUMMARIES.inc(outcome='ok')
+            logger.info("Room %s summarized through message %s (%s chars)", room_id, through, len(summary),
+                        extra={'room_id': room_id})
+        except Exception:
+            SUMMARIES.inc(outcome='error')
+            logger.error("Summarizing room %s failed", room_id, exc_info=True)
+        finally:
+            with self._lock:
+                self._pending.discard(room_id)
@@ -0,0 +1,41 @@
+import tempfile
+import threading
+import unittest
+from pathlib import Path
+
+from llm_jobs import JobStore, LLMJobQueue
+
+
+class SharedJobStoreTest(unittest.TestCase):
+    """A job accepted by one worker process can be polled through another"""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        db_path = Path(self.tmp.name) / 'rooms.db'
+        # Two queues on one database stand in for two worker processes
+        self.accepting = LLMJobQueue(workers=1, store=JobStore(db_path))
+        self.polled = LLMJobQueue(workers=1, store=JobStore(db_path))
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_other_worker_sees_result(self):
+        release = threading.Event()
+        job = self.accepting.submit('room', 'player', 'game_action', lambda: release.wait(5) and {'message': 'hi'})
+
+        seen = self.polled.get(job.id)
+        self.assertIsNotNone(seen)
+        self.assertFalse(self.polled.is_local(seen))
+        self.assertIn(seen.status, ('queued', 'running'))
+
+        release.set()
+        finished = self.polled.wait(seen, 5)
+        self.assertEqual(finished.status, 'done')
+        self.assertEqual(finished.result, {'message': 'hi'})
+
+    def test_unknown_job(self):
+        self.assertIsNone(self.polled.get('missing'))
+
+
+if __name__ == '__main__':
+    unittest.main()
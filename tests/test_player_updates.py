@@ -0,0 +1,35 @@
+import unittest
+
+from gemini_schema import RoomState
+from player_updates import apply_player_updates, ROLL_FIELD_MAP
+from room_manager import RoomManager
+
+
+class PlayerUpdateFieldsTest(unittest.TestCase):
+    """A game action changes HP, gold and damage; a dice roll may also level up"""
+
+    def setUp(self):
+        player = RoomManager._new_player('p1', 'Alice')
+        player.health_points, player.level = 12, 1
+        self.room = RoomState(room_id='r1', host_id='p1', players={'p1': player})
+        self.player = player
+
+    def test_game_action_fields(self):
+        update = {'player_id': 'p1', 'health_points': 500, 'gold': -3, 'level': 5, 'magic_1lvl': 4}
+        self.assertEqual(apply_player_updates(self.room, [update]), ['p1'])
+        # No upper bound on HP, gold floored at zero, level and spell slots untouched
+        self.assertEqual(self.player.health_points, 500)
+        self.assertEqual(self.player.gold, 0)
+        self.assertEqual(self.player.level, 1)
+        self.assertEqual(self.player.magic_1lvl, 0)
+
+    def test_roll_fields(self):
+        update = {'player_id': 'p1', 'health_points': -4, 'level': 2, 'magic_1lvl': '2'}
+        apply_player_updates(self.room, [update], ROLL_FIELD_MAP)
+        self.assertEqual(self.player.health_points, 0)
+        self.assertEqual(self.player.level, 2)
+        self.assertEqual(self.player.magic_1lvl, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
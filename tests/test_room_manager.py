@@ -0,0 +1,92 @@
+import os
+import tempfile
+import unittest
+
+from room_manager import RoomManager
+from save_format import find_save
+from sqlite_room_manager import SQLiteRoomManager
+
+
+class SavesFolderTest(unittest.TestCase):
+    """Runs each test in an empty directory, since managers keep their saves in ./saves"""
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmp = tempfile.TemporaryDirectory()
+        os.chdir(self.tmp.name)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        self.tmp.cleanup()
+
+
+class DeletedRoomTest(SavesFolderTest):
+    """A room removed by its last player must not come back from its save file"""
+
+    def assert_deleted_room_stays_deleted(self, manager):
+        room_id = manager.create_room('host')
+        manager.join_room(room_id, 'host', 'Alice')
+        # Spill the room to saves/ and drop it from the live store
+        self.assertEqual(manager.cleanup_inactive_rooms(0), 1)
+        self.assertIsNotNone(find_save(manager.save_folder, f"room_{room_id}"))
+
+        self.assertTrue(manager.leave_room(room_id, 'host'))
+
+        self.assertIsNone(manager.get_room(room_id))
+        self.assertIsNone(find_save(manager.save_folder, f"room_{room_id}"))
+        self.assertNotIn(f"room_{room_id}", manager.save_index)
+
+    def test_memory_backend(self):
+        self.assert_deleted_room_stays_deleted(RoomManager())
+
+    def test_sqlite_backend(self):
+        self.assert_deleted_room_stays_deleted(SQLiteRoomManager())
+
+    def test_explicit_save_is_removed_with_the_room(self):
+        manager = RoomManager()
+        room_id = manager.create_room('host')
+        manager.join_room(room_id, 'host', 'Alice')
+        self.assertTrue(manager.save_room(room_id))
+
+        self.assertTrue(manager.leave_room(room_id, 'host'))
+
+        self.assertIsNone(manager.get_room(room_id))
+
+
+
+class EvictedRoomTest(SavesFolderTest):
+    """Writes to a room spilled since it was read are kept, not dropped"""
+
+    def assert_update_after_eviction_is_kept(self, manager):
+        room_id = manager.create_room('host')
+        manager.join_room(room_id, 'host', 'Alice')
+        room = manager.get_room(room_id)
+        self.assertEqual(manager.cleanup_inactive_rooms(0), 1)
+
+        room.players['host'].gold = 5
+        self.assertTrue(manager.update_room(room))
+
+        self.assertEqual(manager.get_room(room_id).players['host'].gold, 5)
+
+    def test_memory_backend(self):
+        self.assert_update_after_eviction_is_kept(RoomManager())
+
+    def test_sqlite_backend(self):
+        self.assert_update_after_eviction_is_kept(SQLiteRoomManager())
+
+    def test_sqlite_reaps_rooms_without_activity(self):
+        manager = SQLiteRoomManager()
+        room_id = manager.create_room('host')
+        manager._connection().execute("UPDATE rooms SET last_activity = NULL")
+        # Take and drop the room's lock, which creates its lock file
+        with manager.room_lock(room_id):
+            pass
+
+        self.assertEqual(manager.cleanup_inactive_rooms(), 1)
+
+        self.assertIsNone(manager.peek_room(room_id))
+        self.assertEqual(list(manager.lock_folder.iterdir()), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,32 @@
+import json
+import tempfile
+import unittest
+from pathlib import Path
+
+from translations import TranslationCatalog
+
+
+class UnknownLanguageTest(unittest.TestCase):
+    """Language codes without a translation file are not cached"""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        folder = Path(self.tmp.name)
+        (folder / 'en.json').write_text(json.dumps({'hello': 'Hello'}), encoding='utf-8')
+        self.catalog = TranslationCatalog(folder)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_known_language_is_cached(self):
+        self.assertEqual(self.catalog.translate('en', 'hello'), 'Hello')
+        self.assertIn('en', self.catalog._catalogs)
+
+    def test_unknown_languages_do_not_grow_cache(self):
+        for i in range(100):
+            self.assertEqual(self.catalog.translate(f'xx{i}', 'hello'), 'hello')
+        self.assertEqual(self.catalog._catalogs, {})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+import os
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+
+class BattleTest(unittest.TestCase):
+    """Runs each test in an empty directory with its own battle database"""
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmp = tempfile.TemporaryDirectory()
+        os.chdir(self.tmp.name)
+        # Imported here, so the module's saves/ and logs/ land in the temporary directory;
+        # the battle endpoints never call Gemini, but the module builds a client
+        with mock.patch.dict(os.environ, {'GEMINI_API_KEY': os.getenv('GEMINI_API_KEY', 'test')}):
+            import webui
+        self.webui = webui
+        self.interface = webui.app.session_interface
+        webui.app.session_interface = webui.BattleSessionInterface(Path(self.tmp.name) / 'battles.db')
+        self.client = webui.app.test_client()
+        self.client.post('/', data={'name': 'Al', 'race': 'Elf', 'class': 'Mage', 'battlefield': 'forest_ambush'})
+        self.sid = self.client.get_cookie('session').value
+
+    def tearDown(self):
+        self.webui.app.session_interface = self.interface
+        os.chdir(self.cwd)
+        self.tmp.cleanup()
+
+    def battle(self):
+        return self.webui.app.session_interface.lookup(self.sid)
+
+
+class AttackCostTest(BattleTest):
+    """/api/attack spends the attack cost and refuses an attack the player cannot pay for"""
+
+    def test_attack_without_enough_movement_is_refused(self):
+        before = self.battle()
+        with mock.patch.dict(self.webui.GAME_RULES['combat'], {'attack_cost': 40}):
+            result = self.client.post('/api/attack', data={'attack_type': 'melee_attack'}).get_json()
+        self.assertEqual(result['error'], f"Not enough speed! Need 40, but have {before['character']['movement_left']}")
+        after = self.battle()
+        self.assertEqual(after['enemy']['hp'], before['enemy']['hp'])
+        self.assertEqual(after['character']['movement_left'], before['character']['movement_left'])
+        self.assertFalse(after['character'].get('attacked_this_turn'))
+
+    def test_attack_spends_its_cost(self):
+        movement = self.battle()['character']['movement_left']
+        with mock.patch.dict(self.webui.GAME_RULES['combat'], {'attack_cost': 5}):
+            result = self.client.post('/api/attack', data={'attack_type': 'melee_attack'}).get_json()
+        self.assertEqual(result['movement_left'], movement - 5)
+        self.assertEqual(self.battle()['character']['movement_left'], movement - 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,124 @@
+"""
+Token accounting for Gemini calls and per-room prompt budgets.
+
+Every call is recorded per room and per API key, using the token counts
+Gemini reports in usage_metadata and a character-based estimate when it
+reports none. The recorded counts also calibrate the estimate for each room,
+which is what fit_history() uses to decide how much chat history still fits
+into the room's prompt budget.
+"""
+
+import os
+from collections import OrderedDict
+from threading import Lock
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+# Rough average for English and Russian prose with Gemini's tokenizer
+CHARS_PER_TOKEN = 4
+
+# Size a room's turn prompt (stats, history and message, not the fixed
+# system instruction) aims to stay under
+PROMPT_TOKEN_BUDGET = int(os.getenv('ROOM_PROMPT_TOKEN_BUDGET', 2000))
+MAX_HISTORY_MESSAGES = 10
+MIN_HISTORY_MESSAGES = 2
+
+# Rooms whose usage is kept in memory; the least recently used are dropped
+MAX_TRACKED_ROOMS = 10000
+
+
+def estimate_tokens(text: str) -> int:
+    """Approximate the token count of text without calling the API"""
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+class Usage(NamedTuple):
+    prompt_tokens: int
+    output_tokens: int
+    estimated: bool = False
+
+
+class _Totals:
+    __slots__ = ('calls', 'prompt_tokens', 'output_tokens', 'estimated_calls', 'last_prompt_tokens')
+
+    def __init__(self):
+        self.calls = 0
+        self.prompt_tokens = 0
+        self.output_tokens = 0
+        self.estimated_calls = 0
+        self.last_prompt_tokens = 0
+
+    def add(self, usage: Usage):
+        self.calls += 1
+        self.prompt_tokens += usage.prompt_tokens
+        self.output_tokens += usage.output_tokens
+        self.estimated_calls += usage.estimated
+        self.last_prompt_tokens = usage.prompt_tokens
+
+    def as_dict(self) -> dict:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+class TokenLedger:
+    """Running token totals per room and per API key"""
+
+    def __init__(self, max_rooms: int = MAX_TRACKED_ROOMS):
+        self.max_rooms = max_rooms
+        self._rooms: "OrderedDict[str, _Totals]" = OrderedDict()
+        self._keys: Dict[str, _Totals] = {}
+        # room -> reported / estimated prompt tokens, smoothed
+        self._calibration: Dict[str, float] = {}
+        self._lock = Lock()
+
+    def record(self, room_id: Optional[str], key: str, usage: Usage, estimated_prompt: int = 0):
+        with self._lock:
+            self._keys.setdefault(key, _Totals()).add(usage)
+            if room_id is None:
+                return
+            totals = self._rooms.get(room_id)
+            if totals is None:
+                totals = self._rooms[room_id] = _Totals()
+                if len(self._rooms) > self.max_rooms:
+                    dropped, _ = self._rooms.popitem(last=False)
+                    self._calibration.pop(dropped, None)
+            else:
+                self._rooms.move_to_end(room_id)
+            totals.add(usage)
+            if not usage.estimated and estimated_prompt > 0:
+                ratio = usage.prompt_tokens / estimated_prompt
+                previous = self._calibration.get(room_id, ratio)
+                self._calibration[room_id] = 0.7 * previous + 0.3 * ratio
+
+    def calibration(self, room_id: Optional[str]) -> float:
+        """How many real tokens one estimated token turned out to be in this room"""
+        return self._calibration.get(room_id, 1.0)
+
+    def room_usage(self, room_id: str) -> Optional[dict]:
+        totals = self._rooms.get(room_id)
+        return totals.as_dict() if totals is not None else None
+
+    def key_usage(self) -> Dict[str, dict]:
+        with self._lock:
+            return {key: totals.as_dict() for key, totals in self._keys.items()}
+
+    def fit_history(self, room_id: Optional[str], fixed_text: str, entries: List[str],
+                    budget: int = PROMPT_TOKEN_BUDGET) -> Tuple[List[str], int]:
+        """Keep the newest history entries that fit in the room's prompt budget.
+
+        fixed_text is the part of the prompt that is always sent. Returns the
+        kept entries (oldest first) and how many older ones were left out. The
+        newest MIN_HISTORY_MESSAGES are kept even when over budget.
+        """
+        ratio = self.calibration(room_id)
+        used = estimate_tokens(fixed_text) * ratio
+        kept: List[str] = []
+        for entry in reversed(entries[-MAX_HISTORY_MESSAGES:]):
+            cost = estimate_tokens(entry) * ratio
+            if used + cost > budget and len(kept) >= MIN_HISTORY_MESSAGES:
+                break
+            kept.append(entry)
+            used += cost
+        kept.reverse()
+        return kept, len(entries) - len(kept)
+
+
+ledger = TokenLedger()
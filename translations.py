@@ -1,10 +1,108 @@
 import json
+import logging
+import os
+import time
 from pathlib import Path
+from threading import Lock
+from types import MappingProxyType
+from typing import Dict, FrozenSet, Iterable, Mapping, Tuple
+
+logger = logging.getLogger(__name__)
+
+TRANSLATIONS_DIR = Path(__file__).resolve().parent / 'translations'
+
+EMPTY = MappingProxyType({})
+
+
+class TranslationCatalog:
+    """Loads each language file once and serves read-only lookup dicts.
+
+    With auto_reload enabled (for development) the file's mtime is checked at
+    most every `check_interval` seconds and the language is reparsed when it
+    changed on disk.
+    """
+
+    def __init__(self, folder: Path = TRANSLATIONS_DIR, auto_reload: bool = False, check_interval: float = 1.0):
+        self.folder = Path(folder)
+        self.auto_reload = auto_reload
+        self.check_interval = check_interval
+        # lang -> (lookup, file mtime, time of the last mtime check)
+        self._catalogs: Dict[str, Tuple[Mapping[str, str], float, float]] = {}
+        self._languages: FrozenSet[str] = frozenset()
+        self._languages_checked = None
+        self._lock = Lock()
+
+    @property
+    def languages(self) -> FrozenSet[str]:
+        """Language codes that have a file in the translations folder"""
+        now = time.monotonic()
+        checked = self._languages_checked
+        if checked is None or (self.auto_reload and now - checked >= self.check_interval):
+            try:
+                self._languages = frozenset(path.stem for path in self.folder.glob('*.json'))
+            except OSError:
+                logger.error(f"Failed to list translations in '{self.folder}'", exc_info=True)
+            self._languages_checked = now
+        return self._languages
+
+    def _path(self, lang: str) -> Path:
+        return self.folder / f'{lang}.json'
+
+    def _mtime(self, lang: str) -> float:
+        try:
+            return self._path(lang).stat().st_mtime
+        except OSError:
+            return 0.0
+
+    def _load(self, lang: str) -> Mapping[str, str]:
+        try:
+            with self._path(lang).open('r', encoding='utf-8') as f:
+                return MappingProxyType(json.load(f))
+        except FileNotFoundError:
+            return EMPTY
+        except (OSError, ValueError):
+            logger.error(f"Failed to load translations for '{lang}'", exc_info=True)
+            return EMPTY
+
+    def get(self, lang: str) -> Mapping[str, str]:
+        """Return the lookup dict for a language, loading it on first use"""
+        cached = self._catalogs.get(lang)
+        if cached is not None:
+            lookup, mtime, checked = cached
+            if not self.auto_reload:
+                return lookup
+            now = time.monotonic()
+            if now - checked < self.check_interval:
+                return lookup
+            if self._mtime(lang) == mtime:
+                self._catalogs[lang] = (lookup, mtime, now)
+                return lookup
+            logger.info(f"Translations for '{lang}' changed on disk, reloading")
+
+        # Language codes come from clients; only languages with a file are
+        # loaded and cached, so unknown codes never grow the cache
+        if lang not in self.languages:
+            self._catalogs.pop(lang, None)
+            return EMPTY
+        with self._lock:
+            mtime = self._mtime(lang)
+            lookup = self._load(lang)
+            self._catalogs[lang] = (lookup, mtime, time.monotonic())
+            return lookup
+
+    def translate(self, lang: str, key: str) -> str:
+        """Translate a single key, falling back to the key itself"""
+        return self.get(lang).get(key, key)
+
+    def translate_many(self, lang: str, keys: Iterable[str]) -> Dict[str, str]:
+        """Translate a batch of keys with a single catalog lookup"""
+        lookup = self.get(lang)
+        return {key: lookup.get(key, key) for key in keys}
+
+
+catalog = TranslationCatalog(auto_reload=os.getenv('TRANSLATIONS_RELOAD', '0') == '1')
+
 
 def load_translations(lang):
     """Load translations for the specified language."""
-    try:
-        with open(Path('translations') / f'{lang}.json', 'r', encoding='utf-8') as f:
-            return json.load(f)
-    except:
-        return {} 
\ No newline at end of file
+    return catalog.get(lang)
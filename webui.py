@@ -1,6 +1,12 @@
-from flask import Flask, render_template, request, redirect, url_for, session, jsonify
+from flask import Flask, render_template, request, redirect, url_for, session, jsonify, g
+from flask.sessions import SecureCookieSession, SessionInterface, session_json_serializer
 import random
 import math
+import secrets
+import sqlite3
+import threading
+import time
+from pathlib import Path
 from dnd_spells import spells_1lvl, spells_2lvl, basic_attacks
 from gemini import Gemini
 from dotenv import load_dotenv
@@ -9,13 +15,171 @@ from config import BATTLEFIELD, PLAYER, ENEMIES, GAME_RULES  # Import our new co
 from battlefield_configs import BATTLEFIELD_CONFIGS
 from character_config import CLASS_CONFIGS
 import copy
+from serialization import FastJSONProvider
+from sqlite_room_manager import RoomFileLock
+from logging_setup import setup_logging
+import logging
+
+logger = logging.getLogger(__name__)
+setup_logging()
 
 app = Flask(__name__)
+app.json = FastJSONProvider(app)
 app.secret_key = 'secret-key-for-session'
 
 # Load environment variables
 load_dotenv()
 
+# Battles idle this long are forgotten
+BATTLE_SESSION_IDLE_SECONDS = int(os.getenv('BATTLE_SESSION_IDLE_SECONDS', 6 * 3600))
+# Where battles are kept, shared by all worker processes and kept across restarts
+BATTLE_DB_PATH = os.getenv('BATTLE_DB_PATH', 'saves/battles.db')
+
+BATTLE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS battles (
+    sid TEXT PRIMARY KEY,
+    data TEXT NOT NULL,
+    last_seen REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_battles_last_seen ON battles(last_seen);
+"""
+
+class BattleSession(SecureCookieSession):
+    def __init__(self, sid, initial=None, stored=False):
+        super().__init__(initial)
+        self.sid = sid
+        # Whether the battle has a row in the database yet
+        self.stored = stored
+
+class BattleSessionInterface(SessionInterface):
+    """Keeps sessions in a SQLite database; the cookie only carries a random session id.
+
+    Battle requests then no longer send the whole battle back and forth, and
+    the battle socket (battle_socket.py) works on the same session as HTTP.
+    Battles survive restarts and any worker process can serve them. Only a
+    request that changed the battle writes it back, so pages that merely read
+    it cannot overwrite a battle API request that ran meanwhile.
+    """
+
+    def __init__(self, db_path=BATTLE_DB_PATH, idle_seconds=BATTLE_SESSION_IDLE_SECONDS):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.lock_folder = self.db_path.parent / "battle_locks"
+        self.lock_folder.mkdir(exist_ok=True)
+        self.idle_seconds = idle_seconds
+        self._local = threading.local()
+        self._locks = {}
+        self._locks_guard = threading.Lock()
+        self._next_prune = 0
+        self._connection().executescript(BATTLE_SCHEMA)
+
+    def _connection(self):
+        """Get this thread's connection, opening it on first use"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=30000")
+            self._local.conn = conn
+        return conn
+
+    def lookup(self, sid):
+        """The stored session with this id, or None"""
+        self._prune()
+        if not sid:
+            return None
+        row = self._connection().execute("SELECT data FROM battles WHERE sid = ?", (sid,)).fetchone()
+        if row is None:
+            return None
+        return BattleSession(sid, session_json_serializer.loads(row[0]), stored=True)
+
+    def lock(self, sid):
+        """The lock serializing battle API requests on one battle, across threads and processes"""
+        with self._locks_guard:
+            lock = self._locks.get(sid)
+            if lock is None:
+                lock = self._locks[sid] = RoomFileLock(self.lock_folder / f"{sid}.lock")
+            return lock
+
+    def reload(self, session):
+        """Replace the session's data with the stored battle, once its lock is held"""
+        stored = self.lookup(session.sid) if session.stored else None
+        if stored is not None:
+            session.clear()
+            session.update(stored)
+            session.modified = False
+
+    def _prune(self):
+        now = time.time()
+        if now < self._next_prune:
+            return
+        self._next_prune = now + 60
+        conn = self._connection()
+        cutoff = now - self.idle_seconds
+        stale = [sid for (sid,) in conn.execute("SELECT sid FROM battles WHERE last_seen < ?", (cutoff,))]
+        conn.execute("DELETE FROM battles WHERE last_seen < ?", (cutoff,))
+        for sid in stale:
+            with self._locks_guard:
+                self._locks.pop(sid, None)
+            # Only a holder may remove a lock file, see RoomFileLock
+            lock = RoomFileLock(self.lock_folder / f"{sid}.lock")
+            if lock.acquire(blocking=False):
+                try:
+                    lock.path.unlink(missing_ok=True)
+                finally:
+                    lock.release()
+
+    def open_session(self, app, request):
+        if request.path.startswith(f"{app.static_url_path}/"):
+            # Static files never look at the battle
+            return self.make_null_session(app)
+        return self.lookup(request.cookies.get(self.get_cookie_name(app))) or BattleSession(secrets.token_urlsafe(24))
+
+    def save_session(self, app, session, response):
+        if self.is_null_session(session):
+            return
+        conn = self._connection()
+        if not session:
+            if session.stored:
+                conn.execute("DELETE FROM battles WHERE sid = ?", (session.sid,))
+            return
+        if session.modified or not session.stored:
+            conn.execute("INSERT OR REPLACE INTO battles (sid, data, last_seen) VALUES (?, ?, ?)",
+                         (session.sid, session_json_serializer.dumps(dict(session)), time.time()))
+        else:
+            conn.execute("UPDATE battles SET last_seen = ? WHERE sid = ?", (time.time(), session.sid))
+        if not session.stored:
+            response.set_cookie(self.get_cookie_name(app), session.sid,
+                                expires=self.get_expiration_time(app, session),
+                                httponly=self.get_cookie_httponly(app),
+                                domain=self.get_cookie_domain(app),
+                                path=self.get_cookie_path(app),
+                                secure=self.get_cookie_secure(app),
+                                samesite=self.get_cookie_samesite(app))
+
+app.session_interface = BattleSessionInterface()
+
+# Endpoints that read and change the battle; one runs at a time per battle
+BATTLE_API_ENDPOINTS = {'api_attack', 'api_enemy_attack', 'api_cast_spell', 'api_end_turn', 'api_turn'}
+
+@app.before_request
+def hold_battle():
+    """Run one battle API request at a time per battle, so HTTP and socket actions cannot interleave"""
+    if request.endpoint not in BATTLE_API_ENDPOINTS or not session.stored:
+        return
+    lock = app.session_interface.lock(session.sid)
+    lock.acquire()
+    g.battle_lock = lock
+    # The session was read before the lock was ours; pick up what the previous holder wrote
+    app.session_interface.reload(session._get_current_object())
+
+@app.teardown_request
+def release_battle(exc=None):
+    lock = g.pop('battle_lock', None)
+    if lock is not None:
+        lock.release()
+
 # Initialize Gemini AI with updated enemy configuration
 gemini = Gemini(
     API_KEY=os.getenv('GEMINI_API_KEY'),
@@ -198,6 +362,61 @@ def roll_dice():
     result = random.randint(1, sides)
     return jsonify({"result": result})
 
+def resolve_attack(character, enemy, attack_type):
+    """The player's weapon attack. Updates the dicts in place"""
+    if character.get('attacked_this_turn'):
+        return {"error": "You've already attacked this turn"}
+    attack_cost = GAME_RULES['combat']['attack_cost']
+    if character['movement_left'] < attack_cost:
+        return {"error": f"Not enough speed! Need {attack_cost}, but have {character['movement_left']}"}
+    
+    # Get the attack configuration
+    attack_config = None
+    
+    # Try different approaches to find the attack config
+    if attack_type in character.get('abilities', {}):
+        attack_config = character['abilities'][attack_type]
+        logger.debug("Found attack in character abilities: %s", attack_config)
+    elif attack_type in PLAYER['abilities']:
+        attack_config = PLAYER['abilities'][attack_type]
+        logger.debug("Found attack in PLAYER abilities: %s", attack_config)
+    else:
+        # Fallback to basic melee attack
+        attack_config = {
+            "name": "Melee Attack",
+            "damage": "1d6",
+            "range": 1,
+            "description": "Basic melee attack"
+        }
+        logger.debug("Using fallback attack: %s", attack_config)
+    
+    # Auto-roll attack
+    roll = random.randint(1, 20)
+    if roll >= 10:  # TODO: Use proper AC calculation
+        try:
+            dice_count, dice_sides = map(int, attack_config['damage'].split('d'))
+            damage = sum(random.randint(1, dice_sides) for _ in range(dice_count))
+        except Exception as e:
+            logger.error("Error calculating damage: %s", e)
+            damage = random.randint(1, 6)  # Fallback damage
+        
+        enemy['hp'] -= damage
+        combat_log = f"You used {attack_config['name']} and dealt {damage} damage."
+    else:
+        combat_log = f"Your {attack_config['name']} missed!"
+    
+    # Deduct speed cost
+    character['movement_left'] -= attack_cost
+    character['attacked_this_turn'] = True
+    
+    return {
+        "combat_log": combat_log,
+        "character_hp": character['hp'],
+        "enemy_hp": enemy['hp'],
+        "enemy_defeated": enemy['hp'] <= 0,
+        "movement_left": character['movement_left']
+    }
+
 # Update attack endpoint to use manual dice rolls
 @app.route("/api/attack", methods=["POST"])
 def api_attack():
@@ -210,315 +429,251 @@ def api_attack():
         
         # Get attack type from request
         attack_type = request.form.get("attack_type", "melee_attack")
-        print(f"Received attack_type: {attack_type}")  # Debugging
-        
-        # Get the attack configuration
-        attack_config = None
-        
-        # Try different approaches to find the attack config
-        if attack_type in character.get('abilities', {}):
-            attack_config = character['abilities'][attack_type]
-            print(f"Found attack in character abilities: {attack_config}")
-        elif attack_type in PLAYER['abilities']:
-            attack_config = PLAYER['abilities'][attack_type]
-            print(f"Found attack in PLAYER abilities: {attack_config}")
-        else:
-            # Fallback to basic melee attack
-            attack_config = {
-                "name": "Melee Attack",
-                "damage": "1d6",
-                "range": 1,
-                "description": "Basic melee attack"
-            }
-            print(f"Using fallback attack: {attack_config}")
-        
-        # Auto-roll attack
-        roll = random.randint(1, 20)
-        if roll >= 10:  # TODO: Use proper AC calculation
-            try:
-                dice_count, dice_sides = map(int, attack_config['damage'].split('d'))
-                damage = sum(random.randint(1, dice_sides) for _ in range(dice_count))
-            except Exception as e:
-                print(f"Error calculating damage: {e}")
-                damage = random.randint(1, 6)  # Fallback damage
-            
-            enemy['hp'] -= damage
-            combat_log = f"You used {attack_config['name']} and dealt {damage} damage."
-        else:
-            combat_log = f"Your {attack_config['name']} missed!"
-        
-        # Deduct speed cost
-        attack_cost = GAME_RULES['combat']['attack_cost']
-        character['movement_left'] -= attack_cost
+        logger.debug("Received attack_type: %s", attack_type)
+        result = resolve_attack(character, enemy, attack_type)
         
         session['character'] = character
         session['enemy'] = enemy
         session.modified = True
         
-        return jsonify({
-            "combat_log": combat_log,
-            "character_hp": character['hp'],
-            "enemy_hp": enemy['hp'],
-            "enemy_defeated": enemy['hp'] <= 0,
-            "movement_left": character['movement_left']
-        })
+        return jsonify(result)
         
     except Exception as e:
-        print(f"Attack error: {e}")
+        logger.error("Attack error: %s", e, exc_info=True)
         return jsonify({"error": f"Attack failed: {str(e)}"})
 
 # Обновляем функцию api_enemy_attack, добавляем обработку новых эффектов
-@app.route("/api/enemy_attack", methods=["POST"])
-def api_enemy_attack():
-    try:
-        print("DEBUG: Starting enemy turn, effects:", session.get('effects', {'enemy': {}, 'player': {}}).get('enemy', {}))
+def resolve_enemy_turn(character, enemy, effects):
+    """The enemy's turn: effect ticks, then its move and attack. Updates the dicts in place"""
+    logger.debug("Starting enemy turn, effects: %s", effects.get('enemy', {}))
+    enemy_effects = effects.get('enemy', {})
+    
+    # Добавляем отладку для проверки состояния эффектов
+    logger.debug("Enemy effects at start: %s", enemy_effects)
+    
+    combat_log = ""
+    
+    # Обработка эффектов урона с течением времени (DOT)
+
+    # Проверяем эффект горения
+    if 'burning' in enemy_effects:
+        logger.debug("Обрабатываем эффект горения")
+        burning_effect = enemy_effects['burning']
+        burning_effect['duration'] -= 1
         
-        character = session.get('character', {})
-        enemy = session.get('enemy', {})
-        effects = session.get('effects', {'enemy': {}, 'player': {}})
-        enemy_effects = effects.get('enemy', {})
+        # Наносим ФИКСИРОВАННЫЙ урон от горения (2 единицы) вместо случайного
+        burn_damage = 2  # Фиксированный урон вместо random.randint(1, 4)
+        enemy['hp'] -= burn_damage
+        combat_log += f"Враг получает {burn_damage} урона от горения! "
         
-        # Добавляем отладку для проверки состояния эффектов
-        print(f"DEBUG: Enemy effects at start: {enemy_effects}")
+        if burning_effect['duration'] <= 0:
+            combat_log += "Пламя погасло. "
+            del enemy_effects['burning']
+            logger.debug("Эффект горения закончился")
+        else:
+            logger.debug("Осталось %s ходов горения", burning_effect['duration'])
+
+    # Проверяем эффект кровотечения
+    if 'bleeding' in enemy_effects:
+        logger.debug("Обрабатываем эффект кровотечения")
+        bleeding_effect = enemy_effects['bleeding']
+        bleeding_effect['duration'] -= 1
         
-        combat_log = ""
+        # Наносим ФИКСИРОВАННЫЙ урон от кровотечения
+        bleed_damage = 1  # Фиксированный урон вместо random.randint(1, 3)
+        enemy['hp'] -= bleed_damage
+        combat_log += f"Враг теряет {bleed_damage} здоровья от кровотечения! "
         
-        # Обработка эффектов урона с течением времени (DOT)
+        if bleeding_effect['duration'] <= 0:
+            combat_log += "Кровотечение остановилось. "
+            del enemy_effects['bleeding']
+            logger.debug("Эффект кровотечения закончился")
+        else:
+            logger.debug("Осталось %s ходов кровотечения", bleeding_effect['duration'])
 
-        # Проверяем эффект горения
-        if 'burning' in enemy_effects:
-            print("DEBUG: Обрабатываем эффект горения")
-            burning_effect = enemy_effects['burning']
-            burning_effect['duration'] -= 1
-            
-            # Наносим ФИКСИРОВАННЫЙ урон от горения (2 единицы) вместо случайного
-            burn_damage = 2  # Фиксированный урон вместо random.randint(1, 4)
-            enemy['hp'] -= burn_damage
-            combat_log += f"Враг получает {burn_damage} урона от горения! "
+    # Проверяем, не умер ли враг от эффектов
+    if enemy['hp'] <= 0:
+        combat_log += "Враг повержен! "
+        
+        return {
+            "combat_log": combat_log,
+            "character_hp": character['hp'],
+            "enemy_hp": 0,
+            "enemy_pos": enemy['pos'],
+            "enemy_defeated": True
+        }
+    
+    # Проверяем наличие эффекта паралича
+    if 'paralyze' in enemy_effects:
+        logger.debug("Обрабатываем эффект паралича")
+        paralyze_effect = enemy_effects['paralyze']
+        paralyze_effect['duration'] -= 1
+        
+        # Проверяем, не закончился ли эффект
+        if paralyze_effect['duration'] <= 0:
+            del enemy_effects['paralyze']
+            combat_log += "Враг освободился от эффекта паралича! "
+        else:
+            combat_log += f"Враг парализован и не может действовать! (Осталось ходов: {paralyze_effect['duration']}) "
             
-            if burning_effect['duration'] <= 0:
-                combat_log += "Пламя погасло. "
-                del enemy_effects['burning']
-                print("DEBUG: Эффект горения закончился")
-            else:
-                print(f"DEBUG: Осталось {burning_effect['duration']} ходов горения")
+            logger.debug("Враг парализован, пропускаем ход")
+            return {
+                "combat_log": combat_log,
+                "character_hp": character['hp'],
+                "enemy_hp": enemy['hp'],
+                "enemy_pos": enemy['pos'],
+                "enemy_status": "paralyzed"  # Добавляем статус для клиента
+            }
 
-        # Проверяем эффект кровотечения
-        if 'bleeding' in enemy_effects:
-            print("DEBUG: Обрабатываем эффект кровотечения")
-            bleeding_effect = enemy_effects['bleeding']
-            bleeding_effect['duration'] -= 1
+    # Проверяем наличие эффекта испуга
+    elif 'fear' in enemy_effects:
+        logger.debug("Обрабатываем эффект испуга")
+        fear_effect = enemy_effects['fear']
+        fear_effect['duration'] -= 1
+        
+        if fear_effect['duration'] <= 0:
+            combat_log += "Враг преодолел свой страх! "
+            del enemy_effects['fear']
+        else:
+            combat_log += "Враг в панике атакует сам себя! "
             
-            # Наносим ФИКСИРОВАННЫЙ урон от кровотечения
-            bleed_damage = 1  # Фиксированный урон вместо random.randint(1, 3)
-            enemy['hp'] -= bleed_damage
-            combat_log += f"Враг теряет {bleed_damage} здоровья от кровотечения! "
+            # Враг атакует сам себя своей базовой атакой
+            enemy_type = enemy.get('name', 'goblin').lower()
+            basic_attack = list(ENEMIES[enemy_type]['abilities'].values())[0]
             
-            if bleeding_effect['duration'] <= 0:
-                combat_log += "Кровотечение остановилось. "
-                del enemy_effects['bleeding']
-                print("DEBUG: Эффект кровотечения закончился")
+            # Бросок атаки
+            roll = random.randint(1, 20)
+            if roll >= 10:  # Упрощенный порог попадания
+                # Наносим урон
+                dice_parts = basic_attack['damage'].split('d')
+                dice_count = int(dice_parts[0])
+                dice_size = int(dice_parts[1])
+                damage = sum(random.randint(1, dice_size) for _ in range(dice_count))
+                
+                enemy['hp'] -= damage
+                combat_log += f"Враг наносит себе {damage} урона! "
             else:
-                print(f"DEBUG: Осталось {bleeding_effect['duration']} ходов кровотечения")
-
-        # Проверяем, не умер ли враг от эффектов
-        if enemy['hp'] <= 0:
-            combat_log += "Враг повержен! "
-            session['character'] = character
-            session['enemy'] = enemy
-            session['effects'] = effects
-            session.modified = True
+                combat_log += "Но промахивается! "
             
-            return jsonify({
+            return {
                 "combat_log": combat_log,
                 "character_hp": character['hp'],
-                "enemy_hp": 0,
+                "enemy_hp": enemy['hp'],
+                "enemy_pos": enemy['pos']
+            }
+    
+    # Проверяем наличие эффекта заморозки
+    elif 'frozen' in enemy_effects:
+        logger.debug("Обрабатываем эффект заморозки")
+        frozen_effect = enemy_effects['frozen']
+        frozen_effect['duration'] -= 1
+        
+        if frozen_effect['duration'] <= 0:
+            combat_log += "Враг оттаивает! "
+            del enemy_effects['frozen']
+        else:
+            combat_log += "Враг заморожен и не может двигаться или атаковать! "
+            
+            logger.debug("Враг заморожен, пропускаем ход полностью")
+            return {
+                "combat_log": combat_log,
+                "character_hp": character['hp'],
+                "enemy_hp": enemy['hp'],
                 "enemy_pos": enemy['pos'],
-                "enemy_defeated": True
-            })
-        
-        # Проверяем наличие эффекта паралича
-        if 'paralyze' in enemy_effects:
-            print("DEBUG: Обрабатываем эффект паралича")
-            paralyze_effect = enemy_effects['paralyze']
-            paralyze_effect['duration'] -= 1
+                "enemy_status": "frozen"  # Добавляем статус для клиента
+            }
+    
+    # Если код дошел до этого места, значит враг не парализован и не испуган
+    logger.debug("Враг не парализован и не испуган, выполняем его ход")
+    
+    # Используем упрощенный подход к тактике ИИ
+    player_pos = character['pos']
+    enemy_pos = enemy['pos']
+    
+    # Сохраняем начальную позицию для проверки
+    initial_pos = copy.deepcopy(enemy_pos)
+    
+    # Проверяем, есть ли атака в диапазоне
+    attack_in_range = False
+    best_attack = None
+    
+    # Получаем доступные атаки
+    available_attacks = ENEMIES[enemy.get('name', 'goblin').lower()]['abilities']
+    
+    for attack_name, attack in available_attacks.items():
+        if attack['range'] >= math.sqrt((player_pos['col'] - enemy_pos['col'])**2 + 
+                                       (player_pos['row'] - enemy_pos['row'])**2):
+            attack_in_range = True
+            best_attack = attack
+            break
+    
+    # Если игрок не в диапазоне атаки - двигаемся к нему
+    if not attack_in_range:
+        # Простое движение - уменьшаем разницу в координатах
+        if player_pos['col'] > enemy_pos['col']:
+            enemy_pos['col'] += 1
+        elif player_pos['col'] < enemy_pos['col']:
+            enemy_pos['col'] -= 1
             
-            # Проверяем, не закончился ли эффект
-            if paralyze_effect['duration'] <= 0:
-                del enemy_effects['paralyze']
-                combat_log += "Враг освободился от эффекта паралича! "
-            else:
-                combat_log += f"Враг парализован и не может действовать! (Осталось ходов: {paralyze_effect['duration']}) "
-                
-                # Сохраняем изменения и завершаем - враг пропускает ход
-                session['character'] = character
-                session['enemy'] = enemy
-                session['effects'] = effects
-                session.modified = True
-                
-                print("DEBUG: Враг парализован, пропускаем ход")
-                return jsonify({
-                    "combat_log": combat_log,
-                    "character_hp": character['hp'],
-                    "enemy_hp": enemy['hp'],
-                    "enemy_pos": enemy['pos'],
-                    "enemy_status": "paralyzed"  # Добавляем статус для клиента
-                })
-
-        # Проверяем наличие эффекта испуга
-        elif 'fear' in enemy_effects:
-            print("DEBUG: Обрабатываем эффект испуга")
-            fear_effect = enemy_effects['fear']
-            fear_effect['duration'] -= 1
+        if player_pos['row'] > enemy_pos['row']:
+            enemy_pos['row'] += 1
+        elif player_pos['row'] < enemy_pos['row']:
+            enemy_pos['row'] -= 1
             
-            if fear_effect['duration'] <= 0:
-                combat_log += "Враг преодолел свой страх! "
-                del enemy_effects['fear']
-            else:
-                combat_log += "Враг в панике атакует сам себя! "
-                
-                # Враг атакует сам себя своей базовой атакой
-                enemy_type = enemy.get('name', 'goblin').lower()
-                basic_attack = list(ENEMIES[enemy_type]['abilities'].values())[0]
-                
-                # Бросок атаки
-                roll = random.randint(1, 20)
-                if roll >= 10:  # Упрощенный порог попадания
-                    # Наносим урон
-                    dice_parts = basic_attack['damage'].split('d')
-                    dice_count = int(dice_parts[0])
-                    dice_size = int(dice_parts[1])
-                    damage = sum(random.randint(1, dice_size) for _ in range(dice_count))
-                    
-                    enemy['hp'] -= damage
-                    combat_log += f"Враг наносит себе {damage} урона! "
-                else:
-                    combat_log += "Но промахивается! "
-                
-                # Сохраняем изменения
-                session['character'] = character
-                session['enemy'] = enemy
-                session['effects'] = effects
-                session.modified = True
-                
-                return jsonify({
-                    "combat_log": combat_log,
-                    "character_hp": character['hp'],
-                    "enemy_hp": enemy['hp'],
-                    "enemy_pos": enemy['pos']
-                })
-        
-        # Проверяем наличие эффекта заморозки
-        elif 'frozen' in enemy_effects:
-            print("DEBUG: Обрабатываем эффект заморозки")
-            frozen_effect = enemy_effects['frozen']
-            frozen_effect['duration'] -= 1
-            
-            if frozen_effect['duration'] <= 0:
-                combat_log += "Враг оттаивает! "
-                del enemy_effects['frozen']
-            else:
-                combat_log += "Враг заморожен и не может двигаться или атаковать! "
-                
-                # Сохраняем изменения и завершаем ход
-                session['character'] = character
-                session['enemy'] = enemy
-                session['effects'] = effects
-                session.modified = True
-                
-                print("DEBUG: Враг заморожен, пропускаем ход полностью")
-                return jsonify({
-                    "combat_log": combat_log,
-                    "character_hp": character['hp'],
-                    "enemy_hp": enemy['hp'],
-                    "enemy_pos": enemy['pos'],
-                    "enemy_status": "frozen"  # Добавляем статус для клиента
-                })
-        
-        # Если код дошел до этого места, значит враг не парализован и не испуган
-        print("DEBUG: Враг не парализован и не испуган, выполняем его ход")
+        combat_log += "Enemy moves closer to attack! "
         
-        # Используем упрощенный подход к тактике ИИ
-        player_pos = character['pos']
-        enemy_pos = enemy['pos']
-        
-        # Сохраняем начальную позицию для проверки
-        initial_pos = copy.deepcopy(enemy_pos)
-        
-        # Проверяем, есть ли атака в диапазоне
-        attack_in_range = False
-        best_attack = None
-        
-        # Получаем доступные атаки
-        available_attacks = ENEMIES[enemy.get('name', 'goblin').lower()]['abilities']
+        # Проверяем, не стал ли игрок доступен для атаки после перемещения
+        distance = math.sqrt((player_pos['col'] - enemy_pos['col'])**2 + 
+                           (player_pos['row'] - enemy_pos['row'])**2)
         
+        # Проверяем атаки снова
         for attack_name, attack in available_attacks.items():
-            if attack['range'] >= math.sqrt((player_pos['col'] - enemy_pos['col'])**2 + 
-                                           (player_pos['row'] - enemy_pos['row'])**2):
+            if attack['range'] >= distance:
                 attack_in_range = True
                 best_attack = attack
                 break
-        
-        # Если игрок не в диапазоне атаки - двигаемся к нему
-        if not attack_in_range:
-            # Простое движение - уменьшаем разницу в координатах
-            if player_pos['col'] > enemy_pos['col']:
-                enemy_pos['col'] += 1
-            elif player_pos['col'] < enemy_pos['col']:
-                enemy_pos['col'] -= 1
-                
-            if player_pos['row'] > enemy_pos['row']:
-                enemy_pos['row'] += 1
-            elif player_pos['row'] < enemy_pos['row']:
-                enemy_pos['row'] -= 1
-                
-            combat_log += "Enemy moves closer to attack! "
-            
-            # Проверяем, не стал ли игрок доступен для атаки после перемещения
-            distance = math.sqrt((player_pos['col'] - enemy_pos['col'])**2 + 
-                               (player_pos['row'] - enemy_pos['row'])**2)
-            
-            # Проверяем атаки снова
-            for attack_name, attack in available_attacks.items():
-                if attack['range'] >= distance:
-                    attack_in_range = True
-                    best_attack = attack
-                    break
-        
-        # Если игрок в диапазоне атаки - атакуем
-        if attack_in_range and best_attack:
-            # Атака
-            roll = random.randint(1, 20)
-            if roll >= 10:  # TODO: Использовать правильный расчет AC
-                dice_count, dice_sides = map(int, best_attack['damage'].split('d'))
-                damage = sum(random.randint(1, dice_sides) for _ in range(dice_count))
-                character['hp'] -= damage
-                combat_log += f"Enemy uses {best_attack['name']} and deals {damage} damage! "
-            else:
-                combat_log += f"Enemy's {best_attack['name']} missed! "
-        
-        # Проверяем, изменилась ли позиция врага
-        if enemy_pos != initial_pos:
-            print(f"DEBUG: Враг переместился с {initial_pos} на {enemy_pos}")
+    
+    # Если игрок в диапазоне атаки - атакуем
+    if attack_in_range and best_attack:
+        # Атака
+        roll = random.randint(1, 20)
+        if roll >= 10:  # TODO: Использовать правильный расчет AC
+            dice_count, dice_sides = map(int, best_attack['damage'].split('d'))
+            damage = sum(random.randint(1, dice_sides) for _ in range(dice_count))
+            character['hp'] -= damage
+            combat_log += f"Enemy uses {best_attack['name']} and deals {damage} damage! "
         else:
-            print("DEBUG: Враг не двигался")
-        
-        # Сохраняем изменения
+            combat_log += f"Enemy's {best_attack['name']} missed! "
+    
+    # Проверяем, изменилась ли позиция врага
+    if enemy_pos != initial_pos:
+        logger.debug("Враг переместился с %s на %s", initial_pos, enemy_pos)
+    else:
+        logger.debug("Враг не двигался")
+    
+    return {
+        "combat_log": combat_log,
+        "character_hp": character['hp'],
+        "enemy_hp": enemy['hp'],
+        "enemy_pos": enemy['pos'],
+        "enemy_status": "frozen" if 'frozen' in enemy_effects else None
+    }
+
+@app.route("/api/enemy_attack", methods=["POST"])
+def api_enemy_attack():
+    try:
+        character = session.get('character', {})
+        enemy = session.get('enemy', {})
+        effects = session.get('effects', {'enemy': {}, 'player': {}})
+        result = resolve_enemy_turn(character, enemy, effects)
         session['character'] = character
         session['enemy'] = enemy
         session['effects'] = effects
         session.modified = True
-        
-        return jsonify({
-            "combat_log": combat_log,
-            "character_hp": character['hp'],
-            "enemy_hp": enemy['hp'],
-            "enemy_pos": enemy['pos'],
-            "enemy_status": "frozen" if 'frozen' in enemy_effects else None
-        })
+        return jsonify(result)
         
     except Exception as e:
-        print(f"Ошибка в атаке противника: {e}")
+        logger.error("Ошибка в атаке противника: %s", e, exc_info=True)
         # В случае ошибки возвращаем последние известные значения
         return jsonify({
             "error": f"Enemy attack error: {str(e)}",
@@ -593,191 +748,206 @@ def get_hex_neighbors(col, row):
     
     return neighbors
 
-@app.route("/api/cast_spell", methods=["POST"])
-def api_cast_spell():
-    try:
-        data = request.get_json()
-        spell_name = data.get('spell_name')
-        target = data.get('target')
+def resolve_spell(character, enemy, effects, spell_name, target):
+    """The player's spell or basic attack from the spell list. Updates the dicts in place"""
+    if character.get('attacked_this_turn'):
+        return {"error": "You've already attacked this turn"}
+    result = cast_spell(character, enemy, effects, spell_name, target)
+    if not result.get('error'):
+        character['attacked_this_turn'] = True
+    return result
+
+def cast_spell(character, enemy, effects, spell_name, target):
+    """Resolve a spell without the once-per-turn check"""
+    combat_log = f"{character.get('name', 'Character')} "
+    
+    # Специальная обработка для Melee Attack
+    if spell_name == "Melee Attack":
+        damage = apply_spell_damage(spell_name, basic_attacks)
+        enemy['hp'] -= damage
+        combat_log += f"performs melee attack for {damage} damage! "
         
-        character = session.get('character', {})
-        enemy = session.get('enemy', {})
-        effects = session.get('effects', {'enemy': {}, 'player': {}})
+        return {
+            "combat_log": combat_log,
+            "character_hp": character['hp'],
+            "enemy_hp": enemy['hp'],
+            "enemy_defeated": enemy['hp'] <= 0,
+            "spell_slots": character['spell_slots']
+        }
+
+    # Определяем уровень заклинания для всех остальных заклинаний
+    spell_level = None
+    spell_range = 0
+    
+    if spell_name in spells_1lvl:
+        spell_level = '1'
+        spell_range = spells_1lvl[spell_name].get('range', 0)
+    elif spell_name in spells_2lvl:
+        spell_level = '2'
+        spell_range = spells_2lvl[spell_name].get('range', 0)
+    
+    # Проверяем наличие ячеек нужного уровня
+    if spell_level and character['spell_slots'].get(spell_level, 0) <= 0:
+        return {"error": f"No {spell_level}-level spell slots remaining!"}
+    
+    # Проверяем слоты только для настоящих заклинаний
+    if spell_name in basic_attacks:
+        is_spell = False
+    else:
+        is_spell = True
+        if character['spell_slots']['1'] <= 0 and character['spell_slots']['2'] <= 0:
+            return {"error": "No spell slots remaining!"}
+
+    # Проверяем, находится ли противник в радиусе действия заклинания
+    # За исключением заклинаний с самонаведением или тех, что не требуют проверки расстояния
+    distance_check_required = True
+    
+    # Список заклинаний, которые не требуют проверки расстояния (самолечение и т.д.)
+    distance_exceptions = ["Healing Word", "Misty Step"]
+    
+    if spell_name in distance_exceptions:
+        distance_check_required = False
+    
+    if distance_check_required:
+        # Сохраняем старое расстояние для сравнения
+        old_method = math.sqrt((character['pos']['col'] - enemy['pos']['col'])**2 + 
+                              (character['pos']['row'] - enemy['pos']['row'])**2)
+        # Новый метод
+        distance = get_distance(character['pos'], enemy['pos'])
         
-        combat_log = f"{character.get('name', 'Character')} "
+        logger.debug("Spell: %s, Range: %s", spell_name, spell_range)
+        logger.debug("Player at %s, Enemy at %s", character['pos'], enemy['pos'])
+        logger.debug("New distance calc: %s, Old Euclidean/2: %s", distance, old_method / 2)
         
-        # Специальная обработка для Melee Attack
-        if spell_name == "Melee Attack":
-            damage = apply_spell_damage(spell_name, basic_attacks)
-            enemy['hp'] -= damage
-            combat_log += f"performs melee attack for {damage} damage! "
+        if distance > spell_range:
+            # Если враг вне радиуса действия, регистрируем промах
+            # Все равно расходуем слот заклинания
+            if spell_level:
+                character['spell_slots'][spell_level] -= 1
             
-            session['character'] = character
-            session['enemy'] = enemy
-            return jsonify({
+            combat_log += f"пытается применить {spell_name}, но противник вне радиуса действия ({math.ceil(distance)} > {spell_range})."
+            
+            return {
                 "combat_log": combat_log,
                 "character_hp": character['hp'],
                 "enemy_hp": enemy['hp'],
-                "enemy_defeated": enemy['hp'] <= 0,
-                "spell_slots": character['spell_slots']
-            })
-
-        # Определяем уровень заклинания для всех остальных заклинаний
-        spell_level = None
-        spell_range = 0
-        
-        if spell_name in spells_1lvl:
-            spell_level = '1'
-            spell_range = spells_1lvl[spell_name].get('range', 0)
-        elif spell_name in spells_2lvl:
-            spell_level = '2'
-            spell_range = spells_2lvl[spell_name].get('range', 0)
-        
-        # Проверяем наличие ячеек нужного уровня
-        if spell_level and character['spell_slots'].get(spell_level, 0) <= 0:
-            return jsonify({"error": f"No {spell_level}-level spell slots remaining!"})
-        
-        # Проверяем слоты только для настоящих заклинаний
-        if spell_name in basic_attacks:
-            is_spell = False
-        else:
-            is_spell = True
-            if character['spell_slots']['1'] <= 0 and character['spell_slots']['2'] <= 0:
-                return jsonify({"error": "No spell slots remaining!"})
-
-        # Проверяем, находится ли противник в радиусе действия заклинания
-        # За исключением заклинаний с самонаведением или тех, что не требуют проверки расстояния
-        distance_check_required = True
-        
-        # Список заклинаний, которые не требуют проверки расстояния (самолечение и т.д.)
-        distance_exceptions = ["Healing Word", "Misty Step"]
-        
-        if spell_name in distance_exceptions:
-            distance_check_required = False
-        
-        if distance_check_required:
-            # Сохраняем старое расстояние для сравнения
-            old_method = math.sqrt((character['pos']['col'] - enemy['pos']['col'])**2 + 
-                                  (character['pos']['row'] - enemy['pos']['row'])**2)
-            # Новый метод
-            distance = get_distance(character['pos'], enemy['pos'])
-            
-            print(f"DEBUG: Spell: {spell_name}, Range: {spell_range}")
-            print(f"DEBUG: Player at {character['pos']}, Enemy at {enemy['pos']}")
-            print(f"DEBUG: New distance calc: {distance}, Old Euclidean/2: {old_method/2}")
-            
-            if distance > spell_range:
-                # Если враг вне радиуса действия, регистрируем промах
-                # Все равно расходуем слот заклинания
-                if spell_level:
-                    character['spell_slots'][spell_level] -= 1
-                
-                combat_log += f"пытается применить {spell_name}, но противник вне радиуса действия ({math.ceil(distance)} > {spell_range})."
-                
-                session['character'] = character
-                session.modified = True
-                
-                return jsonify({
-                    "combat_log": combat_log,
-                    "character_hp": character['hp'],
-                    "enemy_hp": enemy['hp'],
-                    "enemy_defeated": False,
-                    "spell_slots": character['spell_slots'],
-                    "spell_missed": True
-                })
-
-        # Специальная обработка для каждого заклинания
-        if spell_name == "Hold Person":
-            effects['enemy']['paralyze'] = {
-                'duration': 3,
-                'source': spell_name,
-                'breaks_on_damage': True
-            }
-            combat_log += "casts Hold Person and paralyzes the enemy! "
-
-        elif spell_name == "Ice Knife":
-            damage = apply_spell_damage(spell_name, spells_1lvl)
-            enemy['hp'] -= damage
-            effects['enemy']['frozen'] = {'duration': 2, 'source': spell_name}
-            combat_log += f"hits with Ice Knife for {damage} damage and freezes the enemy! "
-
-        elif spell_name == "Healing Word":
-            healing_formula = spells_1lvl[spell_name].get("healing")
-            healing = calculate_damage(healing_formula)
-            old_hp = character['hp']
-            character['hp'] = min(character['hp'] + healing, character['max_hp'])
-            actual_healing = character['hp'] - old_hp
-            combat_log += f"uses Healing Word and heals for {actual_healing} HP! "
-
-        elif spell_name == "Chromatic Orb":
-            damage = apply_spell_damage(spell_name, spells_1lvl)
-            enemy['hp'] = max(0, enemy['hp'] - damage)
-            
-            # Добавляем эффект испуга с увеличенной продолжительностью
-            effects['enemy']['fear'] = {
-                'duration': 2,
-                'source': 'Chromatic Orb'
+                "enemy_defeated": False,
+                "spell_slots": character['spell_slots'],
+                "spell_missed": True
             }
-            
-            combat_log += f"hits with Chromatic Orb for {damage} damage! The enemy is frightened!"
 
-        elif spell_name == "Magic Missile":
-            damage = apply_spell_damage(spell_name, spells_1lvl)
-            enemy['hp'] -= damage
-            combat_log += f"launches Magic Missiles for {damage} damage! "
+    # Специальная обработка для каждого заклинания
+    if spell_name == "Hold Person":
+        effects['enemy']['paralyze'] = {
+            'duration': 3,
+            'source': spell_name,
+            'breaks_on_damage': True
+        }
+        combat_log += "casts Hold Person and paralyzes the enemy! "
 
-        elif spell_name == "Burning Hands":
-            damage = apply_spell_damage(spell_name, spells_1lvl)
-            enemy['hp'] -= damage
-            
-            # Уточняем эффект горения - 3 хода по 2 урона
-            effects['enemy']['burning'] = {
-                'duration': 3, 
-                'source': spell_name,
-                'damage_per_turn': 2  # Для ясности добавляем параметр урона
-            }
-            
-            combat_log += f"burns enemy for {damage} damage and sets them on fire! "
-
-        elif spell_name == "Scorching Ray":
-            total_damage = 0
-            hits = []
-            for i in range(3):
-                if random.randint(1, 20) >= 10:  # Hit roll for each ray
-                    damage = apply_spell_damage("Scorching Ray", spells_2lvl)
-                    total_damage += damage
-                    hits.append(damage)
-            if hits:
-                enemy['hp'] -= total_damage
-                combat_log += f"hits with Scorching Ray for {total_damage} damage ({', '.join(map(str, hits))})! "
-            else:
-                combat_log += "misses with all Scorching Rays! "
+    elif spell_name == "Ice Knife":
+        damage = apply_spell_damage(spell_name, spells_1lvl)
+        enemy['hp'] -= damage
+        effects['enemy']['frozen'] = {'duration': 2, 'source': spell_name}
+        combat_log += f"hits with Ice Knife for {damage} damage and freezes the enemy! "
 
-        elif spell_name == "Dragon's Breath":
-            damage = apply_spell_damage("Dragon's Breath", spells_2lvl)
-            enemy['hp'] = max(0, enemy['hp'] - damage)
-            
-            # Добавляем эффект испуга
-            effects['enemy']['fear'] = {
-                'duration': 2,
-                'source': 'Dragon\'s Breath'
-            }
-            
-            combat_log = f"{character.get('name', 'Character')} uses Dragon's Breath for {damage} damage! The enemy is frightened!"
-
-        elif spell_name == "Cloud of Daggers":
-            damage = apply_spell_damage("Cloud of Daggers", spells_2lvl)
-            enemy['hp'] -= damage
-            effects['enemy']['bleeding'] = {
-                'duration': 3, 
-                'source': spell_name,
-                'damage_per_turn': 1
-            }
-            combat_log += f"creates Cloud of Daggers for {damage} damage and causes bleeding! "
+    elif spell_name == "Healing Word":
+        healing_formula = spells_1lvl[spell_name].get("healing")
+        healing = calculate_damage(healing_formula)
+        old_hp = character['hp']
+        character['hp'] = min(character['hp'] + healing, character['max_hp'])
+        actual_healing = character['hp'] - old_hp
+        combat_log += f"uses Healing Word and heals for {actual_healing} HP! "
+
+    elif spell_name == "Chromatic Orb":
+        damage = apply_spell_damage(spell_name, spells_1lvl)
+        enemy['hp'] = max(0, enemy['hp'] - damage)
+        
+        # Добавляем эффект испуга с увеличенной продолжительностью
+        effects['enemy']['fear'] = {
+            'duration': 2,
+            'source': 'Chromatic Orb'
+        }
+        
+        combat_log += f"hits with Chromatic Orb for {damage} damage! The enemy is frightened!"
+
+    elif spell_name == "Magic Missile":
+        damage = apply_spell_damage(spell_name, spells_1lvl)
+        enemy['hp'] -= damage
+        combat_log += f"launches Magic Missiles for {damage} damage! "
 
-        # Используем слот заклинания соответствующего уровня
-        if spell_level:
-            character['spell_slots'][spell_level] -= 1
+    elif spell_name == "Burning Hands":
+        damage = apply_spell_damage(spell_name, spells_1lvl)
+        enemy['hp'] -= damage
+        
+        # Уточняем эффект горения - 3 хода по 2 урона
+        effects['enemy']['burning'] = {
+            'duration': 3, 
+            'source': spell_name,
+            'damage_per_turn': 2  # Для ясности добавляем параметр урона
+        }
+        
+        combat_log += f"burns enemy for {damage} damage and sets them on fire! "
+
+    elif spell_name == "Scorching Ray":
+        total_damage = 0
+        hits = []
+        for i in range(3):
+            if random.randint(1, 20) >= 10:  # Hit roll for each ray
+                damage = apply_spell_damage("Scorching Ray", spells_2lvl)
+                total_damage += damage
+                hits.append(damage)
+        if hits:
+            enemy['hp'] -= total_damage
+            combat_log += f"hits with Scorching Ray for {total_damage} damage ({', '.join(map(str, hits))})! "
+        else:
+            combat_log += "misses with all Scorching Rays! "
+
+    elif spell_name == "Dragon's Breath":
+        damage = apply_spell_damage("Dragon's Breath", spells_2lvl)
+        enemy['hp'] = max(0, enemy['hp'] - damage)
+        
+        # Добавляем эффект испуга
+        effects['enemy']['fear'] = {
+            'duration': 2,
+            'source': 'Dragon\'s Breath'
+        }
+        
+        combat_log = f"{character.get('name', 'Character')} uses Dragon's Breath for {damage} damage! The enemy is frightened!"
+
+    elif spell_name == "Cloud of Daggers":
+        damage = apply_spell_damage("Cloud of Daggers", spells_2lvl)
+        enemy['hp'] -= damage
+        effects['enemy']['bleeding'] = {
+            'duration': 3, 
+            'source': spell_name,
+            'damage_per_turn': 1
+        }
+        combat_log += f"creates Cloud of Daggers for {damage} damage and causes bleeding! "
+
+    # Используем слот заклинания соответствующего уровня
+    if spell_level:
+        character['spell_slots'][spell_level] -= 1
+    
+    return {
+        "combat_log": combat_log,
+        "character_hp": character['hp'],
+        "enemy_hp": enemy['hp'],
+        "enemy_defeated": enemy['hp'] <= 0,
+        "spell_slots": character['spell_slots']
+    }
+
+@app.route("/api/cast_spell", methods=["POST"])
+def api_cast_spell():
+    try:
+        data = request.get_json()
+        spell_name = data.get('spell_name')
+        target = data.get('target')
+        
+        character = session.get('character', {})
+        enemy = session.get('enemy', {})
+        effects = session.get('effects', {'enemy': {}, 'player': {}})
+        result = resolve_spell(character, enemy, effects, spell_name, target)
         
         # Сохраняем изменения
         session['character'] = character
@@ -785,18 +955,30 @@ def api_cast_spell():
         session['effects'] = effects
         session.modified = True
         
-        return jsonify({
-            "combat_log": combat_log,
-            "character_hp": character['hp'],
-            "enemy_hp": enemy['hp'],
-            "enemy_defeated": enemy['hp'] <= 0,
-            "spell_slots": character['spell_slots']
-        })
+        return jsonify(result)
         
     except Exception as e:
-        print(f"Error in cast_spell: {e}")
+        logger.error("Error in cast_spell: %s", e, exc_info=True)
         return jsonify({"error": f"Failed to cast spell: {str(e)}"})
 
+def resolve_end_turn(character, effects):
+    """Start the player's next turn: movement comes back and the player's effects tick down"""
+    # Восстанавливаем движение персонажа
+    character['movement_left'] = character['speed']
+    character['attacked_this_turn'] = False
+    
+    # Обрабатываем эффекты, которые действуют в течение хода
+    player_effects = effects['player']
+    
+    # Уменьшаем длительность эффектов игрока
+    for effect_name in list(player_effects.keys()):
+        effect = player_effects[effect_name]
+        effect['duration'] -= 1
+        if effect['duration'] <= 0:
+            del player_effects[effect_name]
+    
+    effects['player'] = player_effects
+
 @app.route("/api/end_turn", methods=["POST"])
 def api_end_turn():
     try:
@@ -804,23 +986,10 @@ def api_end_turn():
             return jsonify({"error": "No character in session"})
             
         character = session['character']
-        
-        # Восстанавливаем движение персонажа
-        character['movement_left'] = character['speed']
-        
-        # Обрабатываем эффекты, которые действуют в течение хода
         effects = session.get('effects', {'player': {}, 'enemy': {}})
-        player_effects = effects['player']
-        
-        # Уменьшаем длительность эффектов игрока
-        for effect_name in list(player_effects.keys()):
-            effect = player_effects[effect_name]
-            effect['duration'] -= 1
-            if effect['duration'] <= 0:
-                del player_effects[effect_name]
+        resolve_end_turn(character, effects)
         
         # Сохраняем изменения
-        effects['player'] = player_effects
         session['effects'] = effects
         session['character'] = character
         session.modified = True
@@ -829,9 +998,121 @@ def api_end_turn():
         return api_enemy_attack()
         
     except Exception as e:
-        print(f"Error in end_turn: {e}")
+        logger.error("Error in end_turn: %s", e, exc_info=True)
         return jsonify({"error": f"Failed to end turn: {str(e)}"})
 
+def resolve_move(character, enemy, path, battlefield_config, terrain):
+    """Walk the player along path, a list of adjacent {col, row} cells, paying in movement"""
+    try:
+        cells = [(int(cell['col']), int(cell['row'])) for cell in path]
+    except (KeyError, TypeError, ValueError):
+        return {"error": "A move needs a path of {col, row} cells."}
+    position = (character['pos']['col'], character['pos']['row'])
+    # The battle page's paths start on the player's own cell
+    if cells and cells[0] == position:
+        cells = cells[1:]
+    if not cells:
+        return {"error": "No path selected!"}
+    
+    dimensions = battlefield_config.get('dimensions', BATTLEFIELD['dimensions'])
+    enemy_cell = (enemy['pos']['col'], enemy['pos']['row'])
+    for col, row in cells:
+        if ((col, row) not in get_neighbors(position) or (col, row) == enemy_cell
+                or not (0 <= col < dimensions['cols'] and 0 <= row < dimensions['rows'])):
+            return {"error": f"Cannot move to ({col}, {row})."}
+        position = (col, row)
+    
+    # Priced like the battle page does: base cost per hex times the terrain's multiplier
+    multiplier = BATTLEFIELD['terrain_types'].get(terrain, {}).get('movement_cost', 1)
+    cost = math.floor(len(cells) * GAME_RULES['movement']['base_cost'] * multiplier)
+    if cost > character['movement_left']:
+        return {"error": f"Not enough speed! Need {cost}, but have {character['movement_left']}"}
+    
+    character['pos'] = {'col': position[0], 'row': position[1]}
+    character['movement_left'] -= cost
+    return {"combat_log": f"Moved {len(cells)} tiles. Cost: {cost} speed. Remaining: {character['movement_left']}"}
+
+def battle_state(battle):
+    """The parts of a battle the client must agree with the server on"""
+    character = battle.get('character', {})
+    enemy = battle.get('enemy', {})
+    return {
+        'character': {key: character.get(key) for key in ('hp', 'max_hp', 'movement_left', 'pos', 'spell_slots',
+                                                          'attacked_this_turn')},
+        'enemy': {key: enemy.get(key) for key in ('hp', 'max_hp', 'pos')},
+        'effects': battle.get('effects', {}),
+    }
+
+# A turn is a few moves, at most one attack or spell, and the end of the turn
+MAX_TURN_ACTIONS = 8
+
+@app.route("/api/turn", methods=["POST"])
+def api_turn():
+    """Resolve the player's whole turn in one request.
+
+    Takes {"actions": [...]} in order: {"type": "move", "path": [...]},
+    {"type": "attack", "attack_type": ...} or {"type": "cast_spell",
+    "spell_name": ..., "target": ...}, and last {"type": "end_turn"}, which
+    ticks effects and plays the enemy's answer. If any action is refused
+    the battle is left as it was. The once-per-turn attack flag is kept in
+    the battle, so a turn sent as several requests gets one attack too;
+    hold_battle keeps other requests off the battle until the turn is saved.
+    """
+    try:
+        if 'character' not in session or 'enemy' not in session:
+            return jsonify({"error": "No battle in progress."})
+        actions = (request.get_json(silent=True) or {}).get('actions')
+        if not isinstance(actions, list) or not 0 < len(actions) <= MAX_TURN_ACTIONS:
+            return jsonify({"error": f"A turn takes a list of 1 to {MAX_TURN_ACTIONS} actions."})
+        
+        # Work on copies, so a refused action leaves the session untouched
+        character = copy.deepcopy(session['character'])
+        enemy = copy.deepcopy(session['enemy'])
+        effects = copy.deepcopy(session.get('effects', {'enemy': {}, 'player': {}}))
+        battlefield_config = session.get('battlefield_config', BATTLEFIELD_CONFIGS['forest_ambush'])
+        
+        combat_log = []
+        enemy_status = None
+        for index, action in enumerate(actions):
+            if enemy['hp'] <= 0:
+                # The fight is over; the rest of the turn does not happen
+                break
+            kind = action.get('type') if isinstance(action, dict) else None
+            if kind == 'move':
+                result = resolve_move(character, enemy, action.get('path'), battlefield_config,
+                                      session.get('current_terrain'))
+            elif kind == 'attack':
+                result = resolve_attack(character, enemy, action.get('attack_type', 'melee_attack'))
+            elif kind == 'cast_spell':
+                result = resolve_spell(character, enemy, effects, action.get('spell_name'), action.get('target'))
+            elif kind == 'end_turn' and index == len(actions) - 1:
+                resolve_end_turn(character, effects)
+                result = resolve_enemy_turn(character, enemy, effects)
+                enemy_status = result.get('enemy_status')
+            elif kind == 'end_turn':
+                result = {"error": "end_turn must be the last action of a turn."}
+            else:
+                result = {"error": f"Unknown action: {kind}"}
+            if result.get('error'):
+                return jsonify({"error": result['error'], "action_index": index})
+            combat_log.append(result.get('combat_log', ''))
+        
+        session['character'] = character
+        session['enemy'] = enemy
+        session['effects'] = effects
+        session.modified = True
+        
+        return jsonify({
+            "combat_log": combat_log,
+            "enemy_defeated": enemy['hp'] <= 0,
+            "enemy_status": enemy_status,
+            "state": battle_state(session)
+        })
+        
+    except Exception as e:
+        logger.error("Error in turn: %s", e, exc_info=True)
+        return jsonify({"error": f"Failed to resolve turn: {str(e)}"})
+
 def calculate_damage(damage_formula):
     """Рассчитывает урон на основе строковой формулы типа 'XdY+Z'"""
     try:
@@ -866,7 +1147,7 @@ def calculate_damage(damage_formula):
             # Если нет кубиков, просто возвращаем число
             return int(dice_part) + modifier
     except Exception as e:
-        print(f"Error calculating damage from formula {damage_formula}: {e}")
+        logger.error("Error calculating damage from formula %s: %s", damage_formula, e)
         return random.randint(1, 6)  # Аварийное значение
 
 if __name__ == "__main__":